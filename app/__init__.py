@@ -5,6 +5,9 @@ import os
 import logging
 from logging.handlers import RotatingFileHandler
 from app.extensions import db
+from app.utils.assets import init_assets
+from app.commands import register_commands
+from app.utils.background import start_periodic_task
 
 def create_app(config_class=Config):
     # Get the absolute path to the app directory
@@ -57,6 +60,10 @@ def create_app(config_class=Config):
     app.register_blueprint(coupon_bp, url_prefix='/coupon')
     app.register_blueprint(admin_bp, url_prefix='/backend')
     
+    # Fingerprinted static assets and CLI commands
+    init_assets(app)
+    register_commands(app)
+    
     # Root route
     @app.route('/')
     def index():
@@ -73,3 +80,39 @@ def create_app(config_class=Config):
         return render_template('errors/500.html'), 500
     
     return app
+
+def start_background_tasks(app):
+    """Start the periodic maintenance threads for a serving process
+    
+    Called per worker by the servers (gunicorn.conf.py post_fork, run.py and
+    wsgi.py when run directly), never from create_app, so CLI commands and
+    the debug reloader's parent process run no background work.
+    """
+    if not app.config['BACKGROUND_TASKS_ENABLED'] or app.testing:
+        return
+    if app.config['STOCK_HOLD_SWEEPER_ENABLED']:
+        from app.models.stock_reservation import StockReservation
+        start_periodic_task(app, 'stock-hold-sweeper', app.config['STOCK_HOLD_SWEEP_INTERVAL'],
+                            StockReservation.sweep_expired)
+    if app.config['ADMIN_STATS_REFRESH_ENABLED']:
+        from app.models.site_stats import SiteStats
+        start_periodic_task(app, 'admin-stats-refresh', app.config['ADMIN_STATS_REFRESH_INTERVAL'],
+                            SiteStats.refresh)
+    if app.config['CHECKOUT_ASYNC_ENABLED']:
+        from app.models.checkout_job import CheckoutJob
+        for worker in range(app.config['CHECKOUT_WORKERS']):
+            start_periodic_task(app, f'checkout-worker-{worker}', app.config['CHECKOUT_POLL_INTERVAL'],
+                                CheckoutJob.drain)
+    if app.config['ORDER_ARCHIVE_ENABLED']:
+        from app.models.order_archive import OrderArchive
+        start_periodic_task(app, 'order-archiver', app.config['ORDER_ARCHIVE_INTERVAL'],
+                            OrderArchive.archive_closed)
+    if app.config['OUTBOX_DISPATCH_ENABLED']:
+        from app.models.outbox import Outbox
+        start_periodic_task(app, 'outbox-dispatcher', app.config['OUTBOX_POLL_INTERVAL'], Outbox.dispatch)
+        start_periodic_task(app, 'outbox-pruner', app.config['OUTBOX_PRUNE_INTERVAL'], Outbox.prune)
+    if app.config['ANALYTICS_EXTRACT_ENABLED']:
+        from app.models.sales_analytics import SalesAnalytics
+        start_periodic_task(app, 'analytics-extract', app.config['ANALYTICS_EXTRACT_INTERVAL'],
+                            SalesAnalytics.extract)
+    
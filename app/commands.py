@@ -0,0 +1,152 @@
+import click
+from flask.cli import AppGroup
+
+assets_cli = AppGroup('assets', help='Static asset pipeline')
+
+@assets_cli.command('build')
+def build_assets_command():
+    """Fingerprint, minify and precompress static assets"""
+    from app.utils.assets import build_assets, BROTLI_AVAILABLE
+    manifest = build_assets()
+    for source, hashed in sorted(manifest.items()):
+        click.echo(f"{source} -> {hashed}")
+    if not BROTLI_AVAILABLE:
+        click.echo("brotli not installed, only gzip variants were written")
+
+inventory_cli = AppGroup('inventory', help='Stock and checkout holds')
+
+@inventory_cli.command('sweep-holds')
+@click.option('--batch-size', type=int, default=None, help='Rows deleted per statement')
+def sweep_holds_command(batch_size):
+    """Delete expired checkout stock holds"""
+    from app.models.stock_reservation import StockReservation
+    removed = StockReservation.sweep_expired(batch_size)
+    click.echo(f"Removed {removed} expired holds")
+
+coupons_cli = AppGroup('coupons', help='Coupon maintenance')
+
+@coupons_cli.command('shard')
+@click.argument('code')
+@click.option('--shards', type=int, default=8, show_default=True)
+def shard_coupon_command(code, shards):
+    """Spread a hot coupon's usage counter over several rows"""
+    from app.models.coupon import Coupon
+    coupon = Coupon.get_by_code(code)
+    if not coupon:
+        raise click.ClickException(f"Coupon {code} not found")
+    success, error = coupon.enable_sharded_counter(shards)
+    if not success:
+        raise click.ClickException(error)
+    click.echo(f"{code} now counts usage over {shards} shards")
+
+@coupons_cli.command('generate')
+@click.argument('code')
+@click.option('--count', type=int, required=True, help='Number of codes to add')
+@click.option('--length', type=int, default=None, help='Defaults to COUPON_CODE_LENGTH')
+@click.option('--output', type=click.File('w'), default=None, help='Write all unused codes to this file')
+def generate_coupon_codes_command(code, count, length, output):
+    """Generate single-use campaign codes from a template coupon"""
+    from app.models.coupon import Coupon
+    from app.models.coupon_campaign import CouponCampaign
+    coupon = Coupon.get_template(code)
+    if not coupon:
+        raise click.ClickException(f"Coupon {code} not found")
+    inserted, error = CouponCampaign.generate(coupon, count, length)
+    click.echo(f"Added {inserted} codes to {code}")
+    if output:
+        written = 0
+        for campaign_code in CouponCampaign.iter_codes(coupon.id, unused_only=True):
+            output.write(campaign_code + '\n')
+            written += 1
+        click.echo(f"Wrote {written} unused codes")
+    if error:
+        raise click.ClickException(error)
+
+orders_cli = AppGroup('orders', help='Order maintenance')
+
+@orders_cli.command('backfill-store-links')
+@click.option('--batch-size', type=int, default=1000, show_default=True)
+def backfill_store_links_command(batch_size):
+    """Populate order_items.store_id and store_orders for existing orders"""
+    from app.models.order import Order
+    processed = Order.backfill_store_links(batch_size)
+    click.echo(f"Processed {processed} orders")
+
+@orders_cli.command('archive')
+@click.option('--older-than-days', type=int, default=None,
+              help='Defaults to ORDER_ARCHIVE_AFTER_DAYS')
+@click.option('--batch-size', type=int, default=None, help='Defaults to ORDER_ARCHIVE_BATCH')
+def archive_orders_command(older_than_days, batch_size):
+    """Move old delivered/cancelled orders to the archive tables"""
+    from app.models.order_archive import OrderArchive
+    moved = OrderArchive.archive_closed(older_than_days, batch_size)
+    click.echo(f"Archived {moved} orders")
+
+stats_cli = AppGroup('stats', help='Sales statistics rollups')
+
+@stats_cli.command('rebuild-store-daily')
+@click.option('--store-id', type=int, default=None, help='Only rebuild this store')
+def rebuild_store_daily_command(store_id):
+    """Recompute store_daily_stats from order data"""
+    from app.models.store_stats import StoreDailyStats
+    rows = StoreDailyStats.rebuild(store_id)
+    click.echo(f"Rebuilt {rows} store-day rows")
+
+@stats_cli.command('verify-store-daily')
+@click.option('--store-id', type=int, default=None, help='Only verify this store')
+def verify_store_daily_command(store_id):
+    """Compare store_daily_stats with order data and report drift"""
+    from app.models.store_stats import StoreDailyStats
+    mismatches = StoreDailyStats.verify(store_id)
+    for mismatch_store_id, stat_date, field, expected, actual in mismatches:
+        click.echo(f"store {mismatch_store_id} {stat_date} {field}: expected {expected}, found {actual}")
+    if mismatches:
+        raise click.ClickException(f"{len(mismatches)} mismatched values; run 'flask stats rebuild-store-daily'")
+    click.echo("store_daily_stats is consistent")
+
+@stats_cli.command('refresh-site')
+def refresh_site_command():
+    """Recompute the admin dashboard counters"""
+    from app.models.site_stats import SiteStats
+    counters = SiteStats.reconcile()
+    if counters is None:
+        raise click.ClickException("Another process is reconciling the counters")
+    for key, value in counters.items():
+        click.echo(f"{key}: {value}")
+
+outbox_cli = AppGroup('outbox', help='Change feed maintenance')
+
+@outbox_cli.command('prune')
+@click.option('--older-than-hours', type=int, default=None, help='Defaults to OUTBOX_RETENTION')
+def prune_outbox_command(older_than_hours):
+    """Delete delivered change events"""
+    from app.models.outbox import Outbox
+    removed = Outbox.prune(older_than_hours * 3600 if older_than_hours is not None else None)
+    click.echo(f"Removed {removed} events")
+
+analytics_cli = AppGroup('analytics', help='Sales report data')
+
+@analytics_cli.command('extract')
+@click.option('--batch-size', type=int, default=None, help='Defaults to ANALYTICS_EXTRACT_BATCH')
+@click.option('--reset', is_flag=True, help='Discard extracted data and start from the first order')
+def extract_analytics_command(batch_size, reset):
+    """Copy new order lines into the sales report column files"""
+    from app.models.sales_analytics import SalesAnalytics, NUMPY_AVAILABLE
+    if reset:
+        SalesAnalytics.reset()
+    added = SalesAnalytics.extract(batch_size)
+    if added is None:
+        raise click.ClickException("Another extraction is running")
+    click.echo(f"Extracted {added} order lines")
+    if not NUMPY_AVAILABLE:
+        click.echo("numpy not installed, reports will aggregate in pure Python")
+
+def register_commands(app):
+    """Register CLI command groups on the app"""
+    app.cli.add_command(assets_cli)
+    app.cli.add_command(inventory_cli)
+    app.cli.add_command(coupons_cli)
+    app.cli.add_command(orders_cli)
+    app.cli.add_command(stats_cli)
+    app.cli.add_command(outbox_cli)
+    app.cli.add_command(analytics_cli)
@@ -1,11 +1,14 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session
+from datetime import date, datetime, timedelta
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, current_app, jsonify
 from app.models.user import User
-from app.models.coupon import Coupon
+from app.models.coupon import Coupon, USED_COUNT_COLUMN
 from app.models.order import Order
 from app.models.store import Store
 from app.models.product import Product
 from app.models.category import Category
 from app.utils.auth import admin_login_required
+from app.utils.passwords import HashingBusyError
+from app.utils.rate_limit import login_allowed
 
 admin_bp = Blueprint('admin', __name__)
 
@@ -31,8 +34,18 @@ def login():
             flash('請填寫所有欄位', 'error')
             return render_template('admin/login.html')
         
+        if not login_allowed('admin', username, request.remote_addr):
+            flash('登入嘗試次數過多，請稍後再試', 'error')
+            return render_template('admin/login.html'), 429
+        
         user = User.get_by_username(username)
-        if user and user.check_password(password):
+        try:
+            password_ok = bool(user) and user.check_password(password)
+        except HashingBusyError as e:
+            flash(str(e), 'error')
+            return render_template('admin/login.html'), 503
+        
+        if password_ok:
             session['admin_id'] = user.id
             session['admin_username'] = user.username
             session['admin_role'] = user.role
@@ -54,60 +67,62 @@ def logout():
 @admin_bp.route('/dashboard')
 @admin_login_required
 def dashboard():
-    # Get statistics
-    from app.utils.db import get_db_connection
-    conn = get_db_connection()
-    try:
-        with conn.cursor() as cursor:
-            # Total members
-            cursor.execute("SELECT COUNT(*) as count FROM members")
-            total_members = cursor.fetchone()['count']
-            
-            # Total stores
-            cursor.execute("SELECT COUNT(*) as count FROM stores")
-            total_stores = cursor.fetchone()['count']
-            
-            # Active stores
-            cursor.execute("SELECT COUNT(*) as count FROM stores WHERE status = 'active'")
-            active_stores = cursor.fetchone()['count']
-            
-            # Total products
-            cursor.execute("SELECT COUNT(*) as count FROM products WHERE status = 'active'")
-            total_products = cursor.fetchone()['count']
-            
-            # Total orders
-            cursor.execute("SELECT COUNT(*) as count FROM orders")
-            total_orders = cursor.fetchone()['count']
-            
-            # Total revenue
-            cursor.execute("SELECT COALESCE(SUM(final_amount), 0) as revenue FROM orders WHERE status != 'cancelled'")
-            total_revenue = cursor.fetchone()['revenue']
-            
-            # Recent orders
-            cursor.execute("""
-                SELECT o.id, o.order_number, o.final_amount, o.status, o.created_at, m.name as member_name
-                FROM orders o
-                JOIN members m ON o.member_id = m.id
-                ORDER BY o.created_at DESC
-                LIMIT 5
-            """)
-            recent_orders = cursor.fetchall()
-            
-            stats = {
-                'total_members': total_members,
-                'total_stores': total_stores,
-                'active_stores': active_stores,
-                'total_products': total_products,
-                'total_orders': total_orders,
-                'total_revenue': total_revenue,
-                'recent_orders': recent_orders
-            }
-            
-    finally:
-        conn.close()
+    # Counters are maintained incrementally and cached briefly per worker
+    from app.models.site_stats import SiteStats
+    stats = SiteStats.snapshot()
     
     return render_template('admin/dashboard.html', stats=stats)
 
+@admin_bp.route('/reports')
+@admin_login_required
+def reports():
+    """Sales report (?start=&end=&granularity=day|week|month&group_by=store&group_by=category...)
+
+    Add format=json for the same data as JSON.
+    """
+    from app.models.sales_analytics import SalesAnalytics, DIMENSIONS, GRANULARITIES
+    wants_json = request.args.get('format') == 'json'
+    granularity = request.args.get('granularity', 'day')
+    if granularity not in GRANULARITIES:
+        granularity = 'day'
+    group_by = [key for key in request.args.getlist('group_by') if key in DIMENSIONS]
+    
+    end_date = date.today()
+    start_date = end_date - timedelta(days=29)
+    error = None
+    try:
+        if request.args.get('end'):
+            end_date = datetime.strptime(request.args['end'], '%Y-%m-%d').date()
+        if request.args.get('start'):
+            start_date = datetime.strptime(request.args['start'], '%Y-%m-%d').date()
+        if start_date > end_date or (end_date - start_date).days >= current_app.config['ANALYTICS_MAX_RANGE_DAYS']:
+            error = '日期範圍無效'
+    except ValueError:
+        error = '日期格式錯誤'
+    
+    report = None
+    if not error:
+        report = SalesAnalytics.report(start_date, end_date, granularity, group_by)
+    
+    if wants_json:
+        if error:
+            return jsonify({'success': False, 'message': error})
+        return jsonify({
+            'success': True,
+            'lines': report['lines'],
+            'truncated': report['truncated'],
+            'totals': dict(report['totals'], revenue=float(report['totals']['revenue']),
+                           discount=float(report['totals']['discount']), aov=float(report['totals']['aov'])),
+            'rows': [dict(row, period=row['period'].isoformat(), revenue=float(row['revenue']),
+                          discount=float(row['discount']), aov=float(row['aov']))
+                     for row in report['rows']]
+        })
+    
+    if error:
+        flash(error, 'error')
+    return render_template('admin/reports.html', report=report, start_date=start_date, end_date=end_date,
+                           granularity=granularity, group_by=group_by)
+
 @admin_bp.route('/users')
 @admin_login_required
 def users():
@@ -253,10 +268,10 @@ def coupons():
             
             # Get coupons with pagination
             offset = (page - 1) * per_page
-            cursor.execute("""
+            cursor.execute(f"""
                 SELECT id, code, discount_type, discount_value, min_purchase, max_discount,
-                       valid_from, valid_to, usage_limit, used_count, created_by_type,
-                       created_by_id, applicable_to, applicable_id, created_at
+                       valid_from, valid_to, usage_limit, {USED_COUNT_COLUMN.format(table='coupons')} as used_count,
+                       created_by_type, created_by_id, applicable_to, applicable_id, created_at, counter_shards
                 FROM coupons 
                 ORDER BY created_at DESC
                 LIMIT %s OFFSET %s
@@ -344,6 +359,22 @@ def orders():
     
     return render_template('admin/orders.html', orders=orders, total=total, page=page, per_page=per_page)
 
+@admin_bp.route('/orders/bulk_status', methods=['POST'])
+@admin_login_required
+def bulk_update_order_status():
+    """Move many orders to one status (JSON)"""
+    data = request.get_json(silent=True) or {}
+    order_ids = data.get('order_ids')
+    if not isinstance(order_ids, list):
+        return {'success': False, 'message': '無效的訂單編號'}
+    
+    updated, skipped, error = Order.transition_many(
+        order_ids, data.get('status'), 'user', session['admin_id']
+    )
+    if error:
+        return {'success': False, 'message': error, 'updated': updated, 'skipped': skipped}
+    return {'success': True, 'updated': updated, 'skipped': skipped}
+
 @admin_bp.route('/products')
 @admin_login_required
 def products():
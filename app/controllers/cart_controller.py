@@ -1,18 +1,23 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, session
 from app.models.cart import Cart
+from app.models.guest_cart import GuestCart
+from app.models.pricing import CartPricing
+from app.models.stock_reservation import StockReservation
 from app.models.coupon import Coupon
 from app.utils.auth import member_login_required
+from app.utils.helpers import new_idempotency_key, clean_idempotency_key
 
 cart_bp = Blueprint('cart', __name__)
 
 @cart_bp.route('/')
-@member_login_required
 def view_cart():
-    cart_items = Cart.get_by_member(session['member_id'])
+    if 'member_id' in session:
+        cart_items = Cart.get_by_member(session['member_id'])
+    else:
+        cart_items = GuestCart.load().get_items()
     return render_template('cart/view.html', cart_items=cart_items)
 
 @cart_bp.route('/update_quantity', methods=['POST'])
-@member_login_required
 def update_quantity():
     product_id = request.form.get('product_id', type=int)
     quantity = request.form.get('quantity', 0, type=int)
@@ -21,16 +26,22 @@ def update_quantity():
         flash('無效的商品', 'error')
         return redirect(url_for('cart.view_cart'))
     
-    success, error = Cart.update_quantity(session['member_id'], product_id, quantity)
+    response = redirect(url_for('cart.view_cart'))
+    if 'member_id' in session:
+        success, error = Cart.update_quantity(session['member_id'], product_id, quantity)
+    else:
+        guest_cart = GuestCart.load()
+        success, error = guest_cart.update_quantity(product_id, quantity)
+        guest_cart.save(response)
+    
     if success:
         flash('購物車已更新', 'success')
     else:
         flash(error, 'error')
     
-    return redirect(url_for('cart.view_cart'))
+    return response
 
 @cart_bp.route('/remove_item', methods=['POST'])
-@member_login_required
 def remove_item():
     product_id = request.form.get('product_id', type=int)
     
@@ -38,29 +49,81 @@ def remove_item():
         flash('無效的商品', 'error')
         return redirect(url_for('cart.view_cart'))
     
-    success, error = Cart.remove_item(session['member_id'], product_id)
+    response = redirect(url_for('cart.view_cart'))
+    if 'member_id' in session:
+        success, error = Cart.remove_item(session['member_id'], product_id)
+    else:
+        guest_cart = GuestCart.load()
+        success, error = guest_cart.remove_item(product_id)
+        guest_cart.save(response)
+    
     if success:
         flash('商品已從購物車移除', 'success')
     else:
         flash(error, 'error')
     
-    return redirect(url_for('cart.view_cart'))
+    return response
+
+@cart_bp.route('/batch', methods=['POST'])
+@member_login_required
+def batch_update():
+    """Apply several cart mutations in one request (JSON)"""
+    data = request.get_json(silent=True) or {}
+    operations = data.get('operations')
+    if not isinstance(operations, list):
+        return {'success': False, 'message': '無效的購物車操作'}
+    
+    cart_summary, error, item_errors = Cart.apply_batch(session['member_id'], operations)
+    if error:
+        return {'success': False, 'message': error, 'errors': item_errors}
+    
+    return {
+        'success': True,
+        'total_items': cart_summary['total_items'],
+        'total_amount': float(cart_summary['total_amount']),
+        'items': [{
+            'product_id': item['product_id'],
+            'quantity': item['quantity'],
+            'price': float(item['price']),
+            'subtotal': float(item['subtotal'])
+        } for item in cart_summary['items']]
+    }
 
 @cart_bp.route('/checkout')
 @member_login_required
 def checkout():
-    cart_summary = Cart.get_cart_summary(session['member_id'])
+    priced_cart = CartPricing.for_member(session['member_id'])
     
-    if not cart_summary['items']:
+    if priced_cart.is_empty:
         flash('購物車是空的', 'warning')
         return redirect(url_for('product.index'))
     
-    # Get available coupons
-    coupons = Coupon.get_all()
+    # Hold the stock while the member completes checkout
+    hold_expires_at, error = StockReservation.hold(
+        session['member_id'],
+        [(line.product_id, line.quantity) for line in priced_cart.items],
+        names={line.product_id: line.product_name for line in priced_cart.items}
+    )
+    if error:
+        flash(error, 'error')
+        return redirect(url_for('cart.view_cart'))
+    
+    # Coupons this cart can use right now (cached per store / category)
+    coupons = Coupon.get_applicable(priced_cart)
+    
+    # Pre-apply the largest discount; the member can still enter another code
+    best, best_by_store = priced_cart.best_coupons(coupons)
+    applied_coupon, discount_amount = best or (None, None)
     
     return render_template('cart/checkout.html', 
-                         cart_summary=cart_summary, 
-                         coupons=coupons)
+                         cart_summary=priced_cart, 
+                         coupons=coupons,
+                         applied_coupon=applied_coupon,
+                         discount_amount=discount_amount,
+                         final_amount=priced_cart.total_amount - discount_amount if best else None,
+                         store_best_coupons=best_by_store,
+                         idempotency_key=new_idempotency_key(),
+                         hold_expires_at=hold_expires_at)
 
 @cart_bp.route('/apply_coupon', methods=['POST'])
 @member_login_required
@@ -71,8 +134,8 @@ def apply_coupon():
         flash('請輸入優惠券代碼', 'error')
         return redirect(url_for('cart.checkout'))
     
-    cart_summary = Cart.get_cart_summary(session['member_id'])
-    if not cart_summary['items']:
+    priced_cart = CartPricing.for_member(session['member_id'])
+    if priced_cart.is_empty:
         flash('購物車是空的', 'warning')
         return redirect(url_for('product.index'))
     
@@ -81,21 +144,18 @@ def apply_coupon():
         flash('優惠券不存在', 'error')
         return redirect(url_for('cart.checkout'))
     
-    # Validate coupon
-    product_ids = [item['product_id'] for item in cart_summary['items']]
-    store_id = cart_summary['items'][0]['store_id'] if cart_summary['items'] else None
-    
-    is_valid, message = coupon.is_valid(cart_summary['total_amount'], product_ids, store_id)
+    # Validate coupon and calculate discount against the priced snapshot
+    is_valid, message, discount_amount = priced_cart.check_coupon(coupon)
     if not is_valid:
         flash(message, 'error')
         return redirect(url_for('cart.checkout'))
     
-    # Calculate discount
-    discount_amount = coupon.calculate_discount(cart_summary['total_amount'])
-    final_amount = cart_summary['total_amount'] - discount_amount
+    final_amount = priced_cart.total_amount - discount_amount
     
     return render_template('cart/checkout.html',
-                         cart_summary=cart_summary,
+                         cart_summary=priced_cart,
                          applied_coupon=coupon,
                          discount_amount=discount_amount,
-                         final_amount=final_amount)
+                         final_amount=final_amount,
+                         idempotency_key=clean_idempotency_key(request.form.get('idempotency_key'))
+                         or new_idempotency_key())
@@ -1,5 +1,6 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, session
 from app.models.coupon import Coupon
+from app.models.pricing import CartPricing
 from app.utils.auth import member_login_required
 
 coupon_bp = Blueprint('coupon', __name__)
@@ -8,9 +9,6 @@ coupon_bp = Blueprint('coupon', __name__)
 @member_login_required
 def validate_coupon():
     coupon_code = request.form.get('coupon_code', '').strip()
-    total_amount = float(request.form.get('total_amount', 0))
-    product_ids = request.form.getlist('product_ids', type=int)
-    store_id = request.form.get('store_id', type=int)
     
     if not coupon_code:
         return {'valid': False, 'message': '請輸入優惠券代碼'}
@@ -19,14 +17,37 @@ def validate_coupon():
     if not coupon:
         return {'valid': False, 'message': '優惠券不存在'}
     
-    is_valid, message = coupon.is_valid(total_amount, product_ids, store_id)
+    # Checked against the member's own priced cart with the compiled coupon
+    # rule, so amounts are never taken from the request
+    priced_cart = CartPricing.for_member(session['member_id'])
+    is_valid, message, discount_amount = priced_cart.check_coupon(coupon)
     if is_valid:
-        discount_amount = coupon.calculate_discount(total_amount)
         return {
             'valid': True, 
             'message': '優惠券有效',
-            'discount_amount': discount_amount,
-            'final_amount': total_amount - discount_amount
+            'discount_amount': float(discount_amount),
+            'final_amount': float(priced_cart.total_amount - discount_amount)
         }
     else:
         return {'valid': False, 'message': message}
+
+@coupon_bp.route('/best')
+@member_login_required
+def best_coupon():
+    """Largest discount available on the member's cart, overall and per store"""
+    priced_cart = CartPricing.for_member(session['member_id'])
+    if priced_cart.is_empty:
+        return {'best': None, 'stores': {}}
+    
+    best, best_by_store = Coupon.best_for_cart(priced_cart)
+    return {
+        'best': {
+            'code': best[0].code,
+            'discount_amount': float(best[1]),
+            'final_amount': float(priced_cart.total_amount - best[1])
+        } if best else None,
+        'stores': {
+            str(store_id): {'code': coupon.code, 'discount_amount': float(discount)}
+            for store_id, (coupon, discount) in best_by_store.items()
+        }
+    }
@@ -1,7 +1,11 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, session
 from app.models.member import Member
 from app.models.store import Store
-from app.utils.auth import member_login_required
+from app.models.cart import Cart
+from app.models.guest_cart import GuestCart
+from app.utils.auth import member_login_required, load_owned_stores
+from app.utils.passwords import HashingBusyError
+from app.utils.rate_limit import login_allowed
 
 member_bp = Blueprint('member', __name__)
 
@@ -15,12 +19,32 @@ def login():
             flash('請填寫所有欄位', 'error')
             return render_template('member/login.html')
         
+        if not login_allowed('member', email, request.remote_addr):
+            flash('登入嘗試次數過多，請稍後再試', 'error')
+            return render_template('member/login.html'), 429
+        
         member = Member.get_by_email(email)
-        if member and member.check_password(password):
+        try:
+            password_ok = bool(member) and member.check_password(password)
+        except HashingBusyError as e:
+            flash(str(e), 'error')
+            return render_template('member/login.html'), 503
+        
+        if password_ok:
             session['member_id'] = member.id
             session['member_name'] = member.name
+            load_owned_stores(member.id)
             flash(f'歡迎回來，{member.name}！', 'success')
-            return redirect(url_for('product.index'))
+            
+            # Merge the anonymous cookie cart into the member's cart
+            response = redirect(url_for('product.index'))
+            guest_cart = GuestCart.load()
+            if guest_cart.items:
+                success, _ = Cart.merge_items(member.id, guest_cart.items)
+                if success:
+                    guest_cart.items.clear()
+                    guest_cart.save(response)
+            return response
         else:
             flash('電子郵件或密碼錯誤', 'error')
     
@@ -62,6 +86,8 @@ def register():
 def logout():
     session.pop('member_id', None)
     session.pop('member_name', None)
+    session.pop('store_ids', None)
+    session.pop('stores_version', None)
     flash('已登出', 'info')
     return redirect(url_for('product.index'))
 
@@ -108,6 +134,7 @@ def create_store():
         
         store, error = Store.create(session['member_id'], store_name, description)
         if store:
+            load_owned_stores(session['member_id'])
             flash('商店創建成功，等待審核', 'success')
             return redirect(url_for('member.my_stores'))
         else:
@@ -1,8 +1,9 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, current_app
 from app.models.order import Order
-from app.models.cart import Cart
-from app.models.coupon import Coupon
+from app.models.checkout_job import CheckoutJob
+from app.models.pricing import CartPricing
 from app.utils.auth import member_login_required
+from app.utils.helpers import clean_idempotency_key
 
 order_bp = Blueprint('order', __name__)
 
@@ -10,26 +11,42 @@ order_bp = Blueprint('order', __name__)
 @member_login_required
 def create_order():
     coupon_code = request.form.get('coupon_code', '').strip()
+    idempotency_key = clean_idempotency_key(request.form.get('idempotency_key'))
     
-    # Get cart items
-    cart_summary = Cart.get_cart_summary(session['member_id'])
-    if not cart_summary['items']:
+    # Async mode: queue the checkout and let the workers price and insert it
+    # (checkout_jobs deduplicates resubmissions by the same key)
+    if current_app.config['CHECKOUT_ASYNC_ENABLED']:
+        if idempotency_key:
+            order = Order.get_by_idempotency_key(session['member_id'], idempotency_key)
+            if order:
+                return redirect(url_for('order.order_detail', order_id=order.id))
+        job, error = CheckoutJob.enqueue(session['member_id'], coupon_code, idempotency_key)
+        if error:
+            flash('訂單送出失敗，請重試', 'error')
+            return redirect(url_for('cart.checkout'))
+        return redirect(url_for('order.checkout_status', job_id=job.id))
+    
+    # A resubmitted form returns the order it already created, or waits for
+    # the original request instead of running checkout a second time
+    if idempotency_key:
+        order, claimed = Order.claim_idempotency_key(session['member_id'], idempotency_key)
+        if order:
+            return redirect(url_for('order.order_detail', order_id=order.id))
+        if not claimed:
+            flash('訂單處理中，請稍後查看我的訂單', 'info')
+            return redirect(url_for('order.my_orders'))
+    
+    # Price the cart once; Order.create reuses this snapshot
+    priced_cart = CartPricing.for_member(session['member_id'])
+    if priced_cart.is_empty:
+        if idempotency_key:
+            Order.release_idempotency_key(session['member_id'], idempotency_key)
         flash('購物車是空的', 'warning')
         return redirect(url_for('product.index'))
     
-    # Prepare cart items for order creation
-    cart_items = []
-    for item in cart_summary['items']:
-        cart_items.append({
-            'product_id': item['product_id'],
-            'quantity': item['quantity'],
-            'price': item['price'],
-            'subtotal': item['subtotal'],
-            'store_id': item['store_id']
-        })
-    
     # Create order
-    order, error = Order.create(session['member_id'], cart_items, coupon_code)
+    order, error = Order.create(session['member_id'], priced_cart, coupon_code,
+                                idempotency_key=idempotency_key)
     if order:
         flash('訂單創建成功！', 'success')
         return redirect(url_for('order.order_detail', order_id=order.id))
@@ -37,11 +54,43 @@ def create_order():
         flash(error, 'error')
         return redirect(url_for('cart.checkout'))
 
+@order_bp.route('/checkout/<int:job_id>')
+@member_login_required
+def checkout_status(job_id):
+    """Pending page for a queued checkout; polls checkout_status_json"""
+    job = CheckoutJob.get_for_member(job_id, session['member_id'])
+    if not job:
+        flash('訂單不存在', 'error')
+        return redirect(url_for('order.my_orders'))
+    
+    if job.status == 'done':
+        flash('訂單創建成功！', 'success')
+        return redirect(url_for('order.order_detail', order_id=job.order_id))
+    if job.status == 'failed':
+        flash(job.error or '訂單處理失敗，請重試', 'error')
+        return redirect(url_for('cart.checkout'))
+    
+    return render_template('order/checkout_pending.html', job=job)
+
+@order_bp.route('/checkout/<int:job_id>/status')
+@member_login_required
+def checkout_status_json(job_id):
+    job = CheckoutJob.get_for_member(job_id, session['member_id'])
+    if not job:
+        return {'success': False, 'message': '訂單不存在'}
+    
+    result = {'success': True, 'status': job.status}
+    if job.is_finished:
+        # The pending page handles the final redirect and flash message
+        result['redirect_url'] = url_for('order.checkout_status', job_id=job.id)
+    return result
+
 @order_bp.route('/my_orders')
 @member_login_required
 def my_orders():
     page = request.args.get('page', 1, type=int)
     orders, total = Order.get_by_member(session['member_id'], page=page)
+    Order.load_item_previews(orders)
     
     # Pagination info
     from math import ceil
@@ -56,38 +105,30 @@ def my_orders():
 @order_bp.route('/order/<int:order_id>')
 @member_login_required
 def order_detail(order_id):
-    order = Order.get_by_id(order_id)
-    if not order or order.member_id != session['member_id']:
+    # Order, items and coupon in one query
+    order = Order.get_detail(order_id, member_id=session['member_id'])
+    if not order:
         flash('訂單不存在', 'error')
         return redirect(url_for('order.my_orders'))
     
-    order_items = order.get_items()
-    
-    # Get coupon info if applied
-    coupon = None
-    if order.coupon_id:
-        coupon = Coupon.get_by_id(order.coupon_id)
-    
     return render_template('order/order_detail.html', 
                          order=order, 
-                         order_items=order_items,
-                         coupon=coupon)
+                         order_items=order.items,
+                         coupon=order.coupon)
 
 @order_bp.route('/cancel/<int:order_id>')
 @member_login_required
 def cancel_order(order_id):
-    order = Order.get_by_id(order_id)
-    if not order or order.member_id != session['member_id']:
-        flash('訂單不存在', 'error')
-        return redirect(url_for('order.my_orders'))
-    
-    if order.status != 'pending':
-        flash('只能取消待處理的訂單', 'error')
-        return redirect(url_for('order.order_detail', order_id=order_id))
-    
-    if order.update_status('cancelled'):
+    # Ownership and status are checked on the locked row itself; the detail
+    # page reports orders that do not exist or belong to someone else
+    updated, skipped, error = Order.transition_many(
+        [order_id], 'cancelled', 'member', session['member_id'], member_id=session['member_id']
+    )
+    if error:
+        flash('取消失敗，請重試', 'error')
+    elif updated:
         flash('訂單已取消', 'success')
     else:
-        flash('取消失敗，請重試', 'error')
+        flash('只能取消待處理的訂單', 'error')
     
     return redirect(url_for('order.order_detail', order_id=order_id))
@@ -3,8 +3,9 @@ from random import shuffle
 from app.models.product import Product
 from app.models.category import Category
 from app.models.cart import Cart
+from app.models.guest_cart import GuestCart
+from app.models.stock_reservation import StockReservation
 from app.models.coupon import Coupon
-from app.utils.auth import member_login_required
 
 product_bp = Blueprint('product', __name__)
 
@@ -67,7 +68,6 @@ def product_detail(product_id):
                          related_products=related_products)
 
 @product_bp.route('/add_to_cart', methods=['POST'])
-@member_login_required
 def add_to_cart():
     product_id = request.form.get('product_id', type=int)
     quantity = request.form.get('quantity', 1, type=int)
@@ -82,21 +82,31 @@ def add_to_cart():
         flash('商品不存在', 'error')
         return redirect(url_for('product.index'))
     
-    if not product.is_in_stock():
+    # Stock held by other members' checkouts is not available
+    available = StockReservation.get_available([product_id], session.get('member_id')).get(product_id, product.stock)
+    if available <= 0:
         flash('商品缺貨', 'error')
         return redirect(url_for('product.product_detail', product_id=product_id))
     
-    if quantity > product.stock:
-        flash(f'庫存不足，目前庫存：{product.stock}', 'error')
+    if quantity > available:
+        flash(f'庫存不足，目前庫存：{available}', 'error')
         return redirect(url_for('product.product_detail', product_id=product_id))
     
-    success, error = Cart.add_item(session['member_id'], product_id, quantity)
+    response = redirect(url_for('product.product_detail', product_id=product_id))
+    if 'member_id' in session:
+        success, error = Cart.add_item(session['member_id'], product_id, quantity)
+    else:
+        # Anonymous visitors get a cookie cart, merged into the DB cart on login
+        guest_cart = GuestCart.load()
+        success, error = guest_cart.add_item(product_id, quantity)
+        guest_cart.save(response)
+    
     if success:
         flash('商品已加入購物車', 'success')
     else:
         flash(error, 'error')
     
-    return redirect(url_for('product.product_detail', product_id=product_id))
+    return response
 
 @product_bp.route('/search')
 def search():
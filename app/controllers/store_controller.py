@@ -1,8 +1,9 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session
-from app.models.store import Store
+from datetime import date, datetime, timedelta
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify, current_app
 from app.models.product import Product
 from app.models.coupon import Coupon
 from app.models.order import Order
+from app.models.store_stats import StoreDailyStats
 from app.utils.auth import member_login_required, store_owner_required
 
 store_bp = Blueprint('store', __name__)
@@ -10,12 +11,7 @@ store_bp = Blueprint('store', __name__)
 @store_bp.route('/dashboard/<int:store_id>')
 @member_login_required
 @store_owner_required
-def dashboard(store_id):
-    store = Store.get_by_id(store_id)
-    if not store:
-        flash('商店不存在', 'error')
-        return redirect(url_for('member.my_stores'))
-    
+def dashboard(store_id, store):
     # Get store statistics
     stats = store.get_stats()
     
@@ -23,31 +19,51 @@ def dashboard(store_id):
     orders, _ = Order.get_by_store(store_id, page=1, per_page=5)
     
     # Get recent products
-    products = Product.get_by_store(store_id)[:5]
+    products = Product.get_by_store(store_id, limit=5)
+    
+    # Daily sales for the chart
+    daily_sales = StoreDailyStats.get_recent(store_id, current_app.config['STORE_SALES_CHART_DAYS'])
     
-    return render_template('store/dashboard.html', store=store, stats=stats, orders=orders, products=products)
+    return render_template('store/dashboard.html', store=store, stats=stats, orders=orders,
+                           products=products, daily_sales=daily_sales)
+
+@store_bp.route('/sales/<int:store_id>')
+@member_login_required
+@store_owner_required
+def sales(store_id, store):
+    """Daily sales series for a date range (?start=YYYY-MM-DD&end=YYYY-MM-DD)"""
+    try:
+        end_date = datetime.strptime(request.args['end'], '%Y-%m-%d').date() if request.args.get('end') else date.today()
+        start_date = datetime.strptime(request.args['start'], '%Y-%m-%d').date() if request.args.get('start') \
+            else end_date - timedelta(days=current_app.config['STORE_SALES_CHART_DAYS'] - 1)
+    except ValueError:
+        return jsonify({'success': False, 'message': '日期格式錯誤'})
+    
+    if start_date > end_date or (end_date - start_date).days >= current_app.config['STORE_SALES_MAX_RANGE_DAYS']:
+        return jsonify({'success': False, 'message': '日期範圍無效'})
+    
+    days = StoreDailyStats.get_daily(store_id, start_date, end_date)
+    return jsonify({
+        'success': True,
+        'days': [dict(day, stat_date=day['stat_date'].isoformat(),
+                      gross_amount=float(day['gross_amount']),
+                      discount_amount=float(day['discount_amount']),
+                      net_amount=float(day['net_amount']),
+                      cancelled_amount=float(day['cancelled_amount']))
+                 for day in days]
+    })
 
 @store_bp.route('/products/<int:store_id>')
 @member_login_required
 @store_owner_required
-def products(store_id):
-    store = Store.get_by_id(store_id)
-    if not store:
-        flash('商店不存在', 'error')
-        return redirect(url_for('member.my_stores'))
-    
+def products(store_id, store):
     products = Product.get_by_store(store_id)
     return render_template('store/products.html', store=store, products=products)
 
 @store_bp.route('/add_product/<int:store_id>', methods=['GET', 'POST'])
 @member_login_required
 @store_owner_required
-def add_product(store_id):
-    store = Store.get_by_id(store_id)
-    if not store:
-        flash('商店不存在', 'error')
-        return redirect(url_for('member.my_stores'))
-    
+def add_product(store_id, store):
     if request.method == 'POST':
         name = request.form.get('name')
         description = request.form.get('description')
@@ -85,12 +101,7 @@ def add_product(store_id):
 @store_bp.route('/edit_product/<int:store_id>/<int:product_id>', methods=['GET', 'POST'])
 @member_login_required
 @store_owner_required
-def edit_product(store_id, product_id):
-    store = Store.get_by_id(store_id)
-    if not store:
-        flash('商店不存在', 'error')
-        return redirect(url_for('member.my_stores'))
-    
+def edit_product(store_id, product_id, store):
     product = Product.get_by_id(product_id)
     if not product or product.store_id != store_id:
         flash('商品不存在', 'error')
@@ -125,12 +136,7 @@ def edit_product(store_id, product_id):
 @store_bp.route('/delete_product/<int:store_id>/<int:product_id>')
 @member_login_required
 @store_owner_required
-def delete_product(store_id, product_id):
-    store = Store.get_by_id(store_id)
-    if not store:
-        flash('商店不存在', 'error')
-        return redirect(url_for('member.my_stores'))
-    
+def delete_product(store_id, product_id, store):
     product = Product.get_by_id(product_id)
     if not product or product.store_id != store_id:
         flash('商品不存在', 'error')
@@ -146,12 +152,7 @@ def delete_product(store_id, product_id):
 @store_bp.route('/orders/<int:store_id>')
 @member_login_required
 @store_owner_required
-def orders(store_id):
-    store = Store.get_by_id(store_id)
-    if not store:
-        flash('商店不存在', 'error')
-        return redirect(url_for('member.my_stores'))
-    
+def orders(store_id, store):
     page = request.args.get('page', 1, type=int)
     orders, total = Order.get_by_store(store_id, page=page)
     return render_template('store/orders.html', store=store, orders=orders, total=total, page=page)
@@ -159,46 +160,46 @@ def orders(store_id):
 @store_bp.route('/update_order_status/<int:store_id>/<int:order_id>', methods=['POST'])
 @member_login_required
 @store_owner_required
-def update_order_status(store_id, order_id):
-    store = Store.get_by_id(store_id)
-    if not store:
-        flash('商店不存在', 'error')
-        return redirect(url_for('member.my_stores'))
-    
-    order = Order.get_by_id(order_id)
-    if not order:
-        flash('訂單不存在', 'error')
-        return redirect(url_for('store.orders', store_id=store_id))
-    
+def update_order_status(store_id, order_id, store):
     new_status = request.form.get('status')
-    if order.update_status(new_status):
+    updated, skipped, error = Order.transition_many(
+        [order_id], new_status, 'member', session['member_id'], store_id=store_id
+    )
+    if updated:
         flash('訂單狀態更新成功', 'success')
     else:
-        flash('更新失敗，請重試', 'error')
+        flash(error or '此訂單目前無法變更為該狀態', 'error')
     
     return redirect(url_for('store.orders', store_id=store_id))
 
+@store_bp.route('/orders/<int:store_id>/bulk_status', methods=['POST'])
+@member_login_required
+@store_owner_required
+def bulk_update_order_status(store_id, store):
+    """Move many of this store's orders to one status (JSON)"""
+    data = request.get_json(silent=True) or {}
+    order_ids = data.get('order_ids')
+    if not isinstance(order_ids, list):
+        return {'success': False, 'message': '無效的訂單編號'}
+    
+    updated, skipped, error = Order.transition_many(
+        order_ids, data.get('status'), 'member', session['member_id'], store_id=store_id
+    )
+    if error:
+        return {'success': False, 'message': error, 'updated': updated, 'skipped': skipped}
+    return {'success': True, 'updated': updated, 'skipped': skipped}
+
 @store_bp.route('/coupons/<int:store_id>')
 @member_login_required
 @store_owner_required
-def coupons(store_id):
-    store = Store.get_by_id(store_id)
-    if not store:
-        flash('商店不存在', 'error')
-        return redirect(url_for('member.my_stores'))
-    
+def coupons(store_id, store):
     coupons = Coupon.get_by_creator('store', store_id)
     return render_template('store/coupons.html', store=store, coupons=coupons)
 
 @store_bp.route('/create_coupon/<int:store_id>', methods=['GET', 'POST'])
 @member_login_required
 @store_owner_required
-def create_coupon(store_id):
-    store = Store.get_by_id(store_id)
-    if not store:
-        flash('商店不存在', 'error')
-        return redirect(url_for('member.my_stores'))
-    
+def create_coupon(store_id, store):
     if request.method == 'POST':
         code = request.form.get('code')
         discount_type = request.form.get('discount_type')
@@ -1,6 +1,10 @@
+from flask import current_app
 from app.utils.db import get_db_connection
+from app.models.outbox import Outbox
 
 class Cart:
+    MAX_BATCH_OPERATIONS = 100
+    
     def __init__(self, id=None, member_id=None, product_id=None, quantity=None, added_at=None):
         self.id = id
         self.member_id = member_id
@@ -10,31 +14,12 @@ class Cart:
     
     @staticmethod
     def add_item(member_id, product_id, quantity=1):
-        """Add item to cart"""
+        """Add item to cart (atomic upsert on unique_cart_item)"""
         conn = get_db_connection()
         try:
             with conn.cursor() as cursor:
-                # Check if item already exists in cart
-                cursor.execute(
-                    "SELECT id, quantity FROM cart WHERE member_id = %s AND product_id = %s",
-                    (member_id, product_id)
-                )
-                existing = cursor.fetchone()
-                
-                if existing:
-                    # Update quantity
-                    new_quantity = existing['quantity'] + quantity
-                    cursor.execute(
-                        "UPDATE cart SET quantity = %s WHERE id = %s",
-                        (new_quantity, existing['id'])
-                    )
-                else:
-                    # Add new item
-                    cursor.execute(
-                        "INSERT INTO cart (member_id, product_id, quantity) VALUES (%s, %s, %s)",
-                        (member_id, product_id, quantity)
-                    )
-                
+                Cart._upsert(cursor, member_id, product_id, quantity)
+                Outbox.emit(cursor, 'cart.updated', member_id)
                 conn.commit()
                 return True, None
         except Exception as e:
@@ -42,48 +27,61 @@ class Cart:
         finally:
             conn.close()
     
+    @staticmethod
+    def _upsert(cursor, member_id, product_id, quantity):
+        """Insert a cart line or add to its quantity in a single statement"""
+        cursor.execute("""
+            INSERT INTO cart (member_id, product_id, quantity) VALUES (%s, %s, %s)
+            ON DUPLICATE KEY UPDATE quantity = quantity + VALUES(quantity)
+        """, (member_id, product_id, quantity))
+    
+    @staticmethod
+    def _fetch_items(cursor, member_id):
+        """Load priced cart lines for member using an open cursor"""
+        cursor.execute("""
+            SELECT c.id, c.member_id, c.product_id, c.quantity, c.added_at,
+                   p.name as product_name, p.price, p.discount_price, p.image_url,
+                   p.stock, p.category_id, s.store_name, s.id as store_id
+            FROM cart c
+            JOIN products p ON c.product_id = p.id
+            JOIN stores s ON p.store_id = s.id
+            WHERE c.member_id = %s AND p.status = 'active' AND s.status = 'active'
+            ORDER BY c.added_at DESC
+        """, (member_id,))
+        
+        return [Cart._priced_line(result) for result in cursor.fetchall()]
+    
+    @staticmethod
+    def _priced_line(result):
+        """Build a cart line dict (with effective price and subtotal) from a joined row"""
+        # Calculate effective price
+        effective_price = result['discount_price'] if result['discount_price'] else result['price']
+        subtotal = effective_price * result['quantity']
+        
+        return {
+            'id': result['id'],
+            'product_id': result['product_id'],
+            'product_name': result['product_name'],
+            'price': effective_price,
+            'original_price': result['price'],
+            'discount_price': result['discount_price'],
+            'quantity': result['quantity'],
+            'subtotal': subtotal,
+            'image_url': result['image_url'],
+            'stock': result['stock'],
+            'store_name': result['store_name'],
+            'store_id': result['store_id'],
+            'category_id': result['category_id'],
+            'added_at': result['added_at']
+        }
+    
     @staticmethod
     def get_by_member(member_id):
         """Get cart items for member"""
         conn = get_db_connection()
         try:
             with conn.cursor() as cursor:
-                cursor.execute("""
-                    SELECT c.id, c.member_id, c.product_id, c.quantity, c.added_at,
-                           p.name as product_name, p.price, p.discount_price, p.image_url,
-                           p.stock, s.store_name, s.id as store_id
-                    FROM cart c
-                    JOIN products p ON c.product_id = p.id
-                    JOIN stores s ON p.store_id = s.id
-                    WHERE c.member_id = %s AND p.status = 'active' AND s.status = 'active'
-                    ORDER BY c.added_at DESC
-                """, (member_id,))
-                
-                results = cursor.fetchall()
-                cart_items = []
-                
-                for result in results:
-                    # Calculate effective price
-                    effective_price = result['discount_price'] if result['discount_price'] else result['price']
-                    subtotal = effective_price * result['quantity']
-                    
-                    cart_items.append({
-                        'id': result['id'],
-                        'product_id': result['product_id'],
-                        'product_name': result['product_name'],
-                        'price': effective_price,
-                        'original_price': result['price'],
-                        'discount_price': result['discount_price'],
-                        'quantity': result['quantity'],
-                        'subtotal': subtotal,
-                        'image_url': result['image_url'],
-                        'stock': result['stock'],
-                        'store_name': result['store_name'],
-                        'store_id': result['store_id'],
-                        'added_at': result['added_at']
-                    })
-                
-                return cart_items
+                return Cart._fetch_items(cursor, member_id)
         except Exception as e:
             return []
         finally:
@@ -108,6 +106,7 @@ class Cart:
                         (quantity, member_id, product_id)
                     )
                 
+                Outbox.emit(cursor, 'cart.updated', member_id)
                 conn.commit()
                 return True, None
         except Exception as e:
@@ -125,6 +124,32 @@ class Cart:
                     "DELETE FROM cart WHERE member_id = %s AND product_id = %s",
                     (member_id, product_id)
                 )
+                Outbox.emit(cursor, 'cart.updated', member_id)
+                conn.commit()
+                return True, None
+        except Exception as e:
+            return False, str(e)
+        finally:
+            conn.close()
+    
+    @staticmethod
+    def merge_items(member_id, items):
+        """Merge a product_id -> quantity mapping (e.g. a guest cart) in one multi-row upsert"""
+        if not items:
+            return True, None
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cursor:
+                values = ','.join(['(%s, %s, %s)'] * len(items))
+                params = []
+                for product_id, quantity in items.items():
+                    params.extend([member_id, product_id, quantity])
+                # IGNORE turns FK failures for since-deleted products into warnings
+                cursor.execute(f"""
+                    INSERT IGNORE INTO cart (member_id, product_id, quantity) VALUES {values}
+                    ON DUPLICATE KEY UPDATE quantity = quantity + VALUES(quantity)
+                """, params)
+                Outbox.emit(cursor, 'cart.updated', member_id)
                 conn.commit()
                 return True, None
         except Exception as e:
@@ -139,6 +164,7 @@ class Cart:
         try:
             with conn.cursor() as cursor:
                 cursor.execute("DELETE FROM cart WHERE member_id = %s", (member_id,))
+                Outbox.emit(cursor, 'cart.updated', member_id)
                 conn.commit()
                 return True, None
         except Exception as e:
@@ -147,10 +173,115 @@ class Cart:
             conn.close()
     
     @staticmethod
-    def get_cart_summary(member_id):
-        """Get cart summary (total items, total amount)"""
-        cart_items = Cart.get_by_member(member_id)
+    def apply_batch(member_id, operations):
+        """Apply a list of add/set/remove operations in one transaction
+        
+        Each operation is a dict: {'op': 'add'|'set'|'remove', 'product_id': int, 'quantity': int}.
+        Returns (cart summary, None, []) or (None, error, item_errors), where
+        item_errors lists {'index', 'product_id', 'message'} for each rejected
+        operation; nothing is applied on error.
+        """
+        if not operations:
+            return None, "沒有要更新的項目", []
+        if len(operations) > Cart.MAX_BATCH_OPERATIONS:
+            return None, f"一次最多更新 {Cart.MAX_BATCH_OPERATIONS} 個項目", []
+        
+        parsed = []
+        item_errors = []
+        for index, operation in enumerate(operations):
+            try:
+                op = operation.get('op')
+                product_id = int(operation.get('product_id'))
+                quantity = int(operation.get('quantity', 0 if op == 'remove' else 1))
+            except (AttributeError, TypeError, ValueError):
+                item_errors.append({'index': index, 'product_id': None, 'message': "無效的購物車操作"})
+                continue
+            if op not in ('add', 'set', 'remove') or product_id <= 0:
+                item_errors.append({'index': index, 'product_id': product_id, 'message': "無效的購物車操作"})
+            elif op == 'add' and quantity <= 0:
+                item_errors.append({'index': index, 'product_id': product_id, 'message': "無效的商品數量"})
+            else:
+                parsed.append((index, op, product_id, quantity))
+        if item_errors:
+            return None, "部分項目無法更新", item_errors
+        
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cursor:
+                item_errors = Cart._validate_batch(cursor, member_id, parsed)
+                if item_errors:
+                    conn.rollback()
+                    return None, "部分項目無法更新", item_errors
+                
+                for index, op, product_id, quantity in parsed:
+                    if op == 'add':
+                        Cart._upsert(cursor, member_id, product_id, quantity)
+                    elif op == 'set' and quantity > 0:
+                        cursor.execute("""
+                            INSERT INTO cart (member_id, product_id, quantity) VALUES (%s, %s, %s)
+                            ON DUPLICATE KEY UPDATE quantity = VALUES(quantity)
+                        """, (member_id, product_id, quantity))
+                    else:
+                        # 'remove', or 'set' to zero
+                        cursor.execute(
+                            "DELETE FROM cart WHERE member_id = %s AND product_id = %s",
+                            (member_id, product_id)
+                        )
+                
+                cart_items = Cart._fetch_items(cursor, member_id)
+                Outbox.emit(cursor, 'cart.updated', member_id)
+                conn.commit()
+                return Cart._summarize(cart_items), None, []
+        except Exception as e:
+            conn.rollback()
+            current_app.logger.warning('Cart batch update for member %s failed: %s', member_id, e)
+            return None, "購物車更新失敗，請稍後再試", []
+        finally:
+            conn.close()
+    
+    @staticmethod
+    def _validate_batch(cursor, member_id, parsed):
+        """Per-operation errors for (index, op, product_id, quantity) tuples
         
+        Loads every product touched by an add or set with one query and
+        replays the operations on the member's current quantities, so each
+        one is checked against the quantity the cart would end up holding.
+        """
+        product_ids = sorted({product_id for index, op, product_id, quantity in parsed if op != 'remove'})
+        if not product_ids:
+            return []
+        placeholders = ','.join(['%s'] * len(product_ids))
+        cursor.execute(f"""
+            SELECT p.id, p.status, p.stock, s.status as store_status, c.quantity as cart_quantity
+            FROM products p
+            JOIN stores s ON p.store_id = s.id
+            LEFT JOIN cart c ON c.product_id = p.id AND c.member_id = %s
+            WHERE p.id IN ({placeholders})
+        """, [member_id] + product_ids)
+        products = {row['id']: row for row in cursor.fetchall()}
+        
+        quantities = {product_id: row['cart_quantity'] or 0 for product_id, row in products.items()}
+        item_errors = []
+        for index, op, product_id, quantity in parsed:
+            if op == 'remove' or (op == 'set' and quantity <= 0):
+                quantities[product_id] = 0
+                continue
+            product = products.get(product_id)
+            if not product:
+                message = "商品不存在"
+            elif product['status'] != 'active' or product['store_status'] != 'active':
+                message = "商品已下架"
+            else:
+                quantities[product_id] = quantity + (quantities[product_id] if op == 'add' else 0)
+                if quantities[product_id] <= product['stock']:
+                    continue
+                message = f"庫存不足，目前庫存：{product['stock']}"
+            item_errors.append({'index': index, 'product_id': product_id, 'message': message})
+        return item_errors
+    
+    @staticmethod
+    def _summarize(cart_items):
+        """Build the cart summary dict from priced cart lines"""
         total_items = sum(item['quantity'] for item in cart_items)
         total_amount = sum(item['subtotal'] for item in cart_items)
         
@@ -159,3 +290,8 @@ class Cart:
             'total_amount': total_amount,
             'items': cart_items
         }
+    
+    @staticmethod
+    def get_cart_summary(member_id):
+        """Get cart summary (total items, total amount)"""
+        return Cart._summarize(Cart.get_by_member(member_id))
@@ -0,0 +1,227 @@
+import uuid
+from flask import current_app
+from app.utils.db import get_db_connection
+
+class CheckoutJobLostError(Exception):
+    """Raised inside the order transaction when a job's claim was taken over"""
+
+class CheckoutJob:
+    """Queued checkout request, drained by background checkout workers
+
+    With CHECKOUT_ASYNC_ENABLED the order form only inserts a row into
+    checkout_jobs; workers claim queued jobs in batches, price the cart and
+    create the order. A job is marked done in the same transaction that
+    creates its order, and only while the worker still holds its claim, so a
+    job re-queued from a slow or dead worker can never produce two orders.
+    """
+
+    def __init__(self, id=None, member_id=None, coupon_code=None, status=None, order_id=None,
+                 error=None, claim_token=None, created_at=None, updated_at=None, idempotency_key=None):
+        self.id = id
+        self.member_id = member_id
+        self.coupon_code = coupon_code
+        self.status = status
+        self.order_id = order_id
+        self.error = error
+        self.claim_token = claim_token
+        self.created_at = created_at
+        self.updated_at = updated_at
+        self.idempotency_key = idempotency_key
+
+    @property
+    def is_finished(self):
+        return self.status in ('done', 'failed')
+
+    @staticmethod
+    def enqueue(member_id, coupon_code=None, idempotency_key=None):
+        """Queue a checkout; returns (job, None) or (None, error)
+
+        A resubmitted form (same idempotency key) gets its original job back,
+        as does a member with a job still queued or processing.
+        """
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cursor:
+                key_clause = "OR idempotency_key = %s" if idempotency_key else ""
+                params = (member_id, idempotency_key) if idempotency_key else (member_id,)
+                cursor.execute(f"""
+                    SELECT id, member_id, coupon_code, status, order_id, error, claim_token,
+                           created_at, updated_at, idempotency_key
+                    FROM checkout_jobs
+                    WHERE member_id = %s AND (status IN ('queued', 'processing') {key_clause})
+                    ORDER BY id DESC LIMIT 1
+                """, params)
+                existing = cursor.fetchone()
+                if existing:
+                    return CheckoutJob(**existing), None
+
+                cursor.execute("""
+                    INSERT INTO checkout_jobs (member_id, coupon_code, status, idempotency_key)
+                    VALUES (%s, %s, 'queued', %s)
+                """, (member_id, coupon_code or None, idempotency_key))
+                job_id = cursor.lastrowid
+                conn.commit()
+                return CheckoutJob(id=job_id, member_id=member_id, coupon_code=coupon_code or None,
+                                   status='queued', idempotency_key=idempotency_key), None
+        except Exception as e:
+            return None, str(e)
+        finally:
+            conn.close()
+
+    @staticmethod
+    def get_for_member(job_id, member_id):
+        """Get a member's job by ID"""
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    SELECT id, member_id, coupon_code, status, order_id, error, claim_token,
+                           created_at, updated_at, idempotency_key
+                    FROM checkout_jobs WHERE id = %s AND member_id = %s
+                """, (job_id, member_id))
+                result = cursor.fetchone()
+                return CheckoutJob(**result) if result else None
+        except Exception as e:
+            return None
+        finally:
+            conn.close()
+
+    @staticmethod
+    def claim_batch(batch_size):
+        """Atomically claim up to batch_size queued jobs, oldest first"""
+        token = uuid.uuid4().hex
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    UPDATE checkout_jobs SET status = 'processing', claim_token = %s
+                    WHERE status = 'queued'
+                    ORDER BY id
+                    LIMIT %s
+                """, (token, batch_size))
+                conn.commit()
+                if not cursor.rowcount:
+                    return []
+                cursor.execute("""
+                    SELECT id, member_id, coupon_code, status, order_id, error, claim_token,
+                           created_at, updated_at, idempotency_key
+                    FROM checkout_jobs WHERE claim_token = %s AND status = 'processing'
+                    ORDER BY id
+                """, (token,))
+                return [CheckoutJob(**row) for row in cursor.fetchall()]
+        finally:
+            conn.close()
+
+    @staticmethod
+    def requeue_stale(timeout):
+        """Put jobs claimed more than `timeout` seconds ago back in the queue"""
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    UPDATE checkout_jobs SET status = 'queued', claim_token = NULL
+                    WHERE status = 'processing' AND updated_at < NOW() - INTERVAL %s SECOND
+                """, (timeout,))
+                conn.commit()
+                return cursor.rowcount
+        finally:
+            conn.close()
+
+    def run(self):
+        """Price the member's cart and create the order; returns an error or None"""
+        from app.models.cart import Cart
+        from app.models.order import Order
+        from app.models.pricing import CartPricing
+
+        self._heartbeat()
+        priced_cart = CartPricing.price(Cart.get_by_member(self.member_id), self.member_id)
+        if priced_cart.is_empty:
+            return '購物車是空的'
+
+        job_id, claim_token = self.id, self.claim_token
+        marked = []
+
+        def mark_done(cursor, order_id):
+            CheckoutJob._mark_done(cursor, job_id, claim_token, order_id)
+            marked.append(order_id)
+
+        order, error = Order.create(self.member_id, priced_cart, self.coupon_code, on_created=mark_done,
+                                    idempotency_key=self.idempotency_key)
+        if order:
+            if order.id not in marked:
+                # Duplicate submission: the order already existed
+                conn = get_db_connection()
+                try:
+                    with conn.cursor() as cursor:
+                        CheckoutJob._mark_done(cursor, job_id, claim_token, order.id)
+                        conn.commit()
+                except CheckoutJobLostError:
+                    # The worker that took over the job records it
+                    pass
+                finally:
+                    conn.close()
+            self.status = 'done'
+            self.order_id = order.id
+        return error
+
+    def _heartbeat(self):
+        """Refresh updated_at so requeue_stale leaves a job that is about to run alone"""
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    UPDATE checkout_jobs SET updated_at = NOW()
+                    WHERE id = %s AND claim_token = %s AND status = 'processing'
+                """, (self.id, self.claim_token))
+                conn.commit()
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _mark_done(cursor, job_id, claim_token, order_id):
+        """Mark a claimed job done; raises CheckoutJobLostError if the claim is gone"""
+        cursor.execute("""
+            UPDATE checkout_jobs SET status = 'done', order_id = %s, claim_token = NULL
+            WHERE id = %s AND claim_token = %s AND status = 'processing'
+        """, (order_id, job_id, claim_token))
+        if not cursor.rowcount:
+            raise CheckoutJobLostError('訂單處理逾時，請重試')
+
+    @staticmethod
+    def drain(batch_size=None):
+        """Process queued jobs batch by batch until the queue is empty
+
+        Each order keeps its own transaction so one failing cart does not
+        abort the batch; failures are recorded with one statement per batch.
+        Returns the number of jobs processed.
+        """
+        batch_size = batch_size or current_app.config['CHECKOUT_BATCH']
+        CheckoutJob.requeue_stale(current_app.config['CHECKOUT_JOB_TIMEOUT'])
+        processed = 0
+        while True:
+            jobs = CheckoutJob.claim_batch(batch_size)
+            if not jobs:
+                return processed
+
+            failures = []
+            for job in jobs:
+                try:
+                    error = job.run()
+                except Exception as e:
+                    current_app.logger.warning('Checkout job %s failed: %s', job.id, e)
+                    error = '訂單處理失敗，請重試'
+                if error:
+                    failures.append((error[:255], job.id, job.claim_token))
+
+            if failures:
+                conn = get_db_connection()
+                try:
+                    with conn.cursor() as cursor:
+                        cursor.executemany("""
+                            UPDATE checkout_jobs SET status = 'failed', error = %s, claim_token = NULL
+                            WHERE id = %s AND claim_token = %s AND status = 'processing'
+                        """, failures)
+                        conn.commit()
+                finally:
+                    conn.close()
+            processed += len(jobs)
@@ -1,12 +1,96 @@
+import copy
+import random
 from datetime import datetime
-from app.utils.db import get_db_connection
-from app.utils.helpers import calculate_discount
+from decimal import Decimal
+from operator import attrgetter
+from app.utils.db import get_db_connection, run_in_transaction
+from app.utils.helpers import calculate_discount, to_money
+from app.models.outbox import Outbox
+from app.models.coupon_cache import CouponCache
+
+# coupons.used_count plus the uses counted on coupon_counter_shards, for a
+# query over the coupons table aliased as {table}
+USED_COUNT_COLUMN = """{table}.used_count + CASE WHEN {table}.counter_shards > 0
+                       THEN (SELECT COALESCE(SUM(shard.used_count), 0) FROM coupon_counter_shards shard
+                             WHERE shard.coupon_id = {table}.id)
+                       ELSE 0 END"""
+
+def _split_quota(remaining, shards):
+    """Per-shard quotas for `remaining` uses (all None when unlimited)"""
+    if remaining is None:
+        return [None] * shards
+    remaining = max(0, remaining)
+    return [remaining // shards + (1 if shard < remaining % shards else 0) for shard in range(shards)]
+
+class CouponUnavailableError(Exception):
+    """Raised inside an order transaction when a coupon can no longer be redeemed"""
+
+class CouponRule:
+    """A coupon's conditions compiled once into checks over a PricedCart
+
+    The scope (whole cart, one store or one category) is resolved at compile
+    time into a lookup on the cart's precomputed subtotals, so a check is a
+    few comparisons with no database access.
+    """
+    __slots__ = ('valid_from', 'valid_to', 'exhausted', 'code_used', 'min_purchase', 'amount_of', 'scope_error',
+                 'discount_type', 'discount_value', 'max_discount')
+
+    def __init__(self, coupon):
+        self.valid_from = coupon.valid_from
+        self.valid_to = coupon.valid_to
+        self.exhausted = bool(coupon.usage_limit) and (coupon.used_count or 0) >= coupon.usage_limit
+        self.code_used = coupon.code_used_at is not None
+        self.min_purchase = to_money(coupon.min_purchase)
+        self.discount_type = coupon.discount_type
+        self.discount_value = Decimal(str(coupon.discount_value or 0))
+        self.max_discount = to_money(coupon.max_discount) if coupon.max_discount else None
+
+        target = coupon.applicable_id
+        if coupon.applicable_to == 'store':
+            self.amount_of = lambda priced_cart: priced_cart.store_subtotals.get(target, Decimal('0.00'))
+            self.scope_error = "此優惠券不適用於此商店"
+        elif coupon.applicable_to == 'category':
+            self.amount_of = lambda priced_cart: priced_cart.category_subtotals.get(target, Decimal('0.00'))
+            self.scope_error = "此優惠券不適用於此商品分類"
+        else:
+            self.amount_of = attrgetter('total_amount')
+            self.scope_error = None
+
+    def availability_error(self, now=None):
+        """Why the coupon cannot be used at all right now, or None"""
+        now = now or datetime.now()
+        if self.valid_from and now < self.valid_from:
+            return "優惠券尚未生效"
+        if self.valid_to and now > self.valid_to:
+            return "優惠券已過期"
+        if self.exhausted:
+            return "優惠券使用次數已達上限"
+        if self.code_used:
+            return "優惠券已被使用"
+        return None
+
+    def check(self, priced_cart, now=None):
+        """Returns (is_valid, message, eligible_amount)"""
+        error = self.availability_error(now)
+        if error:
+            return False, error, Decimal('0.00')
+        amount = self.amount_of(priced_cart)
+        if self.scope_error and not amount:
+            return False, self.scope_error, Decimal('0.00')
+        if self.min_purchase and amount < self.min_purchase:
+            return False, f"訂單金額需滿 ${self.min_purchase:,.0f} 才能使用此優惠券", Decimal('0.00')
+        return True, "優惠券有效", amount
+
+    def discount(self, amount):
+        """Discount on an eligible amount, in cents"""
+        return to_money(calculate_discount(amount, self.discount_type, self.discount_value, self.max_discount))
 
 class Coupon:
     def __init__(self, id=None, code=None, discount_type=None, discount_value=None, 
                  min_purchase=None, max_discount=None, valid_from=None, valid_to=None,
                  usage_limit=None, used_count=None, created_by_type=None, created_by_id=None,
-                 applicable_to=None, applicable_id=None, created_at=None):
+                 applicable_to=None, applicable_id=None, created_at=None, counter_shards=None,
+                 is_campaign=None, code_used_at=None):
         self.id = id
         self.code = code
         self.discount_type = discount_type
@@ -22,6 +106,21 @@ class Coupon:
         self.applicable_to = applicable_to
         self.applicable_id = applicable_id
         self.created_at = created_at
+        # > 0 when usage is counted in coupon_counter_shards instead of used_count
+        self.counter_shards = counter_shards or 0
+        # Campaign templates are redeemed only through their generated
+        # single-use codes (see CouponCampaign); code_used_at is set when this
+        # coupon was loaded through one of them and it has been used
+        self.is_campaign = bool(is_campaign)
+        self.code_used_at = code_used_at
+        self._rule = None
+    
+    @property
+    def rule(self):
+        """Compiled CouponRule, built on first use"""
+        if self._rule is None:
+            self._rule = CouponRule(self)
+        return self._rule
     
     @staticmethod
     def create(code, discount_type, discount_value, min_purchase=0, max_discount=None,
@@ -32,10 +131,19 @@ class Coupon:
         try:
             with conn.cursor() as cursor:
                 # Check if code already exists
-                cursor.execute("SELECT id FROM coupons WHERE code = %s", (code,))
+                cursor.execute("""
+                    SELECT id FROM coupons WHERE code = %s
+                    UNION ALL
+                    SELECT coupon_id FROM coupon_codes WHERE code = %s
+                """, (code, code))
                 if cursor.fetchone():
                     return None, "此優惠券代碼已被使用"
                 
+                # Whole-cart coupons have no target, which keeps them on one
+                # range of idx_coupons_applicable
+                if applicable_to == 'all':
+                    applicable_id = None
+                
                 # Set default validity if not provided
                 if not valid_from:
                     valid_from = datetime.now()
@@ -52,7 +160,11 @@ class Coupon:
                       applicable_to, applicable_id))
                 
                 coupon_id = cursor.lastrowid
+                Outbox.emit(cursor, 'coupon.created', coupon_id, {
+                    'code': code, 'applicable_to': applicable_to, 'applicable_id': applicable_id
+                })
                 conn.commit()
+                CouponCache.invalidate([code], targets=[(applicable_to, applicable_id)])
                 
                 return Coupon(id=coupon_id, code=code, discount_type=discount_type,
                              discount_value=discount_value, min_purchase=min_purchase,
@@ -67,16 +179,32 @@ class Coupon:
     
     @staticmethod
     def get_by_code(code):
-        """Get coupon by code"""
+        """Get coupon by code (cached per process, see CouponCache)"""
+        return CouponCache.get(code)
+    
+    @staticmethod
+    def fetch_by_code(code):
+        """Get coupon by code from the database, bypassing the cache"""
         conn = get_db_connection()
         try:
             with conn.cursor() as cursor:
-                cursor.execute("""
+                # Campaign codes resolve to their template row
+                cursor.execute(f"""
                     SELECT id, code, discount_type, discount_value, min_purchase, max_discount,
-                           valid_from, valid_to, usage_limit, used_count, created_by_type,
-                           created_by_id, applicable_to, applicable_id, created_at
-                    FROM coupons WHERE code = %s
-                """, (code,))
+                           valid_from, valid_to, usage_limit, {USED_COUNT_COLUMN.format(table='coupons')} as used_count,
+                           created_by_type, created_by_id, applicable_to, applicable_id, created_at, counter_shards,
+                           is_campaign, NULL as code_used_at
+                    FROM coupons WHERE code = %s AND is_campaign = 0
+                    UNION ALL
+                    SELECT c.id, cc.code, c.discount_type, c.discount_value, c.min_purchase, c.max_discount,
+                           c.valid_from, c.valid_to, c.usage_limit, {USED_COUNT_COLUMN.format(table='c')},
+                           c.created_by_type, c.created_by_id, c.applicable_to, c.applicable_id, c.created_at,
+                           c.counter_shards, c.is_campaign, cc.used_at as code_used_at
+                    FROM coupon_codes cc
+                    JOIN coupons c ON cc.coupon_id = c.id
+                    WHERE cc.code = %s
+                    LIMIT 1
+                """, (code, code))
                 result = cursor.fetchone()
                 if result:
                     return Coupon(**result)
@@ -86,16 +214,37 @@ class Coupon:
         finally:
             conn.close()
     
+    @staticmethod
+    def get_template(code):
+        """Coupon row by its own code, campaign templates included (not cached)"""
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(f"""
+                    SELECT id, code, discount_type, discount_value, min_purchase, max_discount,
+                           valid_from, valid_to, usage_limit, {USED_COUNT_COLUMN.format(table='coupons')} as used_count,
+                           created_by_type, created_by_id, applicable_to, applicable_id, created_at, counter_shards,
+                           is_campaign
+                    FROM coupons WHERE code = %s
+                """, (code,))
+                result = cursor.fetchone()
+                return Coupon(**result) if result else None
+        except Exception as e:
+            return None
+        finally:
+            conn.close()
+    
     @staticmethod
     def get_by_creator(created_by_type, created_by_id):
         """Get coupons created by specific user/store"""
         conn = get_db_connection()
         try:
             with conn.cursor() as cursor:
-                cursor.execute("""
+                cursor.execute(f"""
                     SELECT id, code, discount_type, discount_value, min_purchase, max_discount,
-                           valid_from, valid_to, usage_limit, used_count, created_by_type,
-                           created_by_id, applicable_to, applicable_id, created_at
+                           valid_from, valid_to, usage_limit, {USED_COUNT_COLUMN.format(table='coupons')} as used_count,
+                           created_by_type, created_by_id, applicable_to, applicable_id, created_at, counter_shards,
+                           is_campaign
                     FROM coupons 
                     WHERE created_by_type = %s AND created_by_id = %s
                     ORDER BY created_at DESC
@@ -113,10 +262,11 @@ class Coupon:
         conn = get_db_connection()
         try:
             with conn.cursor() as cursor:
-                cursor.execute("""
+                cursor.execute(f"""
                     SELECT id, code, discount_type, discount_value, min_purchase, max_discount,
-                           valid_from, valid_to, usage_limit, used_count, created_by_type,
-                           created_by_id, applicable_to, applicable_id, created_at
+                           valid_from, valid_to, usage_limit, {USED_COUNT_COLUMN.format(table='coupons')} as used_count,
+                           created_by_type, created_by_id, applicable_to, applicable_id, created_at, counter_shards,
+                           is_campaign
                     FROM coupons 
                     ORDER BY created_at DESC
                 """)
@@ -127,19 +277,81 @@ class Coupon:
         finally:
             conn.close()
     
-    def is_valid(self, total_amount=0, product_ids=None, store_id=None):
-        """Check if coupon is valid for given conditions"""
-        now = datetime.now()
+    @staticmethod
+    def fetch_for_targets(targets):
+        """Unexpired coupons for (applicable_to, applicable_id) targets, from the database
         
-        # Check validity period
-        if self.valid_from and now < self.valid_from:
-            return False, "優惠券尚未生效"
-        if self.valid_to and now > self.valid_to:
-            return False, "優惠券已過期"
+        One UNION ALL branch per scope, each a range scan on
+        idx_coupons_applicable (applicable_to, applicable_id, valid_to).
+        """
+        columns = f"""id, code, discount_type, discount_value, min_purchase, max_discount,
+                      valid_from, valid_to, usage_limit, {USED_COUNT_COLUMN.format(table='coupons')} as used_count,
+                      created_by_type, created_by_id, applicable_to, applicable_id, created_at, counter_shards,
+                      is_campaign"""
+        branches, params = [], []
+        for scope in ('all', 'store', 'category'):
+            ids = sorted({target_id for applicable_to, target_id in targets if applicable_to == scope})
+            if scope == 'all' and ids:
+                branches.append(f"""SELECT {columns} FROM coupons
+                                    WHERE applicable_to = 'all' AND applicable_id IS NULL AND valid_to >= NOW()
+                                      AND is_campaign = 0""")
+            elif ids:
+                placeholders = ','.join(['%s'] * len(ids))
+                branches.append(f"""SELECT {columns} FROM coupons
+                                    WHERE applicable_to = %s AND applicable_id IN ({placeholders})
+                                      AND valid_to >= NOW() AND is_campaign = 0""")
+                params.extend([scope] + ids)
+        if not branches:
+            return []
         
-        # Check usage limit
-        if self.usage_limit and self.used_count >= self.usage_limit:
-            return False, "優惠券使用次數已達上限"
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(' UNION ALL '.join(branches), params)
+                return [Coupon(**result) for result in cursor.fetchall()]
+        finally:
+            conn.close()
+    
+    @staticmethod
+    def _candidates(priced_cart, copies=True):
+        """Unexpired coupons scoped to the whole cart or to one of its stores or categories"""
+        targets = [('all', None)]
+        targets.extend(('store', store_id) for store_id in priced_cart.store_ids)
+        targets.extend(('category', category_id) for category_id in priced_cart.category_ids)
+        try:
+            return CouponCache.get_for_targets(targets, copies)
+        except Exception as e:
+            return []
+    
+    @staticmethod
+    def get_applicable(priced_cart):
+        """Coupons usable on this cart right now, newest first (no database access when cached)"""
+        now = datetime.now()
+        usable = [coupon for coupon in Coupon._candidates(priced_cart) if coupon.rule.check(priced_cart, now)[0]]
+        usable.sort(key=lambda coupon: coupon.id, reverse=True)
+        return usable
+    
+    @staticmethod
+    def best_for_cart(priced_cart):
+        """Best coupon for this cart and best store coupon per store; see PricedCart.best_coupons"""
+        # Rank the cached coupons in place and copy only the winners
+        best, best_by_store = priced_cart.best_coupons(Coupon._candidates(priced_cart, copies=False))
+        if best:
+            best = (copy.copy(best[0]), best[1])
+        best_by_store = {store_id: (copy.copy(coupon), discount)
+                         for store_id, (coupon, discount) in best_by_store.items()}
+        return best, best_by_store
+    
+    def _check_availability(self):
+        """Check validity period and usage limit"""
+        error = self.rule.availability_error()
+        return error is None, error
+    
+    def is_valid(self, total_amount=0, product_ids=None, store_id=None):
+        """Check if coupon is valid for given conditions"""
+        is_available, message = self._check_availability()
+        if not is_available:
+            return False, message
         
         # Check minimum purchase
         if self.min_purchase and total_amount < self.min_purchase:
@@ -166,30 +378,138 @@ class Coupon:
         
         return True, "優惠券有效"
     
+    def is_valid_for_cart(self, priced_cart):
+        """Check coupon against a PricedCart snapshot (no database access)
+        
+        Store and category coupons apply to, and check min_purchase against,
+        the subtotal of that store or category only.
+        """
+        is_valid, message, amount = self.rule.check(priced_cart)
+        return is_valid, message
+    
     def calculate_discount(self, total_amount):
         """Calculate discount amount for given total"""
         return calculate_discount(total_amount, self.discount_type, self.discount_value, self.max_discount)
     
     def use_coupon(self):
-        """Mark coupon as used"""
-        conn = get_db_connection()
+        """Mark coupon as used (standalone; orders redeem inside their transaction)"""
         try:
-            with conn.cursor() as cursor:
-                cursor.execute(
-                    "UPDATE coupons SET used_count = used_count + 1 WHERE id = %s",
-                    (self.id,)
-                )
-                conn.commit()
-                self.used_count += 1
-                return True
+            run_in_transaction(lambda cursor: self._increment_usage(cursor))
+            self.used_count += 1
+            if self.is_campaign:
+                self.code_used_at = datetime.now()
+            self._rule = None
+            CouponCache.invalidate([self.code], [self.id])
+            return True
         except Exception as e:
             return False
-        finally:
-            conn.close()
+    
+    def redeem(self, cursor, member_id, order_id):
+        """Redeem coupon for an order inside the caller's transaction
+        
+        The usage limit is enforced by the UPDATE itself, so concurrent orders
+        can never over-redeem. Raises CouponUnavailableError when exhausted.
+        """
+        self._increment_usage(cursor)
+        cursor.execute(
+            "INSERT INTO coupon_redemptions (coupon_id, member_id, order_id) VALUES (%s, %s, %s)",
+            (self.id, member_id, order_id)
+        )
+    
+    def _increment_usage(self, cursor):
+        """Conditionally count one use, on the coupon row or on a random shard"""
+        if self.is_campaign:
+            # Each generated campaign code is single-use
+            cursor.execute(
+                "UPDATE coupon_codes SET used_at = NOW() WHERE code = %s AND coupon_id = %s AND used_at IS NULL",
+                (self.code, self.id)
+            )
+            if not cursor.rowcount:
+                raise CouponUnavailableError("優惠券已被使用")
+        if self.counter_shards:
+            # Hot campaign codes spread uses over shard rows, each with its own
+            # slice of the usage limit, so no single row becomes a lock hotspot
+            shards = list(range(self.counter_shards))
+            random.shuffle(shards)
+            for shard in shards:
+                cursor.execute("""
+                    UPDATE coupon_counter_shards SET used_count = used_count + 1
+                    WHERE coupon_id = %s AND shard = %s AND (quota IS NULL OR used_count < quota)
+                """, (self.id, shard))
+                if cursor.rowcount:
+                    Outbox.emit(cursor, 'coupon.used', self.id, {'code': self.code})
+                    return
+        else:
+            cursor.execute("""
+                UPDATE coupons SET used_count = used_count + 1
+                WHERE id = %s AND (usage_limit IS NULL OR used_count < usage_limit)
+            """, (self.id,))
+            if cursor.rowcount:
+                Outbox.emit(cursor, 'coupon.used', self.id, {'code': self.code})
+                return
+        raise CouponUnavailableError("優惠券使用次數已達上限")
+    
+    def enable_sharded_counter(self, shards):
+        """Move usage counting onto `shards` counter rows
+        
+        The remaining usage limit is split across the shards; existing uses stay
+        in coupons.used_count.
+        """
+        if not 1 < shards <= 64:
+            return False, "分片數需介於 2 到 64"
+        
+        def shard_counter(cursor):
+            cursor.execute(
+                "SELECT usage_limit, used_count, counter_shards FROM coupons WHERE id = %s FOR UPDATE",
+                (self.id,)
+            )
+            row = cursor.fetchone()
+            if not row:
+                raise CouponUnavailableError("優惠券不存在")
+            if row['counter_shards']:
+                raise CouponUnavailableError("此優惠券已啟用分片計數")
+            
+            remaining = row['usage_limit'] - row['used_count'] if row['usage_limit'] is not None else None
+            cursor.executemany(
+                "INSERT INTO coupon_counter_shards (coupon_id, shard, quota) VALUES (%s, %s, %s)",
+                [(self.id, shard, quota) for shard, quota in enumerate(_split_quota(remaining, shards))]
+            )
+            cursor.execute("UPDATE coupons SET counter_shards = %s WHERE id = %s", (shards, self.id))
+            Outbox.emit(cursor, 'coupon.updated', self.id, {'code': self.code, 'fields': ['counter_shards']})
+        
+        try:
+            run_in_transaction(shard_counter)
+            self.counter_shards = shards
+            CouponCache.invalidate([self.code], [self.id])
+            return True, None
+        except Exception as e:
+            return False, str(e)
+    
+    @staticmethod
+    def _resplit_quota(cursor, coupon_id, usage_limit):
+        """Spread what is left of a new usage limit over a sharded coupon's counters
+        
+        Each shard keeps the uses it has counted and gets its share of the
+        remainder on top, inside the caller's transaction.
+        """
+        cursor.execute("SELECT used_count FROM coupons WHERE id = %s FOR UPDATE", (coupon_id,))
+        used = cursor.fetchone()['used_count']
+        cursor.execute("""
+            SELECT shard, used_count FROM coupon_counter_shards
+            WHERE coupon_id = %s ORDER BY shard FOR UPDATE
+        """, (coupon_id,))
+        shards = cursor.fetchall()
+        remaining = usage_limit - used - sum(row['used_count'] for row in shards)
+        cursor.executemany(
+            "UPDATE coupon_counter_shards SET quota = %s WHERE coupon_id = %s AND shard = %s",
+            [(row['used_count'] + quota, coupon_id, row['shard'])
+             for row, quota in zip(shards, _split_quota(remaining, len(shards)))]
+        )
     
     def update(self, code=None, discount_type=None, discount_value=None, min_purchase=None,
                max_discount=None, valid_from=None, valid_to=None, usage_limit=None):
-        """Update coupon"""
+        """Update coupon (a new usage_limit is re-split over sharded counters)"""
+        previous_code = self.code
         conn = get_db_connection()
         try:
             with conn.cursor() as cursor:
@@ -198,7 +518,11 @@ class Coupon:
                 
                 if code is not None:
                     # Check if new code already exists
-                    cursor.execute("SELECT id FROM coupons WHERE code = %s AND id != %s", (code, self.id))
+                    cursor.execute("""
+                        SELECT id FROM coupons WHERE code = %s AND id != %s
+                        UNION ALL
+                        SELECT coupon_id FROM coupon_codes WHERE code = %s
+                    """, (code, self.id, code))
                     if cursor.fetchone():
                         return False, "此優惠券代碼已被使用"
                     updates.append("code = %s")
@@ -246,7 +570,21 @@ class Coupon:
                         f"UPDATE coupons SET {', '.join(updates)} WHERE id = %s",
                         params
                     )
+                    if usage_limit is not None and self.counter_shards:
+                        Coupon._resplit_quota(cursor, self.id, usage_limit)
+                    Outbox.emit(cursor, 'coupon.updated', self.id, {
+                        'code': self.code,
+                        'previous_code': previous_code if previous_code != self.code else None,
+                        'fields': [update.split(' = ')[0] for update in updates],
+                        'applicable_to': self.applicable_to,
+                        'applicable_id': self.applicable_id
+                    })
                     conn.commit()
+                    self._rule = None
+                    # The target too: a coupon whose validity was extended may
+                    # not be in any cached list yet
+                    CouponCache.invalidate([previous_code, self.code], [self.id],
+                                           [(self.applicable_to, self.applicable_id)])
                 return True, None
         except Exception as e:
             return False, str(e)
@@ -259,7 +597,9 @@ class Coupon:
         try:
             with conn.cursor() as cursor:
                 cursor.execute("DELETE FROM coupons WHERE id = %s", (self.id,))
+                Outbox.emit(cursor, 'coupon.deleted', self.id, {'code': self.code})
                 conn.commit()
+                CouponCache.invalidate([self.code], [self.id])
                 return True
         except Exception as e:
             return False
@@ -0,0 +1,140 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+from app.models.outbox import Outbox
+
+class _VersionedLRU:
+    """LRU with per-entry expiry and per-key versions
+
+    A reader notes the key's version before loading from the database and
+    only stores the result if no invalidation bumped it meanwhile, so a load
+    racing a write can never re-cache the old row.
+    """
+
+    def __init__(self):
+        self.entries = OrderedDict()  # key -> (expires_at, value), least recently used first
+        self.versions = {}
+        self.epoch = 0
+        self.lock = threading.Lock()
+
+    def version(self, key):
+        return self.epoch, self.versions.get(key, 0)
+
+    def get(self, key, now):
+        """(True, value) on a fresh hit, else (False, version to pass to put)"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] > now:
+                self.entries.move_to_end(key)
+                return True, entry[1]
+            return False, self.version(key)
+
+    def put(self, key, version, value, now):
+        config = current_app.config
+        with self.lock:
+            if self.version(key) != version:
+                return
+            self.entries[key] = (now + config['COUPON_CACHE_TTL'], value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > config['COUPON_CACHE_SIZE']:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, keys=(), where=None):
+        """Drop the given keys and every entry whose value matches where(value)"""
+        with self.lock:
+            keys = set(keys)
+            if where:
+                keys.update(key for key, (expires_at, value) in self.entries.items() if where(value))
+            for key in keys:
+                self.entries.pop(key, None)
+                self.versions[key] = self.versions.get(key, 0) + 1
+            if len(self.versions) > 4 * current_app.config['COUPON_CACHE_SIZE']:
+                # Forget per-key versions; the new epoch fences every load
+                self.versions.clear()
+                self.epoch += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.versions.clear()
+            self.epoch += 1
+
+# code -> Coupon or None
+_by_code = _VersionedLRU()
+# (applicable_to, applicable_id) -> list of unexpired Coupons with that scope
+_by_target = _VersionedLRU()
+
+class CouponCache:
+    """Per-process coupon caches: by code, and by scope target for checkout
+
+    Unknown codes are cached too, so guessing codes does not reach MySQL.
+    Entries are dropped right after local writes (Coupon.create/update/
+    delete/use_coupon) and, in every process, when the outbox delivers the
+    coupon.* event of any write; COUPON_CACHE_TTL bounds staleness if an
+    event is missed. Callers get copies, never the cached objects.
+    """
+
+    @staticmethod
+    def get(code):
+        """Coupon for code (or None), from the cache or the database"""
+        from app.models.coupon import Coupon
+        now = time.monotonic()
+        hit, value = _by_code.get(code, now)
+        if hit:
+            return copy.copy(value) if value else None
+        coupon = Coupon.fetch_by_code(code)
+        if coupon:
+            coupon.rule  # compile once; copies share it
+        _by_code.put(code, value, coupon, now)
+        return copy.copy(coupon) if coupon else None
+
+    @staticmethod
+    def get_for_targets(targets, copies=True):
+        """Unexpired coupons scoped to any of the (applicable_to, applicable_id) targets
+
+        Targets missing from the cache are loaded with one indexed query.
+        copies=False returns the cached objects themselves, for callers that
+        only read them.
+        """
+        from app.models.coupon import Coupon
+        now = time.monotonic()
+        coupons, missing = [], {}
+        for target in targets:
+            hit, value = _by_target.get(target, now)
+            if hit:
+                coupons.extend(value)
+            else:
+                missing[target] = value
+
+        if missing:
+            loaded = {target: [] for target in missing}
+            for coupon in Coupon.fetch_for_targets(list(missing)):
+                coupon.rule
+                loaded[(coupon.applicable_to, coupon.applicable_id)].append(coupon)
+            for target, version in missing.items():
+                _by_target.put(target, version, loaded[target], now)
+                coupons.extend(loaded[target])
+        return [copy.copy(coupon) for coupon in coupons] if copies else coupons
+
+    @staticmethod
+    def invalidate(codes=(), coupon_ids=(), targets=()):
+        """Drop entries by code, coupon id and/or scope target"""
+        coupon_ids = set(coupon_ids)
+        _by_code.invalidate(codes, lambda coupon: coupon is not None and coupon.id in coupon_ids)
+        _by_target.invalidate(targets, lambda coupons: any(coupon.id in coupon_ids for coupon in coupons))
+
+    @staticmethod
+    def clear():
+        _by_code.clear()
+        _by_target.clear()
+
+@Outbox.subscribe('coupon.*')
+def _invalidate_changed_coupons(events):
+    codes, targets = set(), set()
+    for event in events:
+        codes.update(code for code in (event.payload.get('code'), event.payload.get('previous_code')) if code)
+        if event.payload.get('applicable_to'):
+            targets.add((event.payload['applicable_to'], event.payload.get('applicable_id')))
+    CouponCache.invalidate(codes, {event.entity_id for event in events}, targets)
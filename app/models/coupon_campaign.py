@@ -0,0 +1,154 @@
+import hashlib
+import math
+import secrets
+from flask import current_app
+from app.utils.db import get_db_connection
+from app.models.outbox import Outbox
+from app.models.coupon_cache import CouponCache
+
+# 32 symbols without 0/O and 1/I, so each random byte maps to one symbol
+# without bias (256 % 32 == 0) and printed codes are hard to misread
+ALPHABET = '23456789ABCDEFGHJKLMNPQRSTUVWXYZ'
+_BYTE_TO_SYMBOL = (ALPHABET * 8).encode()  # bytes.translate table: byte -> ALPHABET[byte % 32]
+
+class _BloomFilter:
+    """Fixed-size Bloom filter over strings (false positives only)"""
+
+    def __init__(self, capacity, error_rate=0.001):
+        capacity = max(capacity, 1)
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value):
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, value):
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, value):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+class CouponCampaign:
+    """Bulk single-use codes sharing one coupon row as their template
+
+    Discount, scope, validity and the overall usage limit live on the
+    template coupon; coupon_codes only holds (code, coupon_id, used_at).
+    Once a coupon has generated codes its own code is no longer redeemable.
+    """
+
+    @staticmethod
+    def random_codes(count, length):
+        """count random codes of length symbols (5 bits of entropy each)"""
+        symbols = secrets.token_bytes(count * length).translate(_BYTE_TO_SYMBOL).decode()
+        return [symbols[i:i + length] for i in range(0, count * length, length)]
+
+    @staticmethod
+    def _existing_codes(cursor, expected):
+        """Bloom filter of every coupon and campaign code, read in key order"""
+        cursor.execute("""
+            SELECT (SELECT COUNT(*) FROM coupons) + (SELECT COUNT(*) FROM coupon_codes) as count
+        """)
+        existing = _BloomFilter(cursor.fetchone()['count'] + expected)
+        batch_size = current_app.config['COUPON_CODE_BATCH']
+        for table in ('coupons', 'coupon_codes'):
+            last_code = ''
+            while True:
+                cursor.execute(
+                    f"SELECT code FROM {table} WHERE code > %s ORDER BY code LIMIT %s",
+                    (last_code, batch_size)
+                )
+                rows = cursor.fetchall()
+                for row in rows:
+                    existing.add(row['code'])
+                if len(rows) < batch_size:
+                    break
+                last_code = rows[-1]['code']
+        return existing
+
+    @staticmethod
+    def generate(coupon, count, length=None, max_rounds=5):
+        """Add count new codes to the campaign of coupon; returns (inserted, error)
+
+        Candidates already in the Bloom filter are redrawn before insertion.
+        Codes created concurrently elsewhere are skipped by INSERT IGNORE and
+        the shortfall is redrawn, for up to max_rounds rounds without progress.
+        Each chunk commits on its own, so an interrupted run keeps its codes.
+        """
+        length = length or current_app.config['COUPON_CODE_LENGTH']
+        batch_size = current_app.config['COUPON_CODE_BATCH']
+        if count <= 0:
+            return 0, None
+        if not 8 <= length <= 32:
+            return 0, "代碼長度需介於 8 到 32"
+
+        inserted = 0
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cursor:
+                if not coupon.is_campaign:
+                    cursor.execute("UPDATE coupons SET is_campaign = 1 WHERE id = %s", (coupon.id,))
+                    Outbox.emit(cursor, 'coupon.updated', coupon.id, {
+                        'code': coupon.code, 'fields': ['is_campaign'],
+                        'applicable_to': coupon.applicable_to, 'applicable_id': coupon.applicable_id
+                    })
+                    conn.commit()
+                    coupon.is_campaign = True
+                    CouponCache.invalidate([coupon.code], [coupon.id],
+                                           [(coupon.applicable_to, coupon.applicable_id)])
+
+                existing = CouponCampaign._existing_codes(cursor, count)
+                conn.commit()
+
+                idle_rounds = 0
+                while inserted < count and idle_rounds < max_rounds:
+                    chunk = []
+                    while len(chunk) < min(batch_size, count - inserted):
+                        for code in CouponCampaign.random_codes(min(batch_size, count - inserted) - len(chunk), length):
+                            if code not in existing:
+                                existing.add(code)
+                                chunk.append(code)
+                    cursor.executemany(
+                        "INSERT IGNORE INTO coupon_codes (code, coupon_id) VALUES (%s, %s)",
+                        [(code, coupon.id) for code in chunk]
+                    )
+                    conn.commit()
+                    inserted += cursor.rowcount
+                    idle_rounds = 0 if cursor.rowcount else idle_rounds + 1
+
+                if inserted < count:
+                    return inserted, f"僅產生 {inserted} 組代碼"
+                return inserted, None
+        except Exception as e:
+            return inserted, str(e)
+        finally:
+            conn.close()
+
+    @staticmethod
+    def iter_codes(coupon_id, unused_only=False):
+        """Yield the campaign's codes in key order, batch by batch"""
+        batch_size = current_app.config['COUPON_CODE_BATCH']
+        unused_clause = "AND used_at IS NULL" if unused_only else ""
+        last_code = ''
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cursor:
+                while True:
+                    cursor.execute(f"""
+                        SELECT code FROM coupon_codes
+                        WHERE coupon_id = %s AND code > %s {unused_clause}
+                        ORDER BY code
+                        LIMIT %s
+                    """, (coupon_id, last_code, batch_size))
+                    rows = cursor.fetchall()
+                    for row in rows:
+                        yield row['code']
+                    if len(rows) < batch_size:
+                        return
+                    last_code = rows[-1]['code']
+        finally:
+            conn.close()
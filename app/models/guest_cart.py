@@ -0,0 +1,119 @@
+from flask import current_app, request
+from itsdangerous import Signer, BadSignature
+from app.utils.db import get_db_connection
+
+class GuestCart:
+    """Cart for anonymous visitors, kept in a signed cookie (no database writes)
+
+    The cookie value is a compact "product_id.qty-product_id.qty" list signed with
+    SECRET_KEY, e.g. "12.3-45.1".
+    """
+    COOKIE_NAME = 'guest_cart'
+    MAX_LINES = 50
+    MAX_QUANTITY = 99
+
+    def __init__(self, items=None):
+        # product_id -> quantity, in insertion order
+        self.items = dict(items or {})
+
+    @staticmethod
+    def _signer():
+        return Signer(current_app.config['SECRET_KEY'], salt='guest-cart')
+
+    @staticmethod
+    def encode(items):
+        """Encode product_id -> qty mapping into the compact cookie format"""
+        return '-'.join(f"{product_id}.{quantity}" for product_id, quantity in items.items())
+
+    @staticmethod
+    def decode(value):
+        """Decode the compact cookie format; malformed entries are dropped"""
+        items = {}
+        for entry in value.split('-') if value else []:
+            product_id, _, quantity = entry.partition('.')
+            if product_id.isdigit() and quantity.isdigit():
+                product_id, quantity = int(product_id), int(quantity)
+                if product_id > 0 and quantity > 0:
+                    items[product_id] = min(quantity, GuestCart.MAX_QUANTITY)
+            if len(items) >= GuestCart.MAX_LINES:
+                break
+        return items
+
+    @staticmethod
+    def load():
+        """Load the guest cart from the current request's cookie"""
+        value = request.cookies.get(GuestCart.COOKIE_NAME)
+        if not value:
+            return GuestCart()
+        try:
+            payload = GuestCart._signer().unsign(value).decode('ascii')
+        except (BadSignature, UnicodeDecodeError):
+            return GuestCart()
+        return GuestCart(GuestCart.decode(payload))
+
+    def save(self, response):
+        """Write the cart cookie onto response (or delete it when empty)"""
+        if not self.items:
+            response.delete_cookie(GuestCart.COOKIE_NAME)
+            return response
+        value = GuestCart._signer().sign(GuestCart.encode(self.items)).decode('ascii')
+        response.set_cookie(
+            GuestCart.COOKIE_NAME, value,
+            max_age=current_app.config['GUEST_CART_MAX_AGE'],
+            httponly=True, samesite='Lax'
+        )
+        return response
+
+    def add_item(self, product_id, quantity=1):
+        """Add quantity of a product"""
+        if product_id not in self.items and len(self.items) >= GuestCart.MAX_LINES:
+            return False, f"購物車最多 {GuestCart.MAX_LINES} 項商品"
+        self.items[product_id] = min(self.items.get(product_id, 0) + quantity, GuestCart.MAX_QUANTITY)
+        return True, None
+
+    def update_quantity(self, product_id, quantity):
+        """Set quantity of a product (removes it when quantity <= 0)"""
+        if quantity <= 0:
+            return self.remove_item(product_id)
+        if product_id not in self.items:
+            return False, "商品不在購物車中"
+        self.items[product_id] = min(quantity, GuestCart.MAX_QUANTITY)
+        return True, None
+
+    def remove_item(self, product_id):
+        """Remove a product"""
+        self.items.pop(product_id, None)
+        return True, None
+
+    def get_items(self):
+        """Resolve prices and stock for all lines in one batched query"""
+        if not self.items:
+            return []
+
+        from app.models.cart import Cart
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cursor:
+                product_ids = list(self.items)
+                placeholders = ','.join(['%s'] * len(product_ids))
+                cursor.execute(f"""
+                    SELECT p.id as product_id, p.name as product_name, p.price, p.discount_price,
+                           p.image_url, p.stock, p.category_id, s.store_name, s.id as store_id
+                    FROM products p
+                    JOIN stores s ON p.store_id = s.id
+                    WHERE p.id IN ({placeholders}) AND p.status = 'active' AND s.status = 'active'
+                """, product_ids)
+                rows = {row['product_id']: row for row in cursor.fetchall()}
+
+                # Keep the order in which lines were added (newest first, like Cart)
+                cart_items = []
+                for product_id in reversed(product_ids):
+                    row = rows.get(product_id)
+                    if row:
+                        row.update(id=None, member_id=None, quantity=self.items[product_id], added_at=None)
+                        cart_items.append(Cart._priced_line(row))
+                return cart_items
+        except Exception as e:
+            return []
+        finally:
+            conn.close()
@@ -0,0 +1,82 @@
+from app.models.outbox import Outbox
+
+class InsufficientStockError(Exception):
+    """Raised inside a transaction when a product cannot cover the requested quantity"""
+    def __init__(self, product_id, product_name=None):
+        self.product_id = product_id
+        self.product_name = product_name
+        super().__init__(f"商品「{product_name or product_id}」庫存不足")
+
+class Inventory:
+    """Stock bookkeeping on products.stock
+    
+    All methods take an open cursor so they join the caller's transaction.
+    Rows are always touched in ascending product id order, so concurrent
+    checkouts lock the same rows in the same order and cannot deadlock
+    each other.
+    """
+    
+    @staticmethod
+    def _group(lines):
+        """Sum (product_id, quantity) pairs per product, sorted by product id"""
+        totals = {}
+        for product_id, quantity in lines:
+            totals[product_id] = totals.get(product_id, 0) + quantity
+        return sorted(totals.items())
+    
+    @staticmethod
+    def reserve(cursor, lines, names=None, member_id=None):
+        """Atomically decrement stock for all lines or raise InsufficientStockError
+        
+        lines is an iterable of (product_id, quantity). When member_id is given,
+        stock held by other members' unexpired checkout holds is not available,
+        and the member's own holds on these products are consumed. The caller
+        must roll back the transaction on error; decrements already applied are
+        undone with it.
+        """
+        grouped = Inventory._group(lines)
+        for product_id, quantity in grouped:
+            if member_id is None:
+                cursor.execute(
+                    "UPDATE products SET stock = stock - %s WHERE id = %s AND stock >= %s",
+                    (quantity, product_id, quantity)
+                )
+            else:
+                cursor.execute("""
+                    UPDATE products SET stock = stock - %s
+                    WHERE id = %s AND stock - (
+                        SELECT COALESCE(SUM(r.quantity), 0) FROM stock_reservations r
+                        WHERE r.product_id = %s AND r.member_id != %s AND r.expires_at > NOW()
+                    ) >= %s
+                """, (quantity, product_id, product_id, member_id, quantity))
+            if cursor.rowcount == 0:
+                raise InsufficientStockError(product_id, (names or {}).get(product_id))
+        Outbox.emit_many(cursor, 'product.stock_changed', [(product_id, None) for product_id, _ in grouped])
+        
+        if member_id is not None and grouped:
+            placeholders = ','.join(['%s'] * len(grouped))
+            cursor.execute(
+                f"DELETE FROM stock_reservations WHERE member_id = %s AND product_id IN ({placeholders})",
+                [member_id] + [product_id for product_id, _ in grouped]
+            )
+    
+    @staticmethod
+    def release(cursor, lines):
+        """Return stock for (product_id, quantity) lines"""
+        grouped = Inventory._group(lines)
+        for product_id, quantity in grouped:
+            cursor.execute(
+                "UPDATE products SET stock = stock + %s WHERE id = %s",
+                (quantity, product_id)
+            )
+        Outbox.emit_many(cursor, 'product.stock_changed', [(product_id, None) for product_id, _ in grouped])
+    
+    @staticmethod
+    def release_orders(cursor, order_ids):
+        """Return stock for every line of several orders (one update per product)"""
+        placeholders = ','.join(['%s'] * len(order_ids))
+        cursor.execute(
+            f"SELECT product_id, quantity FROM order_items WHERE order_id IN ({placeholders})",
+            list(order_ids)
+        )
+        Inventory.release(cursor, [(row['product_id'], row['quantity']) for row in cursor.fetchall()])
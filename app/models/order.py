@@ -1,7 +1,35 @@
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime
-from app.utils.db import get_db_connection
+from decimal import Decimal
+from flask import current_app
+from app.utils.db import get_db_connection, run_in_transaction
+from app.models.inventory import Inventory
+from app.models.store_stats import StoreDailyStats
+from app.models.site_stats import SiteStats
+from app.models.outbox import Outbox
+from app.models.pricing import allocate_discount
 from app.utils.helpers import generate_order_number
 
+# Allowed transitions: target status -> statuses it may be reached from
+ORDER_TRANSITIONS = {
+    'confirmed': ('pending',),
+    'shipped': ('confirmed',),
+    'delivered': ('shipped',),
+    'cancelled': ('pending',),
+}
+
+MAX_BULK_ORDERS = 1000
+
+ORDER_FIELDS = ['id', 'member_id', 'order_number', 'total_amount', 'discount_amount',
+                'final_amount', 'coupon_id', 'status', 'created_at']
+
+# Archived row counts per listing: (from, where, params) -> (newest created_at, count, expires_at)
+_archive_counts = OrderedDict()
+_archive_counts_lock = threading.Lock()
+MAX_ARCHIVE_COUNTS = 10000
+
 class Order:
     def __init__(self, id=None, member_id=None, order_number=None, total_amount=None,
                  discount_amount=None, final_amount=None, coupon_id=None, status=None, created_at=None):
@@ -16,84 +44,292 @@ class Order:
         self.created_at = created_at
     
     @staticmethod
-    def create(member_id, cart_items, coupon_code=None):
-        """Create new order from cart items"""
+    def create(member_id, priced_cart, coupon_code=None, on_created=None, idempotency_key=None):
+        """Create new order from a PricedCart snapshot
+        
+        Stock for every line is decremented in the same transaction as the
+        order insert, consuming the member's checkout holds; the whole unit is
+        retried on deadlock. on_created(cursor, order_id), if given, runs
+        inside that transaction. An idempotency_key is stored under a unique
+        (member_id, idempotency_key) index; a concurrent duplicate submission
+        gets the original order back instead of an error. Callers claim the
+        key first (claim_idempotency_key); the claim is dropped with the
+        order insert, or released when the order fails.
+        """
+        total_amount = priced_cart.total_amount
+        
+        # Apply coupon if provided
+        discount_amount = Decimal('0.00')
+        coupon = None
+        if coupon_code:
+            from app.models.coupon import Coupon
+            coupon = Coupon.get_by_code(coupon_code)
+            if coupon:
+                is_valid, message, discount = priced_cart.check_coupon(coupon)
+                if is_valid:
+                    discount_amount = discount
+                else:
+                    coupon = None
+        
+        coupon_id = coupon.id if coupon else None
+        final_amount = total_amount - discount_amount
+        store_discounts = priced_cart.allocate_discount(coupon, discount_amount)
+        store_units = {}
+        for line in priced_cart.items:
+            store_units[line.store_id] = store_units.get(line.store_id, 0) + line.quantity
+        
+        def create_order(cursor):
+            order_number = generate_order_number()
+            
+            # Reserve stock first so an oversold cart fails before any insert
+            Inventory.reserve(
+                cursor,
+                [(line.product_id, line.quantity) for line in priced_cart.items],
+                names={line.product_id: line.product_name for line in priced_cart.items},
+                member_id=member_id
+            )
+            
+            # Create order
+            cursor.execute("""
+                INSERT INTO orders (member_id, order_number, total_amount, discount_amount, 
+                                  final_amount, coupon_id, status, idempotency_key)
+                VALUES (%s, %s, %s, %s, %s, %s, 'pending', %s)
+            """, (member_id, order_number, total_amount, discount_amount, final_amount, coupon_id,
+                  idempotency_key))
+            
+            order_id = cursor.lastrowid
+            
+            # Create order items with store and product name snapshots
+            cursor.executemany("""
+                INSERT INTO order_items (order_id, product_id, store_id, product_name, quantity, price, subtotal)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+            """, [(order_id, line.product_id, line.store_id, line.product_name, line.quantity,
+                   line.price, line.subtotal)
+                  for line in priced_cart.items])
+            
+            # Link the order to each store it contains, for store-scoped listings
+            cursor.execute("SELECT created_at FROM orders WHERE id = %s", (order_id,))
+            created_at = cursor.fetchone()['created_at']
+            cursor.executemany("""
+                INSERT INTO store_orders (store_id, order_id, created_at, store_subtotal, store_discount, units)
+                VALUES (%s, %s, %s, %s, %s, %s)
+            """, [(store_id, order_id, created_at, subtotal, store_discounts[store_id], store_units[store_id])
+                  for store_id, subtotal in priced_cart.store_subtotals.items()])
+            
+            # Redeem coupon in the same transaction; exhausted coupons fail the order
+            if coupon:
+                coupon.redeem(cursor, member_id, order_id)
+            
+            StoreDailyStats.record_order(cursor, order_id)
+            SiteStats.adjust(cursor, total_orders=1, total_revenue=final_amount)
+            
+            if on_created:
+                on_created(cursor, order_id)
+            
+            # Clear cart
+            cursor.execute("DELETE FROM cart WHERE member_id = %s", (member_id,))
+            
+            if idempotency_key:
+                cursor.execute(
+                    "DELETE FROM order_claims WHERE member_id = %s AND idempotency_key = %s",
+                    (member_id, idempotency_key)
+                )
+            
+            Outbox.emit(cursor, 'order.created', order_id, {
+                'member_id': member_id,
+                'store_ids': sorted(priced_cart.store_subtotals),
+                'product_ids': sorted({line.product_id for line in priced_cart.items}),
+                'coupon_id': coupon_id
+            })
+            Outbox.emit(cursor, 'cart.updated', member_id)
+            
+            return order_id, order_number
+        
+        try:
+            order_id, order_number = run_in_transaction(create_order)
+        except Exception as e:
+            # A duplicate submission that lost the race (on the unique key, or
+            # on stock the original already took) returns the original order
+            if idempotency_key:
+                existing = Order.get_by_idempotency_key(member_id, idempotency_key)
+                if existing:
+                    return existing, None
+                Order.release_idempotency_key(member_id, idempotency_key)
+            # InsufficientStockError / CouponUnavailableError carry user-facing messages
+            return None, str(e)
+        
+        return Order(id=order_id, member_id=member_id, order_number=order_number,
+                   total_amount=total_amount, discount_amount=discount_amount,
+                   final_amount=final_amount, coupon_id=coupon_id, status='pending'), None
+    
+    @staticmethod
+    def claim_idempotency_key(member_id, idempotency_key):
+        """Claim a checkout's idempotency key before any pricing or stock work
+        
+        Returns (order, claimed). order is the order already placed with the
+        key; claimed is True when this request now owns the key and should
+        create the order. A resubmission that finds the key claimed by a
+        checkout still running polls for its order for up to ORDER_CLAIM_WAIT
+        seconds, and claims the key itself if the original fails. Claims
+        older than ORDER_CLAIM_TIMEOUT (a request that died) are taken over.
+        """
+        config = current_app.config
+        deadline = time.monotonic() + config['ORDER_CLAIM_WAIT']
         conn = get_db_connection()
         try:
             with conn.cursor() as cursor:
-                # Calculate total amount
-                total_amount = sum(item['subtotal'] for item in cart_items)
-                
-                # Apply coupon if provided
-                discount_amount = 0
-                coupon_id = None
-                if coupon_code:
-                    from app.models.coupon import Coupon
-                    coupon = Coupon.get_by_code(coupon_code)
-                    if coupon:
-                        product_ids = [item['product_id'] for item in cart_items]
-                        store_id = cart_items[0]['store_id'] if cart_items else None
-                        
-                        is_valid, message = coupon.is_valid(total_amount, product_ids, store_id)
-                        if is_valid:
-                            discount_amount = coupon.calculate_discount(total_amount)
-                            coupon_id = coupon.id
-                            coupon.use_coupon()
-                
-                final_amount = total_amount - discount_amount
-                order_number = generate_order_number()
-                
-                # Create order
-                cursor.execute("""
-                    INSERT INTO orders (member_id, order_number, total_amount, discount_amount, 
-                                      final_amount, coupon_id, status)
-                    VALUES (%s, %s, %s, %s, %s, %s, 'pending')
-                """, (member_id, order_number, total_amount, discount_amount, final_amount, coupon_id))
-                
-                order_id = cursor.lastrowid
-                
-                # Create order items
-                for item in cart_items:
-                    cursor.execute("""
-                        INSERT INTO order_items (order_id, product_id, quantity, price, subtotal)
-                        VALUES (%s, %s, %s, %s, %s)
-                    """, (order_id, item['product_id'], item['quantity'], item['price'], item['subtotal']))
-                
-                # Clear cart
-                cursor.execute("DELETE FROM cart WHERE member_id = %s", (member_id,))
-                
+                while True:
+                    cursor.execute(
+                        "INSERT IGNORE INTO order_claims (member_id, idempotency_key) VALUES (%s, %s)",
+                        (member_id, idempotency_key)
+                    )
+                    claimed = cursor.rowcount == 1
+                    if not claimed:
+                        cursor.execute("""
+                            UPDATE order_claims SET claimed_at = NOW()
+                            WHERE member_id = %s AND idempotency_key = %s
+                              AND claimed_at < NOW() - INTERVAL %s SECOND
+                        """, (member_id, idempotency_key, config['ORDER_CLAIM_TIMEOUT']))
+                        claimed = cursor.rowcount == 1
+                    conn.commit()
+                    
+                    # The original may have committed just before the claim
+                    cursor.execute(f"""
+                        SELECT {', '.join(ORDER_FIELDS)} FROM orders
+                        WHERE member_id = %s AND idempotency_key = %s
+                    """, (member_id, idempotency_key))
+                    result = cursor.fetchone()
+                    conn.commit()
+                    if result:
+                        if claimed:
+                            Order.release_idempotency_key(member_id, idempotency_key)
+                        return Order(**result), False
+                    if claimed or time.monotonic() >= deadline:
+                        return None, claimed
+                    time.sleep(config['ORDER_CLAIM_POLL_INTERVAL'])
+        except Exception as e:
+            # The unique order index still rejects a second order
+            return None, True
+        finally:
+            conn.close()
+    
+    @staticmethod
+    def release_idempotency_key(member_id, idempotency_key):
+        """Drop a claim whose checkout did not create an order"""
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    "DELETE FROM order_claims WHERE member_id = %s AND idempotency_key = %s",
+                    (member_id, idempotency_key)
+                )
                 conn.commit()
-                
-                return Order(id=order_id, member_id=member_id, order_number=order_number,
-                           total_amount=total_amount, discount_amount=discount_amount,
-                           final_amount=final_amount, coupon_id=coupon_id, status='pending'), None
         except Exception as e:
-            return None, str(e)
+            pass
         finally:
             conn.close()
     
     @staticmethod
-    def get_by_member(member_id, page=1, per_page=10):
-        """Get orders by member with pagination"""
+    def get_by_idempotency_key(member_id, idempotency_key):
+        """Get the order a member already placed with this idempotency key"""
         conn = get_db_connection()
         try:
             with conn.cursor() as cursor:
-                # Get total count
-                cursor.execute("SELECT COUNT(*) as total FROM orders WHERE member_id = %s", (member_id,))
-                total = cursor.fetchone()['total']
-                
-                # Get orders with pagination
-                offset = (page - 1) * per_page
                 cursor.execute("""
                     SELECT id, member_id, order_number, total_amount, discount_amount, 
                            final_amount, coupon_id, status, created_at
-                    FROM orders 
-                    WHERE member_id = %s 
-                    ORDER BY created_at DESC 
-                    LIMIT %s OFFSET %s
-                """, (member_id, per_page, offset))
-                
-                results = cursor.fetchall()
+                    FROM orders WHERE member_id = %s AND idempotency_key = %s
+                """, (member_id, idempotency_key))
+                result = cursor.fetchone()
+                if result:
+                    return Order(**result)
+                return None
+        except Exception as e:
+            return None
+        finally:
+            conn.close()
+    
+    @staticmethod
+    def _archive_count(cursor, cold_from, where, params, newest):
+        """Number of archived rows for a listing, cached per process
+        
+        The archive only changes when orders are archived, so the count is
+        reused for ORDER_ARCHIVE_COUNT_TTL seconds while the newest archived
+        created_at stays the same.
+        """
+        key = (cold_from, where, tuple(params))
+        now = time.monotonic()
+        with _archive_counts_lock:
+            cached = _archive_counts.get(key)
+            if cached and cached[0] == newest and cached[2] > now:
+                _archive_counts.move_to_end(key)
+                return cached[1]
+        cursor.execute(f"SELECT COUNT(*) as total FROM {cold_from} WHERE {where}", params)
+        count = cursor.fetchone()['total']
+        with _archive_counts_lock:
+            _archive_counts[key] = (newest, count, now + current_app.config['ORDER_ARCHIVE_COUNT_TTL'])
+            _archive_counts.move_to_end(key)
+            while len(_archive_counts) > MAX_ARCHIVE_COUNTS:
+                _archive_counts.popitem(last=False)
+        return count
+    
+    @staticmethod
+    def _fetch_page(cursor, hot_from, cold_from, where, params, page, per_page,
+                    created_column='o.created_at', id_column='o.id'):
+        """One page of orders, newest first, from the hot tables and the archive
+        
+        hot_from/cold_from are FROM clauses that alias the orders table as o.
+        Open orders are never archived, so old hot rows can sort below archived
+        ones; the split is by time instead. A page whose rows are all newer
+        than the newest archived row (one index lookup) is read from the hot
+        tables alone. Otherwise each table contributes its first
+        offset + per_page rows and the page is cut from their merge.
+        Returns (rows, total).
+        """
+        params = list(params)
+        columns = ', '.join(f'o.{field}' for field in ORDER_FIELDS)
+        sort = f'{created_column} DESC, {id_column} DESC'
+        cursor.execute(f"SELECT {created_column} as created_at FROM {cold_from} WHERE {where} ORDER BY {sort} LIMIT 1",
+                       params)
+        newest = cursor.fetchone()
+        newest = newest['created_at'] if newest else None
+        cursor.execute(f"SELECT COUNT(*) as total FROM {hot_from} WHERE {where}", params)
+        total = cursor.fetchone()['total']
+        if newest is not None:
+            total += Order._archive_count(cursor, cold_from, where, params, newest)
+        
+        offset = (page - 1) * per_page
+        cursor.execute(f"""
+            SELECT {columns} FROM {hot_from}
+            WHERE {where}
+            ORDER BY {sort}
+            LIMIT %s OFFSET %s
+        """, params + [per_page, offset])
+        rows = cursor.fetchall()
+        if newest is None or (len(rows) == per_page and rows[-1]['created_at'] > newest):
+            return rows, total
+        
+        cursor.execute(f"""
+            SELECT * FROM (
+                (SELECT {columns} FROM {hot_from} WHERE {where} ORDER BY {sort} LIMIT %s)
+                UNION ALL
+                (SELECT {columns} FROM {cold_from} WHERE {where} ORDER BY {sort} LIMIT %s)
+            ) page
+            ORDER BY created_at DESC, id DESC
+            LIMIT %s OFFSET %s
+        """, params + [offset + per_page] + params + [offset + per_page, per_page, offset])
+        return cursor.fetchall(), total
+    
+    @staticmethod
+    def get_by_member(member_id, page=1, per_page=10):
+        """Get orders by member with pagination"""
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cursor:
+                results, total = Order._fetch_page(
+                    cursor, 'orders o', 'orders_archive o',
+                    'o.member_id = %s', [member_id], page, per_page
+                )
                 orders = [Order(**result) for result in results]
                 
                 return orders, total
@@ -104,34 +340,17 @@ class Order:
     
     @staticmethod
     def get_by_store(store_id, page=1, per_page=10):
-        """Get orders for a specific store"""
+        """Get orders for a specific store (range scan on store_orders)"""
         conn = get_db_connection()
         try:
             with conn.cursor() as cursor:
-                # Get total count
-                cursor.execute("""
-                    SELECT COUNT(DISTINCT o.id) as total
-                    FROM orders o
-                    JOIN order_items oi ON o.id = oi.order_id
-                    JOIN products p ON oi.product_id = p.id
-                    WHERE p.store_id = %s
-                """, (store_id,))
-                total = cursor.fetchone()['total']
-                
-                # Get orders with pagination
-                offset = (page - 1) * per_page
-                cursor.execute("""
-                    SELECT DISTINCT o.id, o.member_id, o.order_number, o.total_amount, o.discount_amount, 
-                           o.final_amount, o.coupon_id, o.status, o.created_at
-                    FROM orders o
-                    JOIN order_items oi ON o.id = oi.order_id
-                    JOIN products p ON oi.product_id = p.id
-                    WHERE p.store_id = %s
-                    ORDER BY o.created_at DESC 
-                    LIMIT %s OFFSET %s
-                """, (store_id, per_page, offset))
-                
-                results = cursor.fetchall()
+                results, total = Order._fetch_page(
+                    cursor,
+                    'store_orders so JOIN orders o ON o.id = so.order_id',
+                    'store_orders_archive so JOIN orders_archive o ON o.id = so.order_id',
+                    'so.store_id = %s', [store_id], page, per_page,
+                    created_column='so.created_at', id_column='so.order_id'
+                )
                 orders = [Order(**result) for result in results]
                 
                 return orders, total
@@ -140,85 +359,320 @@ class Order:
         finally:
             conn.close()
     
+    @staticmethod
+    def backfill_store_links(batch_size=1000):
+        """Fill order_items.store_id/product_name and store_orders for old orders
+        
+        Works through orders in id batches, each in its own short transaction.
+        Returns the number of orders processed.
+        """
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT COALESCE(MAX(id), 0) as max_id FROM orders")
+                max_id = cursor.fetchone()['max_id']
+                processed = 0
+                for start in range(1, max_id + 1, batch_size):
+                    end = start + batch_size - 1
+                    cursor.execute("""
+                        UPDATE order_items oi
+                        JOIN products p ON oi.product_id = p.id
+                        SET oi.store_id = p.store_id, oi.product_name = COALESCE(oi.product_name, p.name)
+                        WHERE oi.order_id BETWEEN %s AND %s AND oi.store_id IS NULL
+                    """, (start, end))
+                    # Per-store totals, and for category coupons the part in the
+                    # coupon's category, so the discount is split as at checkout
+                    cursor.execute("""
+                        SELECT o.id, o.created_at, o.discount_amount, c.applicable_to, c.applicable_id,
+                               oi.store_id, SUM(oi.subtotal) as store_subtotal, SUM(oi.quantity) as units,
+                               SUM(CASE WHEN c.applicable_to = 'category' AND p.category_id = c.applicable_id
+                                        THEN oi.subtotal ELSE 0 END) as category_subtotal
+                        FROM orders o
+                        JOIN order_items oi ON oi.order_id = o.id
+                        LEFT JOIN products p ON p.id = oi.product_id
+                        LEFT JOIN coupons c ON c.id = o.coupon_id
+                        WHERE o.id BETWEEN %s AND %s AND oi.store_id IS NOT NULL
+                          AND NOT EXISTS (SELECT 1 FROM store_orders so WHERE so.order_id = o.id)
+                        GROUP BY o.id, o.created_at, o.discount_amount, c.applicable_to, c.applicable_id,
+                                 oi.store_id
+                        ORDER BY o.id
+                    """, (start, end))
+                    by_order = {}
+                    for row in cursor.fetchall():
+                        by_order.setdefault(row['id'], []).append(row)
+                    links = []
+                    for order_id, rows in by_order.items():
+                        first = rows[0]
+                        store_discounts = allocate_discount(
+                            Decimal(first['discount_amount'] or 0),
+                            {row['store_id']: Decimal(row['store_subtotal']) for row in rows},
+                            first['applicable_to'], first['applicable_id'],
+                            {row['store_id']: Decimal(row['category_subtotal']) for row in rows}
+                        )
+                        links.extend((row['store_id'], order_id, row['created_at'], row['store_subtotal'],
+                                      store_discounts[row['store_id']], row['units']) for row in rows)
+                    if links:
+                        cursor.executemany("""
+                            INSERT IGNORE INTO store_orders (store_id, order_id, created_at, store_subtotal,
+                                                             store_discount, units)
+                            VALUES (%s, %s, %s, %s, %s, %s)
+                        """, links)
+                    conn.commit()
+                    cursor.execute(
+                        "SELECT COUNT(*) as count FROM orders WHERE id BETWEEN %s AND %s",
+                        (start, end)
+                    )
+                    processed += cursor.fetchone()['count']
+                return processed
+        finally:
+            conn.close()
+    
     @staticmethod
     def get_by_id(order_id):
-        """Get order by ID"""
+        """Get order by ID (falls back to the archive)"""
         conn = get_db_connection()
         try:
             with conn.cursor() as cursor:
-                cursor.execute("""
-                    SELECT id, member_id, order_number, total_amount, discount_amount, 
-                           final_amount, coupon_id, status, created_at
-                    FROM orders WHERE id = %s
-                """, (order_id,))
-                result = cursor.fetchone()
-                if result:
-                    return Order(**result)
+                for table in ('orders', 'orders_archive'):
+                    cursor.execute(f"""
+                        SELECT id, member_id, order_number, total_amount, discount_amount, 
+                               final_amount, coupon_id, status, created_at
+                        FROM {table} WHERE id = %s
+                    """, (order_id,))
+                    result = cursor.fetchone()
+                    if result:
+                        return Order(**result)
                 return None
         except Exception as e:
             return None
         finally:
             conn.close()
     
-    def get_items(self):
-        """Get order items"""
+    @staticmethod
+    def get_detail(order_id, member_id=None):
+        """Load an order with its items and coupon in one query
+        
+        Returns an Order with `items` (list of dicts, using the name/store
+        snapshots taken at checkout) and `coupon` (Coupon or None), or None
+        when the order does not exist or belongs to another member. Archived
+        orders are looked up only when the order is not in the hot tables.
+        """
         conn = get_db_connection()
         try:
             with conn.cursor() as cursor:
-                cursor.execute("""
-                    SELECT oi.id, oi.product_id, oi.quantity, oi.price, oi.subtotal,
-                           p.name as product_name, p.image_url, s.store_name
-                    FROM order_items oi
-                    JOIN products p ON oi.product_id = p.id
-                    JOIN stores s ON p.store_id = s.id
-                    WHERE oi.order_id = %s
-                """, (self.id,))
-                return cursor.fetchall()
+                member_clause = 'AND o.member_id = %s' if member_id is not None else ''
+                params = (order_id, member_id) if member_id is not None else (order_id,)
+                for orders_table, items_table in (('orders', 'order_items'),
+                                                  ('orders_archive', 'order_items_archive')):
+                    cursor.execute(f"""
+                        SELECT o.id, o.member_id, o.order_number, o.total_amount, o.discount_amount,
+                               o.final_amount, o.coupon_id, o.status, o.created_at,
+                               oi.id as item_id, oi.product_id, oi.quantity, oi.price, oi.subtotal,
+                               COALESCE(oi.product_name, p.name) as product_name, p.image_url,
+                               s.id as store_id, s.store_name,
+                               c.code as coupon_code, c.discount_type as coupon_discount_type,
+                               c.discount_value as coupon_discount_value,
+                               c.min_purchase as coupon_min_purchase, c.max_discount as coupon_max_discount,
+                               c.valid_from as coupon_valid_from, c.valid_to as coupon_valid_to,
+                               c.applicable_to as coupon_applicable_to, c.applicable_id as coupon_applicable_id
+                        FROM {orders_table} o
+                        LEFT JOIN {items_table} oi ON oi.order_id = o.id
+                        LEFT JOIN products p ON p.id = oi.product_id
+                        LEFT JOIN stores s ON s.id = COALESCE(oi.store_id, p.store_id)
+                        LEFT JOIN coupons c ON c.id = o.coupon_id
+                        WHERE o.id = %s {member_clause}
+                        ORDER BY oi.id
+                    """, params)
+                    rows = cursor.fetchall()
+                    if rows:
+                        break
+                else:
+                    return None
+                
+                first = rows[0]
+                order = Order(**{key: first[key] for key in ORDER_FIELDS})
+                order.items = [{
+                    'id': row['item_id'],
+                    'product_id': row['product_id'],
+                    'quantity': row['quantity'],
+                    'price': row['price'],
+                    'subtotal': row['subtotal'],
+                    'product_name': row['product_name'],
+                    'image_url': row['image_url'],
+                    'store_id': row['store_id'],
+                    'store_name': row['store_name']
+                } for row in rows if row['item_id'] is not None]
+                
+                order.coupon = None
+                if first['coupon_code'] is not None:
+                    from app.models.coupon import Coupon
+                    order.coupon = Coupon(id=first['coupon_id'], **{
+                        key[len('coupon_'):]: value for key, value in first.items()
+                        if key.startswith('coupon_') and key != 'coupon_id'
+                    })
+                return order
         except Exception as e:
-            return []
+            return None
         finally:
             conn.close()
     
-    def update_status(self, status):
-        """Update order status"""
+    @staticmethod
+    def load_item_previews(orders, per_order=4):
+        """Attach `preview_items` and `item_count` to a page of orders in one query"""
+        for order in orders:
+            order.preview_items = []
+            order.item_count = 0
+        if not orders:
+            return orders
+        
+        by_id = {order.id: order for order in orders}
         conn = get_db_connection()
         try:
             with conn.cursor() as cursor:
-                cursor.execute(
-                    "UPDATE orders SET status = %s WHERE id = %s",
-                    (status, self.id)
-                )
-                conn.commit()
-                self.status = status
-                return True
+                pending = list(by_id)
+                for items_table in ('order_items', 'order_items_archive'):
+                    placeholders = ','.join(['%s'] * len(pending))
+                    cursor.execute(f"""
+                        SELECT oi.order_id, oi.product_id, oi.quantity,
+                               COALESCE(oi.product_name, p.name) as product_name, p.image_url
+                        FROM {items_table} oi
+                        LEFT JOIN products p ON p.id = oi.product_id
+                        WHERE oi.order_id IN ({placeholders})
+                        ORDER BY oi.order_id, oi.id
+                    """, pending)
+                    for row in cursor.fetchall():
+                        order = by_id[row['order_id']]
+                        order.item_count += row['quantity']
+                        if len(order.preview_items) < per_order:
+                            order.preview_items.append(row)
+                    # Only orders with no hot items can be archived ones
+                    pending = [order_id for order_id in pending if not by_id[order_id].item_count]
+                    if not pending:
+                        break
         except Exception as e:
-            return False
+            pass
+        finally:
+            conn.close()
+        return orders
+    
+    def get_items(self):
+        """Get order items (falls back to the archive)"""
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cursor:
+                for items_table in ('order_items', 'order_items_archive'):
+                    cursor.execute(f"""
+                        SELECT oi.id, oi.product_id, oi.quantity, oi.price, oi.subtotal,
+                               COALESCE(oi.product_name, p.name) as product_name, p.image_url, s.store_name
+                        FROM {items_table} oi
+                        JOIN products p ON oi.product_id = p.id
+                        JOIN stores s ON s.id = COALESCE(oi.store_id, p.store_id)
+                        WHERE oi.order_id = %s
+                    """, (self.id,))
+                    items = cursor.fetchall()
+                    if items:
+                        return items
+                return []
+        except Exception as e:
+            return []
         finally:
             conn.close()
     
+    def update_status(self, status, actor_type=None, actor_id=None):
+        """Move this order to status if ORDER_TRANSITIONS allows it"""
+        updated, skipped, error = Order.transition_many([self.id], status, actor_type, actor_id)
+        if not updated:
+            return False
+        self.status = status
+        return True
+    
+    @staticmethod
+    def transition_many(order_ids, status, actor_type=None, actor_id=None, store_id=None, member_id=None):
+        """Apply one status transition to many orders in a single transaction
+        
+        Only orders whose current status is an allowed source for `status`
+        (and, with store_id, that contain that store's products; with
+        member_id, that belong to that member) change; the rest are reported
+        as skipped. Cancelling returns stock and updates the
+        sales counters. Every change is recorded in order_events.
+        
+        Returns (updated_ids, skipped_ids, error).
+        """
+        allowed_from = ORDER_TRANSITIONS.get(status)
+        if allowed_from is None:
+            return [], list(order_ids), "無效的訂單狀態"
+        
+        try:
+            order_ids = sorted({int(order_id) for order_id in order_ids})
+        except (TypeError, ValueError):
+            return [], [], "無效的訂單編號"
+        if not order_ids:
+            return [], [], None
+        if len(order_ids) > MAX_BULK_ORDERS:
+            return [], order_ids, f"一次最多更新 {MAX_BULK_ORDERS} 筆訂單"
+        
+        def apply_transition(cursor):
+            id_placeholders = ','.join(['%s'] * len(order_ids))
+            status_placeholders = ','.join(['%s'] * len(allowed_from))
+            scope_clause = ''
+            params = list(order_ids) + list(allowed_from)
+            if store_id is not None:
+                scope_clause = 'AND id IN (SELECT order_id FROM store_orders WHERE store_id = %s)'
+                params.append(store_id)
+            if member_id is not None:
+                scope_clause += ' AND member_id = %s'
+                params.append(member_id)
+            
+            # Lock the eligible rows in id order, then move them in one UPDATE
+            cursor.execute(f"""
+                SELECT id, status, final_amount FROM orders
+                WHERE id IN ({id_placeholders}) AND status IN ({status_placeholders}) {scope_clause}
+                ORDER BY id
+                FOR UPDATE
+            """, params)
+            eligible = cursor.fetchall()
+            if not eligible:
+                return []
+            
+            eligible_ids = [row['id'] for row in eligible]
+            placeholders = ','.join(['%s'] * len(eligible_ids))
+            cursor.execute(f"""
+                UPDATE orders SET status = %s
+                WHERE id IN ({placeholders}) AND status IN ({status_placeholders})
+            """, [status] + eligible_ids + list(allowed_from))
+            
+            if status == 'cancelled':
+                Inventory.release_orders(cursor, eligible_ids)
+                StoreDailyStats.record_cancellations(cursor, eligible_ids)
+                SiteStats.adjust(cursor, total_revenue=-sum(row['final_amount'] for row in eligible))
+            
+            cursor.executemany("""
+                INSERT INTO order_events (order_id, from_status, to_status, actor_type, actor_id)
+                VALUES (%s, %s, %s, %s, %s)
+            """, [(row['id'], row['status'], status, actor_type, actor_id) for row in eligible])
+            Outbox.emit_many(cursor, 'order.status_changed', [
+                (row['id'], {'from': row['status'], 'to': status}) for row in eligible
+            ])
+            return eligible_ids
+        
+        try:
+            updated = run_in_transaction(apply_transition)
+        except Exception as e:
+            return [], order_ids, str(e)
+        
+        updated_set = set(updated)
+        return updated, [order_id for order_id in order_ids if order_id not in updated_set], None
+    
     @staticmethod
     def get_all(page=1, per_page=10):
         """Get all orders (admin)"""
         conn = get_db_connection()
         try:
             with conn.cursor() as cursor:
-                # Get total count
-                cursor.execute("SELECT COUNT(*) as total FROM orders")
-                total = cursor.fetchone()['total']
-                
-                # Get orders with pagination
-                offset = (page - 1) * per_page
-                cursor.execute("""
-                    SELECT o.id, o.member_id, o.order_number, o.total_amount, o.discount_amount, 
-                           o.final_amount, o.coupon_id, o.status, o.created_at, m.name as member_name
-                    FROM orders o
-                    JOIN members m ON o.member_id = m.id
-                    ORDER BY o.created_at DESC 
-                    LIMIT %s OFFSET %s
-                """, (per_page, offset))
-                
-                results = cursor.fetchall()
-                orders = [Order(**{k: v for k, v in result.items() if k in ['id', 'member_id', 'order_number', 'total_amount', 'discount_amount', 'final_amount', 'coupon_id', 'status', 'created_at']}) for result in results]
+                results, total = Order._fetch_page(
+                    cursor, 'orders o', 'orders_archive o', '1 = 1', [], page, per_page
+                )
+                orders = [Order(**result) for result in results]
                 
                 return orders, total
         except Exception as e:
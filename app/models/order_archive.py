@@ -0,0 +1,95 @@
+from flask import current_app
+from app.utils.db import get_db_connection, run_in_transaction
+
+# Statuses after which an order never changes again
+CLOSED_STATUSES = ('delivered', 'cancelled')
+
+# Hot table -> (archive table, order id column, columns copied)
+ARCHIVE_TABLES = {
+    'orders': ('orders_archive', 'id', [
+        'id', 'member_id', 'order_number', 'total_amount', 'discount_amount',
+        'final_amount', 'coupon_id', 'status', 'created_at'
+    ]),
+    'order_items': ('order_items_archive', 'order_id', [
+        'id', 'order_id', 'product_id', 'store_id', 'product_name', 'quantity', 'price', 'subtotal'
+    ]),
+    'store_orders': ('store_orders_archive', 'order_id', [
+        'store_id', 'order_id', 'created_at', 'store_subtotal', 'store_discount', 'units'
+    ]),
+    'order_events': ('order_events_archive', 'order_id', [
+        'id', 'order_id', 'from_status', 'to_status', 'actor_type', 'actor_id', 'created_at'
+    ]),
+    'coupon_redemptions': ('coupon_redemptions_archive', 'order_id', [
+        'id', 'coupon_id', 'member_id', 'order_id', 'redeemed_at'
+    ]),
+}
+
+class OrderArchive:
+    """Moves closed orders older than ORDER_ARCHIVE_AFTER_DAYS into *_archive tables
+
+    The archive tables mirror the hot ones without foreign keys. Each batch
+    copies the rows and deletes the hot orders (children go by ON DELETE
+    CASCADE) in its own short transaction that only locks the batch's order
+    rows by primary key.
+    """
+
+    @staticmethod
+    def _candidates(after_days, batch_size):
+        """Ids of closed orders past the horizon (plain read, no locks)"""
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cursor:
+                placeholders = ','.join(['%s'] * len(CLOSED_STATUSES))
+                cursor.execute(f"""
+                    SELECT id FROM orders
+                    WHERE created_at < NOW() - INTERVAL %s DAY AND status IN ({placeholders})
+                    ORDER BY created_at, id
+                    LIMIT %s
+                """, [after_days] + list(CLOSED_STATUSES) + [batch_size])
+                return [row['id'] for row in cursor.fetchall()]
+        finally:
+            conn.close()
+
+    @staticmethod
+    def archive_batch(order_ids):
+        """Move one batch of orders; returns the number actually archived"""
+        def move(cursor):
+            placeholders = ','.join(['%s'] * len(order_ids))
+            status_placeholders = ','.join(['%s'] * len(CLOSED_STATUSES))
+            # Re-check under lock: only still-closed orders are moved
+            cursor.execute(f"""
+                SELECT id FROM orders
+                WHERE id IN ({placeholders}) AND status IN ({status_placeholders})
+                ORDER BY id
+                FOR UPDATE
+            """, list(order_ids) + list(CLOSED_STATUSES))
+            locked = [row['id'] for row in cursor.fetchall()]
+            if not locked:
+                return 0
+
+            placeholders = ','.join(['%s'] * len(locked))
+            for table, (archive, id_column, columns) in ARCHIVE_TABLES.items():
+                column_list = ', '.join(columns)
+                cursor.execute(f"""
+                    INSERT IGNORE INTO {archive} ({column_list})
+                    SELECT {column_list} FROM {table} WHERE {id_column} IN ({placeholders})
+                """, locked)
+            cursor.execute(f"DELETE FROM orders WHERE id IN ({placeholders})", locked)
+            return len(locked)
+
+        return run_in_transaction(move)
+
+    @staticmethod
+    def archive_closed(after_days=None, batch_size=None):
+        """Archive all eligible orders batch by batch; returns the number moved"""
+        after_days = after_days if after_days is not None else current_app.config['ORDER_ARCHIVE_AFTER_DAYS']
+        batch_size = batch_size or current_app.config['ORDER_ARCHIVE_BATCH']
+        moved = 0
+        while True:
+            order_ids = OrderArchive._candidates(after_days, batch_size)
+            if not order_ids:
+                return moved
+            archived = OrderArchive.archive_batch(order_ids)
+            moved += archived
+            if not archived or len(order_ids) < batch_size:
+                return moved
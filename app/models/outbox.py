@@ -0,0 +1,172 @@
+import json
+import threading
+import time
+from flask import current_app
+from app.utils.db import get_db_connection
+
+# (topic pattern, handler) pairs; see Outbox.subscribe
+_subscribers = []
+_subscribers_lock = threading.Lock()
+
+# This process's read position in outbox_events. Ids below last_id that were
+# not seen yet (transactions that had not committed) are kept in gaps with the
+# time they were noticed, and re-read until OUTBOX_GAP_TIMEOUT.
+_position = {'last_id': None, 'gaps': {}}
+MAX_GAPS = 1000
+_dispatch_lock = threading.Lock()
+
+class OutboxEvent:
+    def __init__(self, id=None, topic=None, entity_id=None, payload=None, created_at=None):
+        self.id = id
+        self.topic = topic
+        self.entity_id = entity_id
+        self.payload = json.loads(payload) if isinstance(payload, str) else (payload or {})
+        self.created_at = created_at
+
+class Outbox:
+    """Change feed of model writes, kept in outbox_events
+
+    Model methods call emit() with their own cursor, so an event is committed
+    exactly when the change it describes is. Every process tails the table
+    from the id it started at (dispatch, run by a background task) and hands
+    each batch to the handlers registered with subscribe(). Delivery is per
+    process and at most once: a handler that raises is logged and skipped.
+    """
+
+    @staticmethod
+    def emit(cursor, topic, entity_id, payload=None):
+        """Record one change inside the caller's transaction"""
+        Outbox.emit_many(cursor, topic, [(entity_id, payload)])
+
+    @staticmethod
+    def emit_many(cursor, topic, events):
+        """Record (entity_id, payload) changes inside the caller's transaction"""
+        if not events:
+            return
+        cursor.executemany(
+            "INSERT INTO outbox_events (topic, entity_id, payload) VALUES (%s, %s, %s)",
+            [(topic, entity_id, json.dumps(payload, default=str) if payload else None)
+             for entity_id, payload in events]
+        )
+
+    @staticmethod
+    def subscribe(pattern, handler=None):
+        """Register handler(events) for a topic ('product.updated'), prefix ('product.*') or '*'
+
+        Usable as a decorator. Handlers receive the matching events of each
+        batch as a list of OutboxEvent, in id order.
+        """
+        def register(handler):
+            with _subscribers_lock:
+                _subscribers.append((pattern, handler))
+            return handler
+        return register(handler) if handler else register
+
+    @staticmethod
+    def _matches(pattern, topic):
+        if pattern == '*':
+            return True
+        if pattern.endswith('.*'):
+            return topic.startswith(pattern[:-1])
+        return pattern == topic
+
+    @staticmethod
+    def _deliver(events):
+        with _subscribers_lock:
+            subscribers = list(_subscribers)
+        for pattern, handler in subscribers:
+            matching = [event for event in events if Outbox._matches(pattern, event.topic)]
+            if not matching:
+                continue
+            try:
+                handler(matching)
+            except Exception as e:
+                current_app.logger.warning('Outbox subscriber %s failed: %s',
+                                           getattr(handler, '__qualname__', handler), e)
+
+    @staticmethod
+    def _read_batch(cursor, batch_size):
+        """Events after last_id plus any still-missing gap ids"""
+        gaps = sorted(_position['gaps'])
+        gap_clause = f"OR id IN ({','.join(['%s'] * len(gaps))})" if gaps else ''
+        cursor.execute(f"""
+            SELECT id, topic, entity_id, payload, created_at FROM outbox_events
+            WHERE id > %s {gap_clause}
+            ORDER BY id
+            LIMIT %s
+        """, [_position['last_id']] + gaps + [batch_size])
+        return cursor.fetchall()
+
+    @staticmethod
+    def dispatch(batch_size=None):
+        """Deliver new events to this process's subscribers; returns the number delivered"""
+        batch_size = batch_size or current_app.config['OUTBOX_BATCH']
+        if not _dispatch_lock.acquire(blocking=False):
+            return 0
+        try:
+            conn = get_db_connection()
+            try:
+                with conn.cursor() as cursor:
+                    if _position['last_id'] is None:
+                        # Subscribers only care about changes after startup
+                        cursor.execute("SELECT COALESCE(MAX(id), 0) as id FROM outbox_events")
+                        _position['last_id'] = cursor.fetchone()['id']
+                        return 0
+
+                    now = time.monotonic()
+                    timeout = current_app.config['OUTBOX_GAP_TIMEOUT']
+                    _position['gaps'] = {gap: seen for gap, seen in _position['gaps'].items()
+                                         if now - seen < timeout}
+                    delivered = 0
+                    while True:
+                        rows = Outbox._read_batch(cursor, batch_size)
+                        conn.commit()  # end the snapshot so the next read sees new commits
+                        if not rows:
+                            return delivered
+
+                        seen = {row['id'] for row in rows}
+                        for gap in seen & set(_position['gaps']):
+                            del _position['gaps'][gap]
+                        new_ids = sorted(event_id for event_id in seen if event_id > _position['last_id'])
+                        if new_ids:
+                            # Ids skipped over may belong to transactions still in flight
+                            first_missing = max(_position['last_id'] + 1, new_ids[-1] - MAX_GAPS)
+                            for missing in range(first_missing, new_ids[-1]):
+                                if missing not in seen:
+                                    _position['gaps'][missing] = now
+                            _position['last_id'] = new_ids[-1]
+                            if len(_position['gaps']) > MAX_GAPS:
+                                keep = sorted(_position['gaps'])[-MAX_GAPS:]
+                                _position['gaps'] = {gap: _position['gaps'][gap] for gap in keep}
+
+                        Outbox._deliver([OutboxEvent(**row) for row in rows])
+                        delivered += len(rows)
+                        if len(rows) < batch_size:
+                            return delivered
+            finally:
+                conn.close()
+        finally:
+            _dispatch_lock.release()
+
+    @staticmethod
+    def prune(retention=None, batch_size=None):
+        """Delete events older than `retention` seconds in short batches; returns rows removed"""
+        retention = retention if retention is not None else current_app.config['OUTBOX_RETENTION']
+        batch_size = batch_size or current_app.config['OUTBOX_BATCH']
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cursor:
+                removed = 0
+                while True:
+                    cursor.execute("""
+                        DELETE FROM outbox_events
+                        WHERE created_at < NOW() - INTERVAL %s SECOND
+                        ORDER BY id
+                        LIMIT %s
+                    """, (retention, batch_size))
+                    conn.commit()
+                    removed += cursor.rowcount
+                    if cursor.rowcount < batch_size:
+                        return removed
+        finally:
+            conn.close()
@@ -0,0 +1,185 @@
+from dataclasses import dataclass
+from datetime import datetime
+from decimal import Decimal
+from types import MappingProxyType
+from flask import g
+from app.models.cart import Cart
+from app.utils.helpers import to_money
+
+def allocate_discount(discount, store_subtotals, applicable_to=None, applicable_id=None,
+                      category_subtotals=None):
+    """Split an order discount across stores; returns store_id -> amount
+
+    Store coupons are charged to their store. Category coupons are split pro
+    rata by each store's subtotal in that category (category_subtotals, per
+    store), other coupons by store subtotal, with the rounding remainder on
+    the largest share. Used at checkout and by the store_orders backfill.
+    """
+    allocation = {store_id: Decimal('0.00') for store_id in store_subtotals}
+    if not discount or not sum(store_subtotals.values()):
+        return allocation
+    if applicable_to == 'store' and applicable_id in allocation:
+        allocation[applicable_id] = discount
+        return allocation
+    basis = store_subtotals
+    if applicable_to == 'category':
+        basis = {store_id: subtotal for store_id, subtotal in (category_subtotals or {}).items() if subtotal}
+        basis = basis or store_subtotals
+    basis_total = sum(basis.values())
+    for store_id, subtotal in basis.items():
+        allocation[store_id] = to_money(discount * subtotal / basis_total)
+    largest = max(basis, key=basis.get)
+    allocation[largest] += discount - sum(allocation.values())
+    return allocation
+
+@dataclass(frozen=True)
+class PricedLine:
+    """One cart line with its effective unit price and subtotal in Decimal"""
+    product_id: int
+    product_name: str
+    store_id: int
+    store_name: str
+    category_id: int
+    quantity: int
+    price: Decimal
+    original_price: Decimal
+    discount_price: Decimal
+    subtotal: Decimal
+    image_url: str
+    stock: int
+
+@dataclass(frozen=True)
+class PricedCart:
+    """Immutable priced snapshot of a member's cart
+
+    Built once per request by CartPricing and shared by checkout, coupon
+    application and order creation so the cart is never re-queried or re-summed.
+    """
+    member_id: int
+    items: tuple
+    total_items: int
+    total_amount: Decimal
+    store_subtotals: MappingProxyType
+    category_subtotals: MappingProxyType
+
+    @property
+    def is_empty(self):
+        return not self.items
+
+    @property
+    def product_ids(self):
+        return [line.product_id for line in self.items]
+
+    @property
+    def store_ids(self):
+        return list(self.store_subtotals)
+
+    @property
+    def category_ids(self):
+        return list(self.category_subtotals)
+
+    def eligible_amount(self, coupon):
+        """Part of the cart a coupon applies to (whole cart, one store or one category)"""
+        return coupon.rule.amount_of(self)
+
+    def check_coupon(self, coupon):
+        """Validate coupon against this cart without touching the database
+
+        Returns (is_valid, message, discount_amount).
+        """
+        is_valid, message, amount = coupon.rule.check(self)
+        if not is_valid:
+            return False, message, Decimal('0.00')
+        return True, message, min(coupon.rule.discount(amount), self.total_amount)
+
+    def best_coupons(self, coupons, now=None):
+        """Pick the largest discount among coupons, overall and per store
+        
+        One pass over the coupons' compiled rules against the cart's
+        subtotals. Returns (best, best_by_store): best is (coupon, discount)
+        or None, best_by_store maps store_id to the best store coupon's
+        (coupon, discount). Ties go to the newest coupon.
+        """
+        now = now or datetime.now()
+        best = None
+        best_by_store = {}
+        for coupon in coupons:
+            rule = coupon.rule
+            is_valid, message, amount = rule.check(self, now)
+            if not is_valid:
+                continue
+            discount = min(rule.discount(amount), self.total_amount)
+            if not discount:
+                continue
+            candidate = (coupon, discount)
+            if best is None or (discount, coupon.id) > (best[1], best[0].id):
+                best = candidate
+            if coupon.applicable_to == 'store':
+                current = best_by_store.get(coupon.applicable_id)
+                if current is None or (discount, coupon.id) > (current[1], current[0].id):
+                    best_by_store[coupon.applicable_id] = candidate
+        return best, best_by_store
+    
+    def allocate_discount(self, coupon, discount):
+        """Split an order discount across stores (see allocate_discount)"""
+        if coupon is None:
+            return allocate_discount(discount, self.store_subtotals)
+        category_subtotals = {}
+        if coupon.applicable_to == 'category':
+            for line in self.items:
+                if line.category_id == coupon.applicable_id:
+                    category_subtotals[line.store_id] = category_subtotals.get(line.store_id, Decimal('0.00')) + line.subtotal
+        return allocate_discount(discount, self.store_subtotals, coupon.applicable_to,
+                                 coupon.applicable_id, category_subtotals)
+
+class CartPricing:
+    """Prices a member's cart once per request"""
+
+    @staticmethod
+    def price(cart_items, member_id=None):
+        """Build a PricedCart from cart line dicts (as returned by Cart.get_by_member)"""
+        lines = []
+        store_subtotals = {}
+        category_subtotals = {}
+        total_amount = Decimal('0.00')
+        total_items = 0
+
+        for item in cart_items:
+            price = to_money(item['price'])
+            subtotal = price * item['quantity']
+            lines.append(PricedLine(
+                product_id=item['product_id'],
+                product_name=item['product_name'],
+                store_id=item['store_id'],
+                store_name=item['store_name'],
+                category_id=item['category_id'],
+                quantity=item['quantity'],
+                price=price,
+                original_price=to_money(item['original_price']),
+                discount_price=to_money(item['discount_price']) if item['discount_price'] else None,
+                subtotal=subtotal,
+                image_url=item['image_url'],
+                stock=item['stock']
+            ))
+            total_amount += subtotal
+            total_items += item['quantity']
+            store_subtotals[item['store_id']] = store_subtotals.get(item['store_id'], Decimal('0.00')) + subtotal
+            category_subtotals[item['category_id']] = category_subtotals.get(item['category_id'], Decimal('0.00')) + subtotal
+
+        return PricedCart(
+            member_id=member_id,
+            items=tuple(lines),
+            total_items=total_items,
+            total_amount=total_amount,
+            store_subtotals=MappingProxyType(store_subtotals),
+            category_subtotals=MappingProxyType(category_subtotals)
+        )
+
+    @staticmethod
+    def for_member(member_id):
+        """Priced cart for member, computed at most once per request"""
+        cache = g.setdefault('priced_carts', {})
+        if member_id not in cache:
+            cache[member_id] = CartPricing.price(Cart.get_by_member(member_id), member_id)
+        return cache[member_id]
+
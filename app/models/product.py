@@ -2,6 +2,8 @@ from app.utils.db import get_db_connection
 from app.extensions import db
 from app.models.orm_models import ProductORM, StoreORM, CategoryORM, OrderItemORM
 from app.utils.helpers import save_product_image, delete_product_image
+from app.models.site_stats import SiteStats
+from app.models.outbox import Outbox
 
 class Product:
     def __init__(self, id=None, store_id=None, category_id=None, name=None, description=None, 
@@ -36,6 +38,8 @@ class Product:
                     (store_id, category_id, name, description, price, discount_price, stock)
                 )
                 product_id = cursor.lastrowid
+                SiteStats.adjust(cursor, total_products=1)
+                Outbox.emit(cursor, 'product.created', product_id, {'store_id': store_id})
                 
                 # Save image with product ID
                 if image_file:
@@ -93,12 +97,14 @@ class Product:
             conn.close()
     
     @staticmethod
-    def get_by_store(store_id, status='active'):
-        """Get products by store"""
+    def get_by_store(store_id, status='active', limit=None):
+        """Get products by store (newest first, optionally only the first `limit`)"""
         conn = get_db_connection()
         try:
             with conn.cursor() as cursor:
-                cursor.execute("""
+                limit_clause = 'LIMIT %s' if limit else ''
+                params = (store_id, status, limit) if limit else (store_id, status)
+                cursor.execute(f"""
                     SELECT p.id, p.store_id, p.category_id, p.name, p.description, p.price, 
                            p.discount_price, p.stock, p.image_url, p.status, p.created_at,
                            c.name as category_name
@@ -106,7 +112,8 @@ class Product:
                     JOIN categories c ON p.category_id = c.id
                     WHERE p.store_id = %s AND p.status = %s
                     ORDER BY p.created_at DESC
-                """, (store_id, status))
+                    {limit_clause}
+                """, params)
                 results = cursor.fetchall()
                 return [Product(**{k: v for k, v in result.items() if k in ['id', 'store_id', 'category_id', 'name', 'description', 'price', 'discount_price', 'stock', 'image_url', 'status', 'created_at']}) for result in results]
         except Exception as e:
@@ -213,11 +220,20 @@ class Product:
                             delete_product_image(old_image_url)
                 
                 if updates:
+                    if status is not None:
+                        cursor.execute("SELECT status FROM products WHERE id = %s FOR UPDATE", (self.id,))
+                        row = cursor.fetchone()
+                        was_active = bool(row) and row['status'] == 'active'
+                        SiteStats.adjust(cursor, total_products=int(status == 'active') - int(was_active))
                     params.append(self.id)
                     cursor.execute(
                         f"UPDATE products SET {', '.join(updates)} WHERE id = %s",
                         params
                     )
+                    Outbox.emit(cursor, 'product.updated', self.id, {
+                        'store_id': self.store_id,
+                        'fields': [update.split(' = ')[0] for update in updates]
+                    })
                     conn.commit()
                 return True
         except Exception as e:
@@ -234,7 +250,12 @@ class Product:
                 if self.image_url:
                     delete_product_image(self.image_url)
                 
+                cursor.execute("SELECT status FROM products WHERE id = %s FOR UPDATE", (self.id,))
+                row = cursor.fetchone()
                 cursor.execute("DELETE FROM products WHERE id = %s", (self.id,))
+                if row and row['status'] == 'active':
+                    SiteStats.adjust(cursor, total_products=-1)
+                Outbox.emit(cursor, 'product.deleted', self.id, {'store_id': self.store_id})
                 conn.commit()
                 return True
         except Exception as e:
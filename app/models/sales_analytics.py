@@ -0,0 +1,510 @@
+import json
+import math
+import os
+import threading
+import uuid
+from array import array
+from datetime import date
+from decimal import Decimal
+from flask import current_app
+from app.utils.db import get_db_connection
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+try:
+    import fcntl
+except ImportError:  # Windows: extraction is not guarded against concurrent runs
+    fcntl = None
+
+# One row per order line: (column, array typecode). Money is stored in cents
+# and dates as days since 1970-01-01; 0 means "none" for the dimension ids.
+COLUMNS = [
+    ('item_id', 'q'),
+    ('order_id', 'q'),
+    ('day', 'i'),
+    ('store_id', 'i'),
+    ('category_id', 'i'),
+    ('coupon_id', 'i'),
+    ('units', 'i'),
+    ('gross', 'q'),
+    ('discount', 'q'),
+]
+
+DIMENSIONS = {'store': 'store_id', 'category': 'category_id', 'coupon': 'coupon_id'}
+GRANULARITIES = ('day', 'week', 'month')
+
+# Only pending orders can still be cancelled (see ORDER_TRANSITIONS)
+OPEN_STATUSES = ('pending',)
+
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+NO_ID_LIMIT = 2 ** 63 - 1
+
+_cache = {'generation': None, 'rows': 0, 'columns': None, 'cancelled_rows': 0, 'cancelled': None,
+          'excluded': None}
+_cache_lock = threading.Lock()
+
+def _to_cents(amount):
+    return int((Decimal(amount or 0) * 100).quantize(Decimal('1')))
+
+def _empty_column(typecode):
+    return np.zeros(0, dtype=typecode) if NUMPY_AVAILABLE else array(typecode)
+
+def _read_column(path, typecode, start, count):
+    """Read `count` values from a column file, skipping the first `start`"""
+    if count <= 0 or not os.path.exists(path):
+        return _empty_column(typecode)
+    itemsize = array(typecode).itemsize
+    if NUMPY_AVAILABLE:
+        return np.fromfile(path, dtype=typecode, count=count, offset=start * itemsize)
+    values = array(typecode)
+    with open(path, 'rb') as f:
+        f.seek(start * itemsize)
+        values.fromfile(f, count)
+    return values
+
+def _concat(head, tail):
+    if NUMPY_AVAILABLE:
+        return np.concatenate([head, tail])
+    return head + tail
+
+class SalesAnalytics:
+    """Sales reports served from a local columnar copy of order lines
+
+    extract() tails order_items (hot and archive) by id and appends one value
+    per line to a binary file per column under ANALYTICS_DIR, so reports never
+    run GROUP BYs on the order tables. Cancellations are picked up by
+    re-checking the still-pending orders on each run. Reports load the columns
+    once per process (new rows are read incrementally) and aggregate them with
+    NumPy when it is installed, or in plain Python otherwise.
+    """
+
+    # ---- Storage -------------------------------------------------------
+
+    @staticmethod
+    def _path(name):
+        return os.path.join(current_app.config['ANALYTICS_DIR'], name)
+
+    @staticmethod
+    def _read_meta():
+        try:
+            with open(SalesAnalytics._path('meta.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {'generation': None, 'rows': 0, 'cancelled_rows': 0, 'item_mark': 0}
+
+    @staticmethod
+    def _replace_file(name, write):
+        """Write a file next to its final name and swap it in atomically"""
+        path = SalesAnalytics._path(name)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _write_meta(meta):
+        SalesAnalytics._replace_file('meta.json', lambda f: f.write(json.dumps(meta).encode()))
+
+    @staticmethod
+    def _append(name, typecode, values, committed_rows):
+        """Append values to a column file, first dropping any uncommitted tail"""
+        path = SalesAnalytics._path(name)
+        with open(path, 'ab') as f:
+            f.truncate(committed_rows * array(typecode).itemsize)
+            array(typecode, values).tofile(f)
+            f.flush()
+            os.fsync(f.fileno())
+
+    # ---- Extraction ----------------------------------------------------
+
+    @staticmethod
+    def _fetch_lines(cursor, after_id, below_id, batch_size):
+        """Next order lines by id, from the hot and archive tables
+
+        Each line carries its store's share of the order discount
+        (store_orders.store_discount) and the subtotal of the store's lines
+        that share applies to: all of them, or for a category coupon only
+        those in the coupon's category.
+        """
+        def branch(items, orders, store_orders):
+            return f"""
+                SELECT oi.id, oi.order_id, oi.quantity, oi.subtotal,
+                       COALESCE(oi.store_id, p.store_id) as store_id, p.category_id,
+                       o.coupon_id, o.status, o.created_at, o.total_amount, o.discount_amount,
+                       c.applicable_to, c.applicable_id, so.store_discount,
+                       (SELECT SUM(si.subtotal) FROM {items} si
+                        LEFT JOIN products sp ON sp.id = si.product_id
+                        WHERE si.order_id = oi.order_id
+                          AND COALESCE(si.store_id, sp.store_id) = COALESCE(oi.store_id, p.store_id)
+                          AND (c.applicable_to IS NULL OR c.applicable_to != 'category'
+                               OR sp.category_id = c.applicable_id)) as eligible_subtotal
+                FROM {items} oi
+                JOIN {orders} o ON o.id = oi.order_id
+                LEFT JOIN products p ON p.id = oi.product_id
+                LEFT JOIN coupons c ON c.id = o.coupon_id
+                LEFT JOIN {store_orders} so
+                       ON so.order_id = oi.order_id AND so.store_id = COALESCE(oi.store_id, p.store_id)
+                WHERE oi.id > %s AND oi.id < %s
+                ORDER BY oi.id LIMIT %s"""
+        cursor.execute(f"""
+            SELECT * FROM (
+                ({branch('order_items', 'orders', 'store_orders')})
+                UNION ALL
+                ({branch('order_items_archive', 'orders_archive', 'store_orders_archive')})
+            ) extracted
+            ORDER BY id
+            LIMIT %s
+        """, (after_id, below_id, batch_size, after_id, below_id, batch_size, batch_size))
+        return cursor.fetchall()
+
+    @staticmethod
+    def _line_discount(line):
+        """The line's share of the order discount, allocated as at checkout
+
+        Orders without store_orders rows (not yet backfilled) fall back to
+        spreading the order discount pro rata over all of its lines.
+        """
+        if line['store_discount'] is None:
+            total = Decimal(line['total_amount'] or 0)
+            discount = Decimal(line['discount_amount'] or 0)
+            return discount * Decimal(line['subtotal']) / total if total else 0
+        if line['applicable_to'] == 'category' and line['category_id'] != line['applicable_id']:
+            return 0
+        eligible = Decimal(line['eligible_subtotal'] or 0)
+        return Decimal(line['store_discount']) * Decimal(line['subtotal']) / eligible if eligible else 0
+
+    @staticmethod
+    def _extract_locked(batch_size, lag):
+        meta = SalesAnalytics._read_meta()
+        if not meta.get('generation'):
+            meta = {'generation': uuid.uuid4().hex, 'rows': 0, 'cancelled_rows': 0,
+                    'pending_rows': 0, 'item_mark': 0}
+            for name, typecode in COLUMNS:
+                SalesAnalytics._replace_file(f'{name}.bin', lambda f: None)
+            SalesAnalytics._replace_file('cancelled.bin', lambda f: None)
+            SalesAnalytics._replace_file('pending.bin', lambda f: None)
+        pending = [int(order_id) for order_id in
+                   _read_column(SalesAnalytics._path('pending.bin'), 'q', 0, meta.get('pending_rows', 0))]
+
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cursor:
+                # Lines of orders placed in the last `lag` seconds may belong to
+                # transactions that have not committed yet; stop below them so
+                # the id high-water mark never skips a row
+                cursor.execute("""
+                    SELECT MIN(oi.id) as id FROM orders o
+                    JOIN order_items oi ON oi.order_id = o.id
+                    WHERE o.created_at >= NOW() - INTERVAL %s SECOND
+                """, (lag,))
+                below_id = cursor.fetchone()['id'] or NO_ID_LIMIT
+
+                # Orders that were still cancellable when extracted
+                cancelled, still_pending = [], []
+                for start in range(0, len(pending), batch_size):
+                    chunk = pending[start:start + batch_size]
+                    placeholders = ','.join(['%s'] * len(chunk))
+                    cursor.execute(f"""
+                        SELECT id, status FROM orders WHERE id IN ({placeholders})
+                        UNION ALL
+                        SELECT id, status FROM orders_archive WHERE id IN ({placeholders})
+                    """, chunk + chunk)
+                    for row in cursor.fetchall():
+                        if row['status'] == 'cancelled':
+                            cancelled.append(row['id'])
+                        elif row['status'] in OPEN_STATUSES:
+                            still_pending.append(row['id'])
+
+                added = 0
+                while True:
+                    lines = SalesAnalytics._fetch_lines(cursor, meta['item_mark'], below_id, batch_size)
+                    if not lines:
+                        break
+                    values = {name: [] for name, typecode in COLUMNS}
+                    for line in lines:
+                        line_discount = SalesAnalytics._line_discount(line)
+                        values['item_id'].append(line['id'])
+                        values['order_id'].append(line['order_id'])
+                        values['day'].append(line['created_at'].date().toordinal() - EPOCH_ORDINAL)
+                        values['store_id'].append(line['store_id'] or 0)
+                        values['category_id'].append(line['category_id'] or 0)
+                        values['coupon_id'].append(line['coupon_id'] or 0)
+                        values['units'].append(line['quantity'])
+                        values['gross'].append(_to_cents(line['subtotal']))
+                        values['discount'].append(_to_cents(line_discount))
+                        if line['status'] == 'cancelled':
+                            cancelled.append(line['order_id'])
+                        elif line['status'] in OPEN_STATUSES:
+                            still_pending.append(line['order_id'])
+
+                    for name, typecode in COLUMNS:
+                        SalesAnalytics._append(f'{name}.bin', typecode, values[name], meta['rows'])
+                    meta['rows'] += len(lines)
+                    meta['item_mark'] = lines[-1]['id']
+                    added += len(lines)
+                    if len(lines) < batch_size:
+                        break
+        finally:
+            conn.close()
+
+        cancelled = sorted(set(cancelled))
+        still_pending = sorted(set(still_pending))
+        if cancelled:
+            SalesAnalytics._append('cancelled.bin', 'q', cancelled, meta['cancelled_rows'])
+            meta['cancelled_rows'] += len(cancelled)
+        SalesAnalytics._replace_file('pending.bin', lambda f: array('q', still_pending).tofile(f))
+        meta['pending_rows'] = len(still_pending)
+        # The meta file is the commit point: readers only see rows it counts
+        SalesAnalytics._write_meta(meta)
+        return added
+
+    @staticmethod
+    def extract(batch_size=None):
+        """Append order lines placed since the last run; returns the number added
+
+        Returns None when another process is already extracting.
+        """
+        batch_size = batch_size or current_app.config['ANALYTICS_EXTRACT_BATCH']
+        os.makedirs(current_app.config['ANALYTICS_DIR'], exist_ok=True)
+        with open(SalesAnalytics._path('.lock'), 'w') as lock_file:
+            if fcntl:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return None
+            return SalesAnalytics._extract_locked(batch_size, current_app.config['ANALYTICS_EXTRACT_LAG'])
+
+    @staticmethod
+    def reset():
+        """Forget extracted data; the next extract() starts from the first order"""
+        os.makedirs(current_app.config['ANALYTICS_DIR'], exist_ok=True)
+        with open(SalesAnalytics._path('.lock'), 'w') as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            SalesAnalytics._write_meta({'generation': None})
+
+    # ---- Loading -------------------------------------------------------
+
+    @staticmethod
+    def _load():
+        """Columns and cancelled lines, read incrementally into a per-process cache
+
+        Returns (columns, excluded, rows): with NumPy `excluded` is a boolean
+        mask of lines belonging to cancelled orders, otherwise the set of
+        cancelled order ids.
+        """
+        meta = SalesAnalytics._read_meta()
+        with _cache_lock:
+            if _cache['generation'] != meta.get('generation') or _cache['columns'] is None:
+                _cache.update(generation=meta.get('generation'), rows=0, cancelled_rows=0,
+                              columns={name: _empty_column(typecode) for name, typecode in COLUMNS},
+                              cancelled=_empty_column('q') if NUMPY_AVAILABLE else set(),
+                              excluded=np.zeros(0, dtype=bool) if NUMPY_AVAILABLE else None)
+
+            cancelled_rows = meta.get('cancelled_rows', 0)
+            cancelled_changed = cancelled_rows > _cache['cancelled_rows']
+            if cancelled_changed:
+                cancelled = _read_column(SalesAnalytics._path('cancelled.bin'), 'q', 0, cancelled_rows)
+                _cache['cancelled'] = np.unique(cancelled) if NUMPY_AVAILABLE else set(cancelled)
+                _cache['cancelled_rows'] = cancelled_rows
+
+            rows = meta.get('rows', 0)
+            cached_rows = _cache['rows']
+            if rows > cached_rows:
+                _cache['columns'] = {
+                    name: _concat(_cache['columns'][name],
+                                  _read_column(SalesAnalytics._path(f'{name}.bin'), typecode,
+                                               cached_rows, rows - cached_rows))
+                    for name, typecode in COLUMNS
+                }
+                _cache['rows'] = rows
+
+            if not NUMPY_AVAILABLE:
+                return _cache['columns'], _cache['cancelled'], rows
+            # Only new lines need checking unless the cancelled set grew
+            if cancelled_changed:
+                _cache['excluded'] = np.isin(_cache['columns']['order_id'], _cache['cancelled'])
+            elif rows > cached_rows:
+                tail = np.isin(_cache['columns']['order_id'][cached_rows:], _cache['cancelled'])
+                _cache['excluded'] = np.concatenate([_cache['excluded'], tail])
+            return _cache['columns'], _cache['excluded'], rows
+
+    # ---- Aggregation ---------------------------------------------------
+
+    @staticmethod
+    def _aggregate_numpy(columns, excluded, start_day, end_day, granularity, keys, max_rows=None):
+        selected = np.flatnonzero((columns['day'] >= start_day) & (columns['day'] <= end_day) & ~excluded)
+        if not len(selected):
+            return [], 0
+        day = columns['day'][selected].astype(np.int64)
+        if granularity == 'week':
+            period = day - (day + 3) % 7  # Monday; 1970-01-01 was a Thursday
+        elif granularity == 'month':
+            period = day.astype('datetime64[D]').astype('datetime64[M]').astype('datetime64[D]').astype(np.int64)
+        else:
+            period = day
+        key_columns = [period] + [columns[key][selected].astype(np.int64) for key in keys]
+
+        # Mixed-radix group code over each key's value range, or over dense
+        # ranks when the ranges are too wide for int64. Small code spaces are
+        # grouped with bincount alone; larger ones need one sort.
+        lows = [int(column.min()) for column in key_columns]
+        sizes = [int(column.max()) - low + 1 for column, low in zip(key_columns, lows)]
+        values = [None] * len(key_columns)
+        if math.prod(sizes) >= 2 ** 62:
+            ranked = [np.unique(column, return_inverse=True) for column in key_columns]
+            values = [column_values for column_values, rank in ranked]
+            key_columns = [rank for column_values, rank in ranked]
+            lows, sizes = [0] * len(ranked), [len(column_values) for column_values in values]
+        space = math.prod(sizes)
+        codes = np.zeros(len(selected), dtype=np.int64)
+        for column, low, size in zip(key_columns, lows, sizes):
+            codes = codes * size + (column - low)
+        if space <= max(4 * len(codes), 1 << 20):
+            present = np.flatnonzero(np.bincount(codes, minlength=space))
+            lookup = np.zeros(space, dtype=np.int64)
+            lookup[present] = np.arange(len(present))
+            group = lookup[codes]
+        else:
+            present, group = np.unique(codes, return_inverse=True)
+        groups = len(present)
+
+        gross = np.bincount(group, weights=columns['gross'][selected], minlength=groups)
+        discount = np.bincount(group, weights=columns['discount'][selected], minlength=groups)
+        units = np.bincount(group, weights=columns['units'][selected], minlength=groups)
+        order_ids = columns['order_id'][selected]
+        order_radix = int(order_ids.max()) + 1
+        # Distinct orders per group: sort (group, order) pairs and count runs
+        pairs = np.sort(group * order_radix + order_ids)
+        first = np.ones(len(pairs), dtype=bool)
+        first[1:] = pairs[1:] != pairs[:-1]
+        orders = np.bincount(pairs[first] // order_radix, minlength=groups)
+
+        # Period first, then highest revenue; only the kept groups are decoded
+        top = np.lexsort((discount - gross, present // (space // sizes[0])))
+        if max_rows is not None:
+            top = top[:max_rows]
+        remaining = present[top]
+        decoded = []
+        for low, size, column_values in reversed(list(zip(lows, sizes, values))):
+            digit = remaining % size
+            decoded.append(column_values[digit] if column_values is not None else digit + low)
+            remaining = remaining // size
+        decoded.reverse()
+        return [
+            (tuple(int(column[i]) for column in decoded), int(orders[g]), int(units[g]),
+             int(gross[g]), int(discount[g]))
+            for i, g in enumerate(top)
+        ], groups
+
+    @staticmethod
+    def _aggregate_python(columns, excluded, start_day, end_day, granularity, keys, max_rows=None):
+        totals = {}
+        key_columns = [columns[key] for key in keys]
+        days, order_ids = columns['day'], columns['order_id']
+        units, gross, discount = columns['units'], columns['gross'], columns['discount']
+        for i in range(len(days)):
+            day = days[i]
+            if day < start_day or day > end_day or order_ids[i] in excluded:
+                continue
+            if granularity == 'week':
+                period = day - (day + 3) % 7
+            elif granularity == 'month':
+                period = date.fromordinal(day + EPOCH_ORDINAL).replace(day=1).toordinal() - EPOCH_ORDINAL
+            else:
+                period = day
+            key = (period,) + tuple(column[i] for column in key_columns)
+            group = totals.get(key)
+            if group is None:
+                group = totals[key] = [set(), 0, 0, 0]
+            group[0].add(order_ids[i])
+            group[1] += units[i]
+            group[2] += gross[i]
+            group[3] += discount[i]
+        groups = sorted(((key, len(group[0]), group[1], group[2], group[3]) for key, group in totals.items()),
+                        key=lambda group: (group[0][0], group[4] - group[3]))
+        return (groups[:max_rows] if max_rows is not None else groups), len(groups)
+
+    @staticmethod
+    def _labels(keys, groups):
+        """Names for the store / category / coupon ids appearing in the groups"""
+        tables = {'store': ('stores', 'name'), 'category': ('categories', 'name'), 'coupon': ('coupons', 'code')}
+        labels = {}
+        conn = None
+        try:
+            for position, key in enumerate(keys, start=1):
+                ids = sorted({group[0][position] for group in groups} - {0})
+                labels[key] = {}
+                if not ids:
+                    continue
+                if conn is None:
+                    conn = get_db_connection()
+                table, column = tables[key]
+                with conn.cursor() as cursor:
+                    placeholders = ','.join(['%s'] * len(ids))
+                    cursor.execute(f"SELECT id, {column} as label FROM {table} WHERE id IN ({placeholders})", ids)
+                    labels[key] = {row['id']: row['label'] for row in cursor.fetchall()}
+        finally:
+            if conn is not None:
+                conn.close()
+        return labels
+
+    @staticmethod
+    def report(start_date, end_date, granularity='day', group_by=()):
+        """Revenue, orders, AOV, discount and units per period and dimension
+
+        group_by is any of 'store', 'category' and 'coupon'. Cancelled orders
+        are excluded; revenue is net of discounts. An order spanning several
+        stores or categories counts once in each of their groups. Returns a
+        dict with the rows (at most ANALYTICS_MAX_ROWS), overall totals and
+        the number of extracted lines.
+        """
+        keys = [key for key in DIMENSIONS if key in group_by]
+        columns, excluded, lines = SalesAnalytics._load()
+        start_day = start_date.toordinal() - EPOCH_ORDINAL
+        end_day = end_date.toordinal() - EPOCH_ORDINAL
+        aggregate = SalesAnalytics._aggregate_numpy if NUMPY_AVAILABLE else SalesAnalytics._aggregate_python
+        dimension_columns = [DIMENSIONS[key] for key in keys]
+        max_rows = current_app.config['ANALYTICS_MAX_ROWS']
+        groups, group_count = aggregate(columns, excluded, start_day, end_day, granularity,
+                                        dimension_columns, max_rows)
+        totals, _ = aggregate(columns, excluded, start_day, end_day, 'day', [])
+        labels = SalesAnalytics._labels(keys, groups)
+
+        rows = []
+        for key, orders, units, gross, discount in groups:
+            revenue = Decimal(gross - discount) / 100
+            row = {
+                'period': date.fromordinal(key[0] + EPOCH_ORDINAL),
+                'orders': orders,
+                'units': units,
+                'revenue': revenue,
+                'discount': Decimal(discount) / 100,
+                'aov': (revenue / orders).quantize(Decimal('0.01')) if orders else Decimal('0'),
+            }
+            for position, dimension in enumerate(keys, start=1):
+                row[f'{dimension}_id'] = key[position] or None
+                row[f'{dimension}_name'] = labels[dimension].get(key[position])
+            rows.append(row)
+
+        # Every order falls on a single day, so per-day distinct counts add up
+        total_orders = sum(group[1] for group in totals)
+        total_revenue = Decimal(sum(group[3] - group[4] for group in totals)) / 100
+        return {
+            'rows': rows,
+            'truncated': group_count > max_rows,
+            'totals': {
+                'orders': total_orders,
+                'units': sum(group[2] for group in totals),
+                'revenue': total_revenue,
+                'discount': Decimal(sum(group[4] for group in totals)) / 100,
+                'aov': (total_revenue / total_orders).quantize(Decimal('0.01')) if total_orders else Decimal('0'),
+            },
+            'lines': lines,
+        }
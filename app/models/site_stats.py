@@ -0,0 +1,170 @@
+import random
+import threading
+import time
+from decimal import Decimal
+from flask import current_app
+from app.utils.db import get_db_connection, run_in_transaction
+
+COUNTERS = ['total_members', 'total_stores', 'active_stores', 'total_products',
+            'total_orders', 'total_revenue']
+
+# site_stat_shards row (shard 0) holding the UNIX time of the last reconcile
+RECONCILED_AT_KEY = 'reconciled_at'
+
+_snapshot = {'expires_at': 0, 'stats': None}
+_snapshot_lock = threading.Lock()
+
+class SiteStats:
+    """Admin dashboard counters kept in site_stat_shards
+
+    Model writes adjust the counters inside their own transactions (adjust),
+    spreading updates over ADMIN_STATS_SHARDS rows per counter so checkouts do
+    not queue on one hot row. Every worker reads the same table, caches the
+    summed snapshot for ADMIN_STATS_TTL seconds, and a background task
+    periodically recomputes the exact values (reconcile) to correct drift.
+    The recompute takes no locks on the shards, and only one process runs it
+    at a time and at most once per interval across all processes.
+    """
+
+    @staticmethod
+    def adjust(cursor, **deltas):
+        """Add deltas to counters inside the caller's transaction"""
+        deltas = {key: value for key, value in deltas.items() if value}
+        if not deltas:
+            return
+        shard = random.randrange(current_app.config['ADMIN_STATS_SHARDS'])
+        keys = sorted(deltas)
+        values = ','.join(['(%s, %s, %s)'] * len(keys))
+        params = []
+        for key in keys:
+            params.extend([key, shard, deltas[key]])
+        cursor.execute(f"""
+            INSERT INTO site_stat_shards (stat_key, shard, value)
+            VALUES {values}
+            ON DUPLICATE KEY UPDATE value = value + VALUES(value)
+        """, params)
+
+    @staticmethod
+    def _compute(cursor):
+        """Exact counters in a single statement"""
+        cursor.execute("""
+            SELECT (SELECT COUNT(*) FROM members) as total_members,
+                   (SELECT COUNT(*) FROM stores) as total_stores,
+                   (SELECT COUNT(*) FROM stores WHERE status = 'active') as active_stores,
+                   (SELECT COUNT(*) FROM products WHERE status = 'active') as total_products,
+                   (SELECT COUNT(*) FROM orders)
+                     + (SELECT COUNT(*) FROM orders_archive) as total_orders,
+                   (SELECT COALESCE(SUM(final_amount), 0) FROM orders WHERE status != 'cancelled')
+                     + (SELECT COALESCE(SUM(final_amount), 0) FROM orders_archive
+                        WHERE status != 'cancelled') as total_revenue
+        """)
+        return cursor.fetchone()
+
+    @staticmethod
+    def reconcile(min_interval=None):
+        """Correct drift in the counters; returns the exact counters, or None if
+        another process is already reconciling or did so within min_interval
+        seconds
+        
+        The aggregates and the shard sums are read from one consistent
+        snapshot without locking, and only their difference is then added
+        with adjust() in a short transaction, so concurrent checkouts never
+        wait on the scan and adjustments made meanwhile are kept.
+        """
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cursor:
+                # One reconciler across all processes
+                cursor.execute("SELECT GET_LOCK('site_stats_reconcile', 0) as locked")
+                if not cursor.fetchone()['locked']:
+                    return None
+                try:
+                    if min_interval:
+                        cursor.execute("""
+                            SELECT UNIX_TIMESTAMP() - value as age FROM site_stat_shards
+                            WHERE stat_key = %s AND shard = 0
+                        """, (RECONCILED_AT_KEY,))
+                        row = cursor.fetchone()
+                        conn.commit()
+                        if row and row['age'] < min_interval:
+                            return None
+                    
+                    cursor.execute("START TRANSACTION WITH CONSISTENT SNAPSHOT")
+                    counters = SiteStats._compute(cursor)
+                    cursor.execute("SELECT stat_key, SUM(value) as value FROM site_stat_shards GROUP BY stat_key")
+                    recorded = {row['stat_key']: row['value'] for row in cursor.fetchall()}
+                    conn.commit()
+                    
+                    drift = {key: counters[key] - (recorded.get(key) or 0) for key in COUNTERS}
+                    run_in_transaction(lambda tx_cursor: SiteStats._apply_drift(tx_cursor, drift))
+                finally:
+                    cursor.execute("SELECT RELEASE_LOCK('site_stats_reconcile')")
+        finally:
+            conn.close()
+        
+        SiteStats.invalidate()
+        return counters
+
+    @staticmethod
+    def _apply_drift(cursor, drift):
+        """Add the reconcile difference and record when it was taken"""
+        SiteStats.adjust(cursor, **drift)
+        cursor.execute("""
+            INSERT INTO site_stat_shards (stat_key, shard, value) VALUES (%s, 0, UNIX_TIMESTAMP())
+            ON DUPLICATE KEY UPDATE value = VALUES(value)
+        """, (RECONCILED_AT_KEY,))
+
+    @staticmethod
+    def _load():
+        """Sum the shards and fetch recent orders"""
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT stat_key, SUM(value) as value FROM site_stat_shards GROUP BY stat_key")
+                counters = {row['stat_key']: row['value'] for row in cursor.fetchall()}
+
+                cursor.execute("""
+                    SELECT o.id, o.order_number, o.final_amount, o.status, o.created_at, m.name as member_name
+                    FROM orders o
+                    JOIN members m ON o.member_id = m.id
+                    ORDER BY o.id DESC
+                    LIMIT 5
+                """)
+                recent_orders = cursor.fetchall()
+        finally:
+            conn.close()
+
+        if any(key not in counters for key in COUNTERS):
+            # First use (or table cleared): seed the counters, unless another
+            # process is already doing it
+            counters = SiteStats.reconcile() or {key: counters.get(key, 0) for key in COUNTERS}
+
+        stats = {key: int(counters[key]) if key != 'total_revenue' else Decimal(counters[key])
+                 for key in COUNTERS}
+        stats['recent_orders'] = recent_orders
+        return stats
+
+    @staticmethod
+    def snapshot():
+        """Dashboard statistics, cached for ADMIN_STATS_TTL seconds per process"""
+        now = time.monotonic()
+        with _snapshot_lock:
+            if _snapshot['stats'] is not None and _snapshot['expires_at'] > now:
+                return _snapshot['stats']
+        stats = SiteStats._load()
+        with _snapshot_lock:
+            _snapshot['stats'] = stats
+            _snapshot['expires_at'] = now + current_app.config['ADMIN_STATS_TTL']
+        return stats
+
+    @staticmethod
+    def invalidate():
+        """Drop this process's cached snapshot"""
+        with _snapshot_lock:
+            _snapshot['stats'] = None
+
+    @staticmethod
+    def refresh():
+        """Background job: reconcile counters (once per interval across processes) and warm the snapshot"""
+        SiteStats.reconcile(current_app.config['ADMIN_STATS_REFRESH_INTERVAL'])
+        SiteStats.snapshot()
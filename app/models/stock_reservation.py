@@ -0,0 +1,135 @@
+from flask import current_app
+from app.utils.db import get_db_connection, run_in_transaction
+from app.models.inventory import InsufficientStockError
+
+class StockReservation:
+    """Time-bounded stock holds placed when a member reaches checkout
+    
+    Holds do not touch products.stock. Available stock for everyone else is
+    stock minus the sum of other members' unexpired holds, which is read from
+    the (product_id, expires_at, quantity) index. Expired holds are simply
+    ignored, and the sweeper deletes them in batches to keep the table small.
+    """
+    
+    @staticmethod
+    def _active_holds(cursor, product_ids, exclude_member_id=None):
+        """Sum of unexpired holds per product (optionally excluding one member)"""
+        placeholders = ','.join(['%s'] * len(product_ids))
+        params = list(product_ids)
+        member_clause = ''
+        if exclude_member_id is not None:
+            member_clause = 'AND member_id != %s'
+            params.append(exclude_member_id)
+        cursor.execute(f"""
+            SELECT product_id, SUM(quantity) as held
+            FROM stock_reservations
+            WHERE product_id IN ({placeholders}) AND expires_at > NOW() {member_clause}
+            GROUP BY product_id
+        """, params)
+        return {row['product_id']: int(row['held']) for row in cursor.fetchall()}
+    
+    @staticmethod
+    def get_available(product_ids, member_id=None):
+        """Available stock per product: stock minus other members' active holds"""
+        if not product_ids:
+            return {}
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cursor:
+                placeholders = ','.join(['%s'] * len(product_ids))
+                cursor.execute(
+                    f"SELECT id, stock FROM products WHERE id IN ({placeholders})",
+                    list(product_ids)
+                )
+                stock = {row['id']: row['stock'] for row in cursor.fetchall()}
+                held = StockReservation._active_holds(cursor, list(stock), member_id) if stock else {}
+                return {product_id: max(0, qty - held.get(product_id, 0)) for product_id, qty in stock.items()}
+        except Exception as e:
+            return {}
+        finally:
+            conn.close()
+    
+    @staticmethod
+    def hold(member_id, lines, names=None):
+        """Hold stock for a member's checkout for STOCK_HOLD_TTL seconds
+        
+        lines is an iterable of (product_id, quantity). Replaces the member's
+        previous holds. Returns (expires_at, None) or (None, error).
+        """
+        totals = {}
+        for product_id, quantity in lines:
+            totals[product_id] = totals.get(product_id, 0) + quantity
+        if not totals:
+            return None, "購物車是空的"
+        product_ids = sorted(totals)
+        ttl = current_app.config['STOCK_HOLD_TTL']
+        
+        def place_holds(cursor):
+            placeholders = ','.join(['%s'] * len(product_ids))
+            # Lock product rows in id order, like Inventory.reserve, so hold
+            # placement and order creation serialize per SKU without deadlocks
+            cursor.execute(
+                f"SELECT id, stock FROM products WHERE id IN ({placeholders}) ORDER BY id FOR UPDATE",
+                product_ids
+            )
+            stock = {row['id']: row['stock'] for row in cursor.fetchall()}
+            held = StockReservation._active_holds(cursor, product_ids, member_id)
+            for product_id in product_ids:
+                if stock.get(product_id, 0) - held.get(product_id, 0) < totals[product_id]:
+                    raise InsufficientStockError(product_id, (names or {}).get(product_id))
+            
+            cursor.execute(
+                f"DELETE FROM stock_reservations WHERE member_id = %s AND product_id NOT IN ({placeholders})",
+                [member_id] + product_ids
+            )
+            values = ','.join(['(%s, %s, %s, NOW() + INTERVAL %s SECOND)'] * len(product_ids))
+            params = []
+            for product_id in product_ids:
+                params.extend([member_id, product_id, totals[product_id], ttl])
+            cursor.execute(f"""
+                INSERT INTO stock_reservations (member_id, product_id, quantity, expires_at)
+                VALUES {values}
+                ON DUPLICATE KEY UPDATE quantity = VALUES(quantity), expires_at = VALUES(expires_at)
+            """, params)
+            
+            cursor.execute("SELECT NOW() + INTERVAL %s SECOND as expires_at", (ttl,))
+            return cursor.fetchone()['expires_at']
+        
+        try:
+            return run_in_transaction(place_holds), None
+        except Exception as e:
+            return None, str(e)
+    
+    @staticmethod
+    def release(member_id):
+        """Drop all holds of a member"""
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("DELETE FROM stock_reservations WHERE member_id = %s", (member_id,))
+                conn.commit()
+                return True
+        except Exception as e:
+            return False
+        finally:
+            conn.close()
+    
+    @staticmethod
+    def sweep_expired(batch_size=None):
+        """Delete expired holds in batches; returns number of rows removed"""
+        batch_size = batch_size or current_app.config['STOCK_HOLD_SWEEP_BATCH']
+        removed = 0
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cursor:
+                while True:
+                    cursor.execute(
+                        "DELETE FROM stock_reservations WHERE expires_at <= NOW() ORDER BY expires_at LIMIT %s",
+                        (batch_size,)
+                    )
+                    conn.commit()
+                    removed += cursor.rowcount
+                    if cursor.rowcount < batch_size:
+                        return removed
+        finally:
+            conn.close()
@@ -1,4 +1,6 @@
 from app.utils.db import get_db_connection
+from app.models.site_stats import SiteStats
+from app.models.outbox import Outbox
 
 class Store:
     def __init__(self, id=None, member_id=None, store_name=None, description=None, status=None, created_at=None):
@@ -20,6 +22,9 @@ class Store:
                     (member_id, store_name, description)
                 )
                 store_id = cursor.lastrowid
+                Store.bump_owner_versions(cursor, [member_id])
+                SiteStats.adjust(cursor, total_stores=1)
+                Outbox.emit(cursor, 'store.created', store_id, {'member_id': member_id})
                 conn.commit()
                 return Store(id=store_id, member_id=member_id, store_name=store_name, description=description, status='pending'), None
         except Exception as e:
@@ -63,6 +68,57 @@ class Store:
         finally:
             conn.close()
     
+    @staticmethod
+    def get_owned_ids(member_id):
+        """(ids of the member's stores, member's stores_version)"""
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    "SELECT m.stores_version, s.id FROM members m LEFT JOIN stores s ON s.member_id = m.id WHERE m.id = %s",
+                    (member_id,)
+                )
+                results = cursor.fetchall()
+                if not results:
+                    return [], None
+                return [result['id'] for result in results if result['id']], results[0]['stores_version']
+        except Exception as e:
+            return [], None
+        finally:
+            conn.close()
+    
+    @staticmethod
+    def get_owned(store_id, member_id):
+        """(store, member's stores_version) in one query; store is None unless the member owns it"""
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    SELECT m.stores_version, s.id, s.member_id, s.store_name, s.description, s.status, s.created_at
+                    FROM members m
+                    LEFT JOIN stores s ON s.id = %s AND s.member_id = m.id
+                    WHERE m.id = %s
+                """, (store_id, member_id))
+                result = cursor.fetchone()
+                if not result:
+                    return None, None
+                version = result.pop('stores_version')
+                return (Store(**result) if result['id'] else None), version
+        except Exception as e:
+            return None, None
+        finally:
+            conn.close()
+    
+    @staticmethod
+    def bump_owner_versions(cursor, member_ids):
+        """Invalidate the ownership sets cached in these members' sessions
+        
+        Call inside the transaction of any change to which stores a member
+        owns (creation, transfer, deletion).
+        """
+        for member_id in set(member_ids):
+            cursor.execute("UPDATE members SET stores_version = stores_version + 1 WHERE id = %s", (member_id,))
+    
     @staticmethod
     def get_all_active():
         """Get all active stores"""
@@ -103,11 +159,20 @@ class Store:
                     self.status = status
                 
                 if updates:
+                    if status is not None:
+                        cursor.execute("SELECT status FROM stores WHERE id = %s FOR UPDATE", (self.id,))
+                        row = cursor.fetchone()
+                        was_active = bool(row) and row['status'] == 'active'
+                        SiteStats.adjust(cursor, active_stores=int(status == 'active') - int(was_active))
                     params.append(self.id)
                     cursor.execute(
                         f"UPDATE stores SET {', '.join(updates)} WHERE id = %s",
                         params
                     )
+                    Outbox.emit(cursor, 'store.updated', self.id, {
+                        'member_id': self.member_id,
+                        'fields': [update.split(' = ')[0] for update in updates]
+                    })
                     conn.commit()
                 return True
         except Exception as e:
@@ -124,32 +189,18 @@ class Store:
                 cursor.execute("SELECT COUNT(*) as product_count FROM products WHERE store_id = %s", (self.id,))
                 product_count = cursor.fetchone()['product_count']
                 
-                # Get order count
-                cursor.execute("""
-                    SELECT COUNT(DISTINCT o.id) as order_count 
-                    FROM orders o 
-                    JOIN order_items oi ON o.id = oi.order_id 
-                    JOIN products p ON oi.product_id = p.id 
-                    WHERE p.store_id = %s
-                """, (self.id,))
-                order_count = cursor.fetchone()['order_count']
-                
-                # Get total sales
-                cursor.execute("""
-                    SELECT COALESCE(SUM(oi.subtotal), 0) as total_sales 
-                    FROM orders o 
-                    JOIN order_items oi ON o.id = oi.order_id 
-                    JOIN products p ON oi.product_id = p.id 
-                    WHERE p.store_id = %s AND o.status != 'cancelled'
-                """, (self.id,))
-                total_sales = cursor.fetchone()['total_sales']
+                # Order figures come from the daily rollup
+                from app.models.store_stats import StoreDailyStats
+                totals = StoreDailyStats.get_totals(self.id)
                 
                 return {
                     'product_count': product_count,
-                    'order_count': order_count,
-                    'total_sales': total_sales
+                    'order_count': totals['order_count'],
+                    'total_sales': totals['net_amount'],
+                    'units': totals['units'],
+                    'cancelled_count': totals['cancelled_count']
                 }
         except Exception as e:
-            return {'product_count': 0, 'order_count': 0, 'total_sales': 0}
+            return {'product_count': 0, 'order_count': 0, 'total_sales': 0, 'units': 0, 'cancelled_count': 0}
         finally:
             conn.close()
@@ -0,0 +1,176 @@
+from datetime import date, timedelta
+from decimal import Decimal
+from app.utils.db import get_db_connection, run_in_transaction
+
+STAT_FIELDS = ['order_count', 'units', 'gross_amount', 'discount_amount',
+               'net_amount', 'cancelled_count', 'cancelled_amount']
+
+class StoreDailyStats:
+    """Per-store, per-day sales rollup kept in store_daily_stats
+
+    Rows are adjusted inside the order transactions (record_order on create,
+    record_cancellations on cancel), so dashboards read a few rows instead of
+    aggregating the whole order history. Orders are attributed to the day they
+    were placed; net_amount excludes cancelled orders. rebuild() recomputes
+    rows from store_orders and verify() reports drift.
+    """
+
+    @staticmethod
+    def record_order(cursor, order_id):
+        """Add a new order's store_orders rows to the rollup (caller's transaction)"""
+        cursor.execute("""
+            INSERT INTO store_daily_stats (store_id, stat_date, order_count, units,
+                                           gross_amount, discount_amount, net_amount)
+            SELECT so.store_id, DATE(so.created_at), 1, so.units, so.store_subtotal,
+                   so.store_discount, so.store_subtotal - so.store_discount
+            FROM store_orders so
+            WHERE so.order_id = %s
+            ON DUPLICATE KEY UPDATE
+                store_daily_stats.order_count = store_daily_stats.order_count + 1,
+                store_daily_stats.units = store_daily_stats.units + VALUES(units),
+                store_daily_stats.gross_amount = store_daily_stats.gross_amount + VALUES(gross_amount),
+                store_daily_stats.discount_amount = store_daily_stats.discount_amount + VALUES(discount_amount),
+                store_daily_stats.net_amount = store_daily_stats.net_amount + VALUES(net_amount)
+        """, (order_id,))
+
+    @staticmethod
+    def record_cancellations(cursor, order_ids):
+        """Move just-cancelled orders out of net sales (caller's transaction)"""
+        placeholders = ','.join(['%s'] * len(order_ids))
+        cursor.execute(f"""
+            UPDATE store_daily_stats d
+            JOIN (
+                SELECT store_id, DATE(created_at) as stat_date, COUNT(*) as orders,
+                       SUM(store_subtotal - store_discount) as amount
+                FROM store_orders
+                WHERE order_id IN ({placeholders})
+                GROUP BY store_id, DATE(created_at)
+            ) c ON d.store_id = c.store_id AND d.stat_date = c.stat_date
+            SET d.cancelled_count = d.cancelled_count + c.orders,
+                d.cancelled_amount = d.cancelled_amount + c.amount,
+                d.net_amount = d.net_amount - c.amount
+        """, list(order_ids))
+
+    @staticmethod
+    def _compute_sql(store_id=None):
+        """SELECT that derives rollup rows from store_orders and orders"""
+        where = 'WHERE so.store_id = %s' if store_id is not None else ''
+        params = (store_id,) * 2 if store_id is not None else ()
+        columns = 'so.store_id, so.created_at, so.units, so.store_subtotal, so.store_discount, o.status'
+        return f"""
+            SELECT so.store_id, DATE(so.created_at) as stat_date,
+                   COUNT(*) as order_count,
+                   SUM(so.units) as units,
+                   SUM(so.store_subtotal) as gross_amount,
+                   SUM(so.store_discount) as discount_amount,
+                   SUM(CASE WHEN so.status = 'cancelled' THEN 0
+                            ELSE so.store_subtotal - so.store_discount END) as net_amount,
+                   SUM(CASE WHEN so.status = 'cancelled' THEN 1 ELSE 0 END) as cancelled_count,
+                   SUM(CASE WHEN so.status = 'cancelled' THEN so.store_subtotal - so.store_discount
+                            ELSE 0 END) as cancelled_amount
+            FROM (
+                SELECT {columns} FROM store_orders so
+                JOIN orders o ON o.id = so.order_id {where}
+                UNION ALL
+                SELECT {columns} FROM store_orders_archive so
+                JOIN orders_archive o ON o.id = so.order_id {where}
+            ) so
+            GROUP BY so.store_id, DATE(so.created_at)
+        """, params
+
+    @staticmethod
+    def rebuild(store_id=None):
+        """Recompute the rollup from order data (all stores, or one); returns row count"""
+        def recompute(cursor):
+            if store_id is not None:
+                cursor.execute("DELETE FROM store_daily_stats WHERE store_id = %s", (store_id,))
+            else:
+                cursor.execute("DELETE FROM store_daily_stats")
+            sql, params = StoreDailyStats._compute_sql(store_id)
+            cursor.execute(f"""
+                INSERT INTO store_daily_stats (store_id, stat_date, {', '.join(STAT_FIELDS)})
+                SELECT store_id, stat_date, {', '.join(STAT_FIELDS)} FROM ({sql}) computed
+            """, params)
+            return cursor.rowcount
+
+        return run_in_transaction(recompute)
+
+    @staticmethod
+    def verify(store_id=None):
+        """Compare the rollup with order data
+
+        Returns a list of (store_id, stat_date, field, expected, actual) for
+        every value that differs; an empty list means the rollup is exact.
+        """
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cursor:
+                sql, params = StoreDailyStats._compute_sql(store_id)
+                cursor.execute(sql, params)
+                expected = {(row['store_id'], row['stat_date']): row for row in cursor.fetchall()}
+
+                where = 'WHERE store_id = %s' if store_id is not None else ''
+                cursor.execute(f"""
+                    SELECT store_id, stat_date, {', '.join(STAT_FIELDS)}
+                    FROM store_daily_stats {where}
+                """, params)
+                actual = {(row['store_id'], row['stat_date']): row for row in cursor.fetchall()}
+
+                mismatches = []
+                for key in sorted(set(expected) | set(actual)):
+                    for field in STAT_FIELDS:
+                        want = (expected.get(key) or {}).get(field) or 0
+                        got = (actual.get(key) or {}).get(field) or 0
+                        if Decimal(want) != Decimal(got):
+                            mismatches.append((key[0], key[1], field, want, got))
+                return mismatches
+        finally:
+            conn.close()
+
+    @staticmethod
+    def get_daily(store_id, start_date, end_date):
+        """Daily rows for a date range (inclusive), with zero rows for quiet days"""
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(f"""
+                    SELECT stat_date, {', '.join(STAT_FIELDS)}
+                    FROM store_daily_stats
+                    WHERE store_id = %s AND stat_date BETWEEN %s AND %s
+                """, (store_id, start_date, end_date))
+                rows = {row['stat_date']: row for row in cursor.fetchall()}
+        except Exception as e:
+            rows = {}
+        finally:
+            conn.close()
+
+        days = []
+        day = start_date
+        while day <= end_date:
+            row = rows.get(day) or {}
+            days.append(dict({field: row.get(field, 0) for field in STAT_FIELDS}, stat_date=day))
+            day += timedelta(days=1)
+        return days
+
+    @staticmethod
+    def get_recent(store_id, days=30):
+        """Daily rows for the last `days` days, ending today"""
+        end_date = date.today()
+        return StoreDailyStats.get_daily(store_id, end_date - timedelta(days=days - 1), end_date)
+
+    @staticmethod
+    def get_totals(store_id):
+        """All-time totals for a store (sums one row per active day)"""
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(f"""
+                    SELECT {', '.join(f'COALESCE(SUM({field}), 0) as {field}' for field in STAT_FIELDS)}
+                    FROM store_daily_stats
+                    WHERE store_id = %s
+                """, (store_id,))
+                return cursor.fetchone()
+        except Exception as e:
+            return {field: 0 for field in STAT_FIELDS}
+        finally:
+            conn.close()
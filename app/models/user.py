@@ -1,5 +1,5 @@
-from werkzeug.security import generate_password_hash, check_password_hash
 from app.utils.db import get_db_connection
+from app.utils.passwords import hash_password, verify_password
 
 class User:
     def __init__(self, id=None, username=None, password_hash=None, role=None, created_at=None):
@@ -11,11 +11,37 @@ class User:
     
     def set_password(self, password):
         """Set password hash"""
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hash_password(password)
     
     def check_password(self, password):
-        """Check password"""
-        return check_password_hash(self.password_hash, password)
+        """Check password, upgrading a hash made with outdated parameters
+        
+        Hashing runs in the bounded executor of app.utils.passwords and raises
+        HashingBusyError when it is saturated.
+        """
+        matches, needs_rehash = verify_password(self.password_hash, password)
+        if needs_rehash:
+            self._upgrade_password_hash(password)
+        return matches
+    
+    def _upgrade_password_hash(self, password):
+        """Store a hash with the current parameters unless the password changed meanwhile"""
+        old_hash = self.password_hash
+        conn = get_db_connection()
+        try:
+            new_hash = hash_password(password)
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    "UPDATE users SET password_hash = %s WHERE id = %s AND password_hash = %s",
+                    (new_hash, self.id, old_hash)
+                )
+                conn.commit()
+                self.password_hash = new_hash
+                return True
+        except Exception as e:
+            return False
+        finally:
+            conn.close()
     
     @staticmethod
     def get_by_username(username):
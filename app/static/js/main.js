@@ -224,3 +224,28 @@ function makeRequest(url, method = 'GET', data = null) {
         showAlert('發生錯誤，請重試', 'danger');
     });
 }
+
+// Apply several cart changes in one request.
+// operations: [{op: 'add'|'set'|'remove', product_id: 1, quantity: 2}, ...]
+function updateCart(operations) {
+    return makeRequest('/cart/batch', 'POST', { operations: operations })
+        .then(result => {
+            if (result && !result.success) {
+                showAlert(result.message, 'danger');
+            }
+            return result;
+        });
+}
+
+// Poll a queued checkout until it finishes, then follow its redirect.
+function pollCheckout(statusUrl, interval = 1000) {
+    makeRequest(statusUrl).then(result => {
+        if (result && result.redirect_url) {
+            window.location.href = result.redirect_url;
+        } else if (result && !result.success) {
+            showAlert(result.message, 'danger');
+        } else {
+            setTimeout(() => pollCheckout(statusUrl, interval), interval);
+        }
+    });
+}
@@ -0,0 +1,157 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+from flask import current_app, url_for, send_from_directory, request, abort
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+
+# Static files that go through the pipeline (relative to the static folder)
+ASSET_FILES = ['css/style.css', 'js/main.js']
+
+# Precompressed variants in order of preference: (Accept-Encoding token, file suffix)
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+_manifest_cache = {}
+
+def minify_css(source):
+    """Strip comments and collapse whitespace in a stylesheet"""
+    source = re.sub(r'/\*.*?\*/', '', source, flags=re.S)
+    source = re.sub(r'\s+', ' ', source)
+    source = re.sub(r'\s*([{};,>])\s*', r'\1', source)
+    source = source.replace(';}', '}')
+    return source.strip()
+
+def minify_js(source):
+    """Conservative JS minification: drop comment-only lines and indentation.
+
+    Only comments that open and close on the same line are dropped, and inline
+    code is never rewritten, so string literals and regexes are safe.
+    """
+    source = re.sub(r'^[ \t]*/\*(?:[^*\n]|\*(?!/))*\*/[ \t]*$', '', source, flags=re.M)
+    lines = []
+    for line in source.splitlines():
+        stripped = line.strip()
+        if not stripped or stripped.startswith('//'):
+            continue
+        lines.append(stripped)
+    return '\n'.join(lines)
+
+MINIFIERS = {'.css': minify_css, '.js': minify_js}
+
+def get_output_folder():
+    """Folder where fingerprinted assets are written"""
+    return os.path.join(current_app.static_folder, current_app.config['ASSET_OUTPUT_DIR'])
+
+def get_manifest_path():
+    """Path of the asset manifest (source filename -> fingerprinted filename)"""
+    return os.path.join(get_output_folder(), 'manifest.json')
+
+def build_assets(files=None):
+    """Hash, minify and precompress static files, then write the manifest.
+
+    Returns the manifest dict.
+    """
+    static_folder = current_app.static_folder
+    output_folder = get_output_folder()
+    manifest = {}
+
+    for filename in files or ASSET_FILES:
+        source_path = os.path.join(static_folder, filename)
+        with open(source_path, 'r', encoding='utf-8') as f:
+            source = f.read()
+
+        base, ext = os.path.splitext(filename)
+        minifier = MINIFIERS.get(ext)
+        data = (minifier(source) if minifier else source).encode('utf-8')
+
+        digest = hashlib.sha256(data).hexdigest()[:12]
+        hashed_name = f"{base}.{digest}{ext}"
+        target_path = os.path.join(output_folder, hashed_name)
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+
+        with open(target_path, 'wb') as f:
+            f.write(data)
+        with open(target_path + '.gz', 'wb') as f:
+            f.write(gzip.compress(data, compresslevel=9, mtime=0))
+        if BROTLI_AVAILABLE:
+            with open(target_path + '.br', 'wb') as f:
+                f.write(brotli.compress(data, quality=11))
+
+        manifest[filename] = hashed_name
+
+    with open(get_manifest_path(), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    _manifest_cache.clear()
+    return manifest
+
+def load_manifest():
+    """Load the asset manifest once per process (reloaded on mtime change in debug)"""
+    path = get_manifest_path()
+    try:
+        mtime = os.path.getmtime(path) if current_app.debug else None
+    except OSError:
+        return {}
+
+    cached = _manifest_cache.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+    _manifest_cache[path] = (mtime, manifest)
+    return manifest
+
+def asset_url_for(endpoint, **values):
+    """Drop-in replacement for url_for that emits fingerprinted static URLs.
+
+    Falls back to the regular static URL when the asset has not been built.
+    """
+    if endpoint == 'static':
+        hashed_name = load_manifest().get(values.get('filename'))
+        if hashed_name:
+            values['filename'] = hashed_name
+            return url_for('assets', **values)
+    return url_for(endpoint, **values)
+
+def serve_asset(filename):
+    """Serve a fingerprinted asset, preferring a precompressed variant"""
+    output_folder = get_output_folder()
+    file_path = safe_join(output_folder, filename)
+    if file_path is None or not os.path.isfile(file_path):
+        abort(404)
+
+    accepted = request.accept_encodings
+    for token, suffix in ENCODINGS:
+        if accepted[token] and os.path.isfile(file_path + suffix):
+            response = send_from_directory(output_folder, filename + suffix,
+                                           mimetype=_guess_mimetype(filename))
+            response.headers['Content-Encoding'] = token
+            break
+    else:
+        response = send_from_directory(output_folder, filename)
+
+    max_age = current_app.config['ASSET_MAX_AGE']
+    response.headers['Cache-Control'] = f'public, max-age={max_age}, immutable'
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+def _guess_mimetype(filename):
+    return mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+def init_assets(app):
+    """Register the fingerprinted asset route and template helper"""
+    app.add_url_rule(f"{app.static_url_path}/{app.config['ASSET_OUTPUT_DIR']}/<path:filename>",
+                     endpoint='assets', view_func=serve_asset)
+    app.jinja_env.globals['asset_url_for'] = asset_url_for
@@ -21,30 +21,43 @@ def admin_login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def load_owned_stores(member_id):
+    """Cache the member's store ids and their stores_version in the session"""
+    from app.models.store import Store
+    store_ids, version = Store.get_owned_ids(member_id)
+    session['store_ids'] = store_ids
+    session['stores_version'] = version
+
 def store_owner_required(f):
-    """Decorator to require store ownership"""
+    """Decorator to require store ownership; passes the loaded store to the view as `store`
+    
+    Store ids outside the session's ownership set are rejected after at most
+    a reload of the set. Owned stores are loaded together with the member's
+    stores_version, and a version other than the session's (a store created,
+    transferred or deleted since login) reloads the set.
+    """
     @wraps(f)
     def decorated_function(*args, **kwargs):
         if 'member_id' not in session:
             flash('請先登入會員', 'warning')
             return redirect(url_for('member.login'))
         
-        # Check if user owns the store
         store_id = kwargs.get('store_id')
         if store_id:
-            from app.utils.db import get_db_connection
-            conn = get_db_connection()
-            try:
-                with conn.cursor() as cursor:
-                    cursor.execute(
-                        "SELECT id FROM stores WHERE id = %s AND member_id = %s",
-                        (store_id, session['member_id'])
-                    )
-                    if not cursor.fetchone():
-                        flash('您沒有權限管理此商店', 'error')
-                        return redirect(url_for('store.my_stores'))
-            finally:
-                conn.close()
+            from app.models.store import Store
+            member_id = session['member_id']
+            if store_id not in session.get('store_ids', ()):
+                load_owned_stores(member_id)
+            
+            store = None
+            if store_id in session['store_ids']:
+                store, version = Store.get_owned(store_id, member_id)
+                if version != session['stores_version']:
+                    load_owned_stores(member_id)
+            if not store:
+                flash('您沒有權限管理此商店', 'error')
+                return redirect(url_for('member.my_stores'))
+            kwargs['store'] = store
         
         return f(*args, **kwargs)
     return decorated_function
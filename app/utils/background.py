@@ -0,0 +1,29 @@
+import threading
+
+_started_tasks = set()
+_started_lock = threading.Lock()
+
+def start_periodic_task(app, name, interval, task):
+    """Run task() every interval seconds in a daemon thread with an app context
+    
+    Each task name is started at most once per process. Errors are logged and
+    the loop keeps running.
+    """
+    with _started_lock:
+        if name in _started_tasks:
+            return None
+        _started_tasks.add(name)
+    
+    stop_event = threading.Event()
+    
+    def run():
+        while not stop_event.wait(interval):
+            with app.app_context():
+                try:
+                    task()
+                except Exception as e:
+                    app.logger.warning('Background task %s failed: %s', name, e)
+    
+    thread = threading.Thread(target=run, name=f"bg-{name}", daemon=True)
+    thread.start()
+    return stop_event
@@ -1,6 +1,11 @@
+import random
+import time
 import pymysql
 from flask import current_app
 
+# MySQL error codes worth retrying: deadlock, lock wait timeout
+RETRYABLE_ERRORS = (1213, 1205)
+
 def get_db_connection():
     """Get database connection"""
     return pymysql.connect(
@@ -12,6 +17,51 @@ def get_db_connection():
         cursorclass=pymysql.cursors.DictCursor
     )
 
+def run_in_transaction(work, max_attempts=None):
+    """Run work(cursor) in a single transaction and commit it
+    
+    Deadlocks and lock wait timeouts roll back and retry the whole unit of work
+    with jittered exponential backoff, so work must be safe to re-run.
+    """
+    max_attempts = max_attempts or current_app.config['DB_TX_MAX_ATTEMPTS']
+    backoff = current_app.config['DB_TX_RETRY_BACKOFF']
+    for attempt in range(1, max_attempts + 1):
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cursor:
+                result = work(cursor)
+            conn.commit()
+            return result
+        except pymysql.err.MySQLError as e:
+            conn.rollback()
+            if not e.args or e.args[0] not in RETRYABLE_ERRORS or attempt == max_attempts:
+                raise
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        time.sleep(backoff * (2 ** (attempt - 1)) * random.uniform(0.5, 1.5))
+
+def ensure_column(cursor, table, column, definition):
+    """Add a column to an existing table if it is missing (lightweight migration)"""
+    cursor.execute("""
+        SELECT COUNT(*) as count FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s
+    """, (table, column))
+    if cursor.fetchone()['count'] == 0:
+        cursor.execute(f"ALTER TABLE `{table}` ADD COLUMN `{column}` {definition}")
+
+def ensure_index(cursor, table, index, definition, unique=False):
+    """Create an index on an existing table if it is missing"""
+    cursor.execute("""
+        SELECT COUNT(*) as count FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s
+    """, (table, index))
+    if cursor.fetchone()['count'] == 0:
+        kind = 'UNIQUE INDEX' if unique else 'INDEX'
+        cursor.execute(f"ALTER TABLE `{table}` ADD {kind} `{index}` {definition}")
+
 def init_db(app):
     """Initialize database tables"""
     with app.app_context():
@@ -124,6 +174,183 @@ def init_db(app):
                     UNIQUE KEY unique_cart_item (member_id, product_id)
                 );
                 
+                CREATE TABLE IF NOT EXISTS stock_reservations (
+                    id INT AUTO_INCREMENT PRIMARY KEY,
+                    member_id INT NOT NULL,
+                    product_id INT NOT NULL,
+                    quantity INT NOT NULL,
+                    expires_at DATETIME NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (member_id) REFERENCES members(id) ON DELETE CASCADE,
+                    FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE CASCADE,
+                    UNIQUE KEY unique_reservation (member_id, product_id),
+                    KEY idx_reservation_product_expiry (product_id, expires_at, quantity),
+                    KEY idx_reservation_expiry (expires_at)
+                );
+                
+                CREATE TABLE IF NOT EXISTS coupon_redemptions (
+                    id INT AUTO_INCREMENT PRIMARY KEY,
+                    coupon_id INT NOT NULL,
+                    member_id INT NOT NULL,
+                    order_id INT NOT NULL,
+                    redeemed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (coupon_id) REFERENCES coupons(id) ON DELETE CASCADE,
+                    FOREIGN KEY (member_id) REFERENCES members(id) ON DELETE CASCADE,
+                    FOREIGN KEY (order_id) REFERENCES orders(id) ON DELETE CASCADE,
+                    UNIQUE KEY unique_coupon_order (coupon_id, order_id),
+                    KEY idx_redemption_member (coupon_id, member_id)
+                );
+                
+                CREATE TABLE IF NOT EXISTS store_orders (
+                    store_id INT NOT NULL,
+                    order_id INT NOT NULL,
+                    created_at TIMESTAMP NOT NULL,
+                    store_subtotal DECIMAL(10,2) NOT NULL,
+                    PRIMARY KEY (store_id, order_id),
+                    KEY idx_store_orders_created (store_id, created_at),
+                    FOREIGN KEY (order_id) REFERENCES orders(id) ON DELETE CASCADE
+                );
+                
+                CREATE TABLE IF NOT EXISTS store_daily_stats (
+                    store_id INT NOT NULL,
+                    stat_date DATE NOT NULL,
+                    order_count INT NOT NULL DEFAULT 0,
+                    units INT NOT NULL DEFAULT 0,
+                    gross_amount DECIMAL(12,2) NOT NULL DEFAULT 0,
+                    discount_amount DECIMAL(12,2) NOT NULL DEFAULT 0,
+                    net_amount DECIMAL(12,2) NOT NULL DEFAULT 0,
+                    cancelled_count INT NOT NULL DEFAULT 0,
+                    cancelled_amount DECIMAL(12,2) NOT NULL DEFAULT 0,
+                    PRIMARY KEY (store_id, stat_date)
+                );
+                
+                CREATE TABLE IF NOT EXISTS order_events (
+                    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+                    order_id INT NOT NULL,
+                    from_status VARCHAR(20) NOT NULL,
+                    to_status VARCHAR(20) NOT NULL,
+                    actor_type VARCHAR(20) DEFAULT NULL,
+                    actor_id INT DEFAULT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    KEY idx_order_events_order (order_id, id),
+                    FOREIGN KEY (order_id) REFERENCES orders(id) ON DELETE CASCADE
+                );
+                
+                CREATE TABLE IF NOT EXISTS orders_archive (
+                    id INT PRIMARY KEY,
+                    member_id INT NOT NULL,
+                    order_number VARCHAR(50) NOT NULL,
+                    total_amount DECIMAL(10,2) NOT NULL,
+                    discount_amount DECIMAL(10,2) DEFAULT 0,
+                    final_amount DECIMAL(10,2) NOT NULL,
+                    coupon_id INT DEFAULT NULL,
+                    status ENUM('pending', 'confirmed', 'shipped', 'delivered', 'cancelled') NOT NULL,
+                    created_at TIMESTAMP NULL DEFAULT NULL,
+                    archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    UNIQUE KEY unique_archive_order_number (order_number),
+                    KEY idx_orders_archive_member (member_id, created_at),
+                    KEY idx_orders_archive_created (created_at)
+                );
+                
+                CREATE TABLE IF NOT EXISTS order_items_archive (
+                    id INT PRIMARY KEY,
+                    order_id INT NOT NULL,
+                    product_id INT NOT NULL,
+                    store_id INT DEFAULT NULL,
+                    product_name VARCHAR(255) DEFAULT NULL,
+                    quantity INT NOT NULL,
+                    price DECIMAL(10,2) NOT NULL,
+                    subtotal DECIMAL(10,2) NOT NULL,
+                    KEY idx_order_items_archive_order (order_id)
+                );
+                
+                CREATE TABLE IF NOT EXISTS store_orders_archive (
+                    store_id INT NOT NULL,
+                    order_id INT NOT NULL,
+                    created_at TIMESTAMP NOT NULL,
+                    store_subtotal DECIMAL(10,2) NOT NULL,
+                    store_discount DECIMAL(10,2) NOT NULL DEFAULT 0,
+                    units INT NOT NULL DEFAULT 0,
+                    PRIMARY KEY (store_id, order_id),
+                    KEY idx_store_orders_archive_created (store_id, created_at)
+                );
+                
+                CREATE TABLE IF NOT EXISTS order_events_archive (
+                    id BIGINT PRIMARY KEY,
+                    order_id INT NOT NULL,
+                    from_status VARCHAR(20) NOT NULL,
+                    to_status VARCHAR(20) NOT NULL,
+                    actor_type VARCHAR(20) DEFAULT NULL,
+                    actor_id INT DEFAULT NULL,
+                    created_at TIMESTAMP NULL DEFAULT NULL,
+                    KEY idx_order_events_archive_order (order_id, id)
+                );
+                
+                CREATE TABLE IF NOT EXISTS coupon_redemptions_archive (
+                    id INT PRIMARY KEY,
+                    coupon_id INT NOT NULL,
+                    member_id INT NOT NULL,
+                    order_id INT NOT NULL,
+                    redeemed_at TIMESTAMP NULL DEFAULT NULL,
+                    KEY idx_redemption_archive_member (coupon_id, member_id)
+                );
+                
+                CREATE TABLE IF NOT EXISTS checkout_jobs (
+                    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+                    member_id INT NOT NULL,
+                    coupon_code VARCHAR(50) DEFAULT NULL,
+                    status ENUM('queued', 'processing', 'done', 'failed') NOT NULL DEFAULT 'queued',
+                    order_id INT DEFAULT NULL,
+                    error VARCHAR(255) DEFAULT NULL,
+                    claim_token CHAR(32) DEFAULT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                    KEY idx_checkout_jobs_status (status, id),
+                    KEY idx_checkout_jobs_member (member_id, status),
+                    KEY idx_checkout_jobs_claim (claim_token),
+                    FOREIGN KEY (member_id) REFERENCES members(id) ON DELETE CASCADE
+                );
+                
+                CREATE TABLE IF NOT EXISTS order_claims (
+                    member_id INT NOT NULL,
+                    idempotency_key CHAR(32) NOT NULL,
+                    claimed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (member_id, idempotency_key)
+                );
+                
+                CREATE TABLE IF NOT EXISTS outbox_events (
+                    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+                    topic VARCHAR(50) NOT NULL,
+                    entity_id BIGINT NOT NULL,
+                    payload TEXT DEFAULT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    KEY idx_outbox_events_created (created_at)
+                );
+                
+                CREATE TABLE IF NOT EXISTS site_stat_shards (
+                    stat_key VARCHAR(32) NOT NULL,
+                    shard TINYINT UNSIGNED NOT NULL,
+                    value DECIMAL(14,2) NOT NULL DEFAULT 0,
+                    PRIMARY KEY (stat_key, shard)
+                );
+                
+                CREATE TABLE IF NOT EXISTS coupon_counter_shards (
+                    coupon_id INT NOT NULL,
+                    shard TINYINT UNSIGNED NOT NULL,
+                    quota INT DEFAULT NULL,
+                    used_count INT NOT NULL DEFAULT 0,
+                    PRIMARY KEY (coupon_id, shard),
+                    FOREIGN KEY (coupon_id) REFERENCES coupons(id) ON DELETE CASCADE
+                );
+                
+                CREATE TABLE IF NOT EXISTS coupon_codes (
+                    code VARCHAR(32) NOT NULL PRIMARY KEY,
+                    coupon_id INT NOT NULL,
+                    used_at TIMESTAMP NULL DEFAULT NULL,
+                    KEY idx_coupon_codes_coupon (coupon_id, code),
+                    FOREIGN KEY (coupon_id) REFERENCES coupons(id) ON DELETE CASCADE
+                );
+                
                 # Insert default categories
                 INSERT IGNORE INTO categories (name, description) VALUES
                 ('3C', '電腦、手機、平板等電子產品'),
@@ -152,6 +379,26 @@ def init_db(app):
                         cursor.execute(statement)
                 conn.commit()
                 
+                # Columns added after the initial schema
+                ensure_column(cursor, 'coupons', 'counter_shards', 'TINYINT UNSIGNED NOT NULL DEFAULT 0')
+                ensure_column(cursor, 'coupons', 'is_campaign', 'TINYINT(1) NOT NULL DEFAULT 0')
+                ensure_column(cursor, 'members', 'stores_version', 'INT NOT NULL DEFAULT 0')
+                ensure_column(cursor, 'order_items', 'store_id', 'INT DEFAULT NULL')
+                ensure_column(cursor, 'order_items', 'product_name', 'VARCHAR(255) DEFAULT NULL')
+                ensure_index(cursor, 'order_items', 'idx_order_items_store', '(store_id, order_id)')
+                ensure_column(cursor, 'store_orders', 'store_discount', 'DECIMAL(10,2) NOT NULL DEFAULT 0')
+                ensure_column(cursor, 'store_orders', 'units', 'INT NOT NULL DEFAULT 0')
+                ensure_index(cursor, 'products', 'idx_products_store_status', '(store_id, status, created_at)')
+                ensure_index(cursor, 'orders', 'idx_orders_created', '(created_at)')
+                ensure_column(cursor, 'orders', 'idempotency_key', 'CHAR(32) DEFAULT NULL')
+                ensure_index(cursor, 'orders', 'unique_order_idempotency', '(member_id, idempotency_key)', unique=True)
+                cursor.execute("UPDATE coupons SET applicable_id = NULL WHERE applicable_to = 'all' AND applicable_id IS NOT NULL")
+                ensure_index(cursor, 'coupons', 'idx_coupons_applicable', '(applicable_to, applicable_id, valid_to)')
+                ensure_column(cursor, 'checkout_jobs', 'idempotency_key', 'CHAR(32) DEFAULT NULL')
+                ensure_index(cursor, 'checkout_jobs', 'unique_checkout_idempotency',
+                             '(member_id, idempotency_key)', unique=True)
+                conn.commit()
+                
                 # Insert default admin user (password: admin)
                 from werkzeug.security import generate_password_hash
                 admin_password_hash = generate_password_hash('admin')
@@ -1,13 +1,41 @@
 from datetime import datetime
+from decimal import Decimal, ROUND_HALF_UP
 import os
+import socket
+import threading
+import time
+import uuid
+import zlib
 from werkzeug.utils import secure_filename
 
 try:
     from PIL import Image
+    from PIL.Image import DecompressionBombError
     PIL_AVAILABLE = True
 except ImportError:
     PIL_AVAILABLE = False
 
+    class DecompressionBombError(Exception):
+        pass
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+_decode_semaphore = None
+_decode_semaphore_lock = threading.Lock()
+
+CENT = Decimal('0.01')
+
+def to_money(value):
+    """Convert a price (Decimal, float, int or str) to Decimal rounded to cents"""
+    if value is None:
+        return Decimal('0.00')
+    if not isinstance(value, Decimal):
+        value = Decimal(str(value))
+    return value.quantize(CENT, rounding=ROUND_HALF_UP)
+
 def format_price(price):
     """Format price with currency symbol"""
     return f"${price:,.0f}"
@@ -24,8 +52,82 @@ def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in current_app.config['ALLOWED_EXTENSIONS']
 
+def _get_decode_semaphore():
+    """Per-process semaphore that caps concurrent image decodes"""
+    global _decode_semaphore
+    if _decode_semaphore is None:
+        from flask import current_app
+        with _decode_semaphore_lock:
+            if _decode_semaphore is None:
+                _decode_semaphore = threading.BoundedSemaphore(
+                    current_app.config['IMAGE_MAX_CONCURRENT_DECODES']
+                )
+    return _decode_semaphore
+
+def _image_nbytes(img):
+    """Approximate size of a decoded image buffer"""
+    return img.width * img.height * len(img.getbands())
+
+def _max_rss_mb():
+    """Worker resident-set high-water mark in MB (None where unsupported)"""
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def _decode_bounded(img, max_dimension):
+    """Decode an opened image at the smallest scale covering max_dimension.
+
+    Returns (RGB image, estimated peak decoded bytes).
+    """
+    # Final size: fit the longest side into max_dimension, keeping aspect ratio
+    scale = min(1.0, max_dimension / max(img.size))
+    target = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+    
+    # Handle animated GIFs - take first frame
+    if hasattr(img, 'is_animated') and img.is_animated:
+        img.seek(0)
+    
+    # JPEG can decode directly at 1/2, 1/4 or 1/8 scale
+    if img.format == 'JPEG':
+        img.draft('RGB', target)
+    img.load()
+    peak = _image_nbytes(img)
+    
+    # Palette images cannot be reduced; expand them first
+    if img.mode == 'P':
+        img = img.convert('RGBA' if 'transparency' in img.info else 'RGB')
+        peak = max(peak, _image_nbytes(img))
+    elif img.mode not in ('RGB', 'RGBA', 'LA', 'L'):
+        img = img.convert('RGB')
+        peak = max(peak, _image_nbytes(img))
+    
+    # Cheap integer box reduction, then a precise resample to the target
+    factor = min(img.width // target[0], img.height // target[1])
+    if factor >= 2:
+        img = img.reduce(factor)
+    if img.width > target[0] or img.height > target[1]:
+        img.thumbnail(target, Image.LANCZOS)
+    
+    # Flatten transparency onto a white canvas at the reduced size
+    if img.mode in ('RGBA', 'LA'):
+        if img.mode == 'LA':
+            img = img.convert('RGBA')
+        rgb_img = Image.new('RGB', img.size, (255, 255, 255))
+        rgb_img.paste(img, mask=img.split()[-1])
+        img = rgb_img
+    elif img.mode != 'RGB':
+        img = img.convert('RGB')
+    
+    return img, peak
+
 def save_product_image(file, product_id):
-    """Save uploaded product image and convert to WebP format"""
+    """Save uploaded product image and convert to WebP format
+    
+    The header is inspected before decoding: images above IMAGE_MAX_PIXELS
+    (IMAGE_MAX_FULL_DECODE_PIXELS for formats other than JPEG, which cannot
+    decode at a reduced scale) are rejected and larger ones are downscaled to
+    IMAGE_MAX_DIMENSION.
+    """
     if file and allowed_file(file.filename):
         from flask import current_app
         upload_folder = current_app.config['UPLOAD_FOLDER']
@@ -36,14 +138,7 @@ def save_product_image(file, product_id):
         # Generate filename with product_id
         name = secure_filename(file.filename)
         name_without_ext = os.path.splitext(name)[0]
-        file_ext = os.path.splitext(name)[1].lower()
-        
-        # If already WebP, keep it as WebP; otherwise convert to WebP
-        if file_ext == '.webp':
-            filename = f"product_{product_id}_{name_without_ext}.webp"
-        else:
-            filename = f"product_{product_id}_{name_without_ext}.webp"
-        
+        filename = f"product_{product_id}_{name_without_ext}.webp"
         file_path = os.path.join(upload_folder, filename)
         
         try:
@@ -51,40 +146,38 @@ def save_product_image(file, product_id):
             if PIL_AVAILABLE:
                 # Reset file pointer to beginning
                 file.seek(0)
+                # Image.open only parses the header; pixels are not decoded yet
                 img = Image.open(file.stream)
+                width, height = img.size
+                max_pixels = current_app.config['IMAGE_MAX_PIXELS']
+                if img.format != 'JPEG':
+                    # PNG, GIF, WebP... are fully decoded before reduce()
+                    max_pixels = min(max_pixels, current_app.config['IMAGE_MAX_FULL_DECODE_PIXELS'])
+                if width * height > max_pixels:
+                    current_app.logger.warning(
+                        'Rejected product image %s: %s %dx%d exceeds %d pixels',
+                        name, img.format, width, height, max_pixels
+                    )
+                    return None
                 
-                # If already WebP and same format, we can optimize it
-                if file_ext == '.webp' and img.format == 'WEBP':
-                    # Re-optimize existing WebP
-                    img.save(file_path, 'WEBP', quality=85, optimize=True)
-                else:
-                    # Handle animated GIFs - take first frame
-                    if hasattr(img, 'is_animated') and img.is_animated:
-                        img.seek(0)  # Get first frame
-                    
-                    # Convert to RGB if needed (WebP supports RGBA, but we'll use RGB for consistency)
-                    if img.mode in ('RGBA', 'LA'):
-                        # Create a white background for transparency
-                        rgb_img = Image.new('RGB', img.size, (255, 255, 255))
-                        if img.mode == 'LA':
-                            img = img.convert('RGBA')
-                        rgb_img.paste(img, mask=img.split()[-1])
-                        img = rgb_img
-                    elif img.mode == 'P':
-                        # Palette mode (like some GIFs)
-                        if 'transparency' in img.info:
-                            img = img.convert('RGBA')
-                            rgb_img = Image.new('RGB', img.size, (255, 255, 255))
-                            rgb_img.paste(img, mask=img.split()[-1])
-                            img = rgb_img
-                        else:
-                            img = img.convert('RGB')
-                    elif img.mode != 'RGB':
-                        img = img.convert('RGB')
-                    
-                    # Save as WebP with quality optimization
+                semaphore = _get_decode_semaphore()
+                if not semaphore.acquire(timeout=current_app.config['IMAGE_DECODE_TIMEOUT']):
+                    current_app.logger.warning('Image decode queue full, rejected %s', name)
+                    return None
+                try:
+                    rss_before = _max_rss_mb()
+                    img, peak = _decode_bounded(img, current_app.config['IMAGE_MAX_DIMENSION'])
                     img.save(file_path, 'WEBP', quality=85, optimize=True)
+                    rss_after = _max_rss_mb()
+                finally:
+                    semaphore.release()
                 
+                current_app.logger.info(
+                    'Saved product image %s: source %dx%d, stored %dx%d, decoded peak ~%.1f MB, worker maxrss %s MB (+%s)',
+                    filename, width, height, img.width, img.height, peak / (1024 * 1024),
+                    f"{rss_after:.0f}" if rss_after is not None else 'n/a',
+                    f"{rss_after - rss_before:.0f}" if rss_after is not None else 'n/a'
+                )
                 return f"images/products/{filename}"
             else:
                 # Fallback: save original file if Pillow is not available
@@ -94,6 +187,10 @@ def save_product_image(file, product_id):
                 file_path = os.path.join(upload_folder, filename)
                 file.save(file_path)
                 return f"images/products/{filename}"
+        except DecompressionBombError as e:
+            # Never fall back to storing the original of a decompression bomb
+            current_app.logger.warning('Rejected product image %s: %s', name, e)
+            return None
         except Exception as e:
             # If conversion fails, try to save original file
             try:
@@ -137,13 +234,86 @@ def delete_product_image(image_url):
         # Silently fail if deletion fails
         return False
 
+class OrderNumberGenerator:
+    """Snowflake-style order numbers, unique across processes and hosts without a DB
+    
+    Bit layout (83 bits): milliseconds since ORDER_EPOCH_MS (41) | host id (8)
+    | pid (22) | per-process sequence (12). Rendered as "ORD" + 17 fixed-width
+    base-36 digits, so numbers sort lexicographically in creation order.
+    Live processes on a host never share a pid, and each process is strictly
+    monotonic, so numbers cannot collide between gunicorn workers.
+    """
+    ORDER_EPOCH_MS = 1704067200000  # 2024-01-01T00:00:00Z
+    HOST_BITS = 8
+    PID_BITS = 22
+    SEQUENCE_BITS = 12
+    WIDTH = 17
+    ALPHABET = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+    
+    def __init__(self, host_id=None):
+        if host_id is None:
+            host_id = zlib.crc32(socket.gethostname().encode('utf-8'))
+        self.host_id = host_id & ((1 << self.HOST_BITS) - 1)
+        self._lock = threading.Lock()
+        self._pid = None
+        self._last_ms = -1
+        self._sequence = 0
+    
+    def next_id(self):
+        """Next 83-bit id for this process"""
+        with self._lock:
+            pid = os.getpid()
+            if pid != self._pid:
+                # Forked (e.g. gunicorn --preload): new worker id, fresh sequence
+                self._pid = pid
+                self._last_ms = -1
+                self._sequence = 0
+            
+            now_ms = int(time.time() * 1000) - self.ORDER_EPOCH_MS
+            if now_ms > self._last_ms:
+                self._last_ms = now_ms
+                self._sequence = 0
+            else:
+                # Same millisecond, or the clock stepped back: keep counting
+                # from the last timestamp so ids stay monotonic
+                self._sequence += 1
+                if self._sequence >> self.SEQUENCE_BITS:
+                    self._last_ms += 1
+                    self._sequence = 0
+            
+            worker = (self.host_id << self.PID_BITS) | (pid & ((1 << self.PID_BITS) - 1))
+            return (((self._last_ms << (self.HOST_BITS + self.PID_BITS)) | worker)
+                    << self.SEQUENCE_BITS) | self._sequence
+    
+    def next_number(self):
+        """Next order number string"""
+        value = self.next_id()
+        digits = []
+        for _ in range(self.WIDTH):
+            value, remainder = divmod(value, 36)
+            digits.append(self.ALPHABET[remainder])
+        return 'ORD' + ''.join(reversed(digits))
+
+def new_idempotency_key():
+    """Random key embedded in a form so its submission is processed once"""
+    return uuid.uuid4().hex
+
+def clean_idempotency_key(value):
+    """Return value if it is a well-formed idempotency key, else None"""
+    value = (value or '').strip().lower()
+    if len(value) == 32 and all(c in '0123456789abcdef' for c in value):
+        return value
+    return None
+
+_order_number_generator = None
+
 def generate_order_number():
     """Generate unique order number"""
-    import random
-    import string
-    timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-    random_str = ''.join(random.choices(string.ascii_uppercase + string.digits, k=4))
-    return f"ORD{timestamp}{random_str}"
+    global _order_number_generator
+    if _order_number_generator is None:
+        from flask import current_app
+        _order_number_generator = OrderNumberGenerator(current_app.config.get('ORDER_HOST_ID'))
+    return _order_number_generator.next_number()
 
 def calculate_discount(price, discount_type, discount_value, max_discount=None):
     """Calculate discount amount"""
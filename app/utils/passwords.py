@@ -0,0 +1,55 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from werkzeug.security import generate_password_hash, check_password_hash
+
+class HashingBusyError(Exception):
+    """Raised instead of queueing when the hashing executor is full"""
+
+    def __init__(self, message="系統忙碌中，請稍後再試"):
+        super().__init__(message)
+
+# One executor per process, created on first use from the app config
+_executor = {'pool': None, 'slots': None}
+_executor_lock = threading.Lock()
+
+def _submit(fn, *args):
+    """Run fn in the hashing executor and wait for it
+
+    At most PASSWORD_HASH_WORKERS hashes run at once (hashlib releases the
+    GIL while hashing) and at most PASSWORD_HASH_QUEUE more wait; beyond that
+    callers get HashingBusyError immediately instead of tying up their worker.
+    """
+    config = current_app.config
+    with _executor_lock:
+        if _executor['pool'] is None:
+            workers = config['PASSWORD_HASH_WORKERS']
+            _executor['pool'] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+            _executor['slots'] = threading.BoundedSemaphore(workers + config['PASSWORD_HASH_QUEUE'])
+    slots = _executor['slots']
+    if not slots.acquire(blocking=False):
+        raise HashingBusyError()
+    try:
+        future = _executor['pool'].submit(fn, *args)
+    except Exception:
+        slots.release()
+        raise
+    future.add_done_callback(lambda f: slots.release())
+    return future.result()
+
+def hash_password(password):
+    """Hash with the configured PASSWORD_HASH_METHOD (may raise HashingBusyError)"""
+    return _submit(generate_password_hash, password, current_app.config['PASSWORD_HASH_METHOD'])
+
+def verify_password(password_hash, password):
+    """Returns (matches, needs_rehash) (may raise HashingBusyError)
+
+    needs_rehash is True for a matching hash made with other parameters than
+    PASSWORD_HASH_METHOD, so callers can store a fresh hash while they still
+    have the plaintext.
+    """
+    if not password_hash:
+        return False, False
+    matches = _submit(check_password_hash, password_hash, password)
+    method = password_hash.split('$', 1)[0]
+    return matches, matches and method != current_app.config['PASSWORD_HASH_METHOD']
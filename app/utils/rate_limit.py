@@ -0,0 +1,58 @@
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+from werkzeug.utils import import_string
+
+class MemoryBucketStore:
+    """Token buckets kept in this process, least recently used dropped first
+
+    Any object with the same take() method can replace it (LOGIN_LIMIT_STORE),
+    e.g. one backed by Redis so limits are shared across processes.
+    """
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()  # key -> (tokens, updated_at)
+        self.lock = threading.Lock()
+
+    def take(self, key, capacity, refill_per_second, cost=1):
+        """Refill the bucket for elapsed time and take cost tokens; False when short"""
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated_at = self.buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated_at) * refill_per_second)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self.buckets[key] = (tokens, now)
+            self.buckets.move_to_end(key)
+            while len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+            return allowed
+
+_store = {'store': None}
+_store_lock = threading.Lock()
+
+def get_bucket_store():
+    """The configured bucket store (LOGIN_LIMIT_STORE import path, default in memory)"""
+    with _store_lock:
+        if _store['store'] is None:
+            store_path = current_app.config.get('LOGIN_LIMIT_STORE')
+            _store['store'] = import_string(store_path)() if store_path else MemoryBucketStore()
+        return _store['store']
+
+def login_allowed(scope, account, remote_addr):
+    """Take one token from the IP's and the account's login buckets
+
+    Called before any password hashing, so a credential-stuffing burst is
+    turned away without costing CPU. Both buckets are charged on every
+    attempt; either one being empty rejects it.
+    """
+    config = current_app.config
+    store = get_bucket_store()
+    ip_allowed = store.take(f"login:{scope}:ip:{remote_addr}", config['LOGIN_IP_BURST'],
+                            config['LOGIN_IP_PER_MINUTE'] / 60)
+    account_allowed = store.take(f"login:{scope}:account:{(account or '').lower()}", config['LOGIN_ACCOUNT_BURST'],
+                                 config['LOGIN_ACCOUNT_PER_MINUTE'] / 60)
+    return ip_allowed and account_allowed
@@ -0,0 +1,124 @@
+"""
+Stock reservation concurrency benchmark
+
+Hammers a single hot SKU from many threads through Inventory.reserve and
+checks that stock is never oversold. Uses the configured MySQL database and
+removes its fixture data afterwards.
+
+Usage:
+  python bench_inventory.py --threads 32 --stock 500 --attempts 40
+"""
+import argparse
+import threading
+import time
+import uuid
+from app import create_app
+from app.utils.db import get_db_connection, run_in_transaction
+from app.models.inventory import Inventory, InsufficientStockError
+
+def setup_fixture(stock):
+    """Create a throwaway member, active store and product with the given stock"""
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO members (email, password_hash, name) VALUES (%s, %s, %s)",
+                (f"bench-{uuid.uuid4().hex}@example.invalid", '!', 'bench')
+            )
+            member_id = cursor.lastrowid
+            cursor.execute(
+                "INSERT INTO stores (member_id, store_name, status) VALUES (%s, %s, 'active')",
+                (member_id, 'bench store')
+            )
+            store_id = cursor.lastrowid
+            cursor.execute("SELECT id FROM categories ORDER BY id LIMIT 1")
+            category_id = cursor.fetchone()['id']
+            cursor.execute(
+                "INSERT INTO products (store_id, category_id, name, price, stock) VALUES (%s, %s, %s, %s, %s)",
+                (store_id, category_id, 'bench hot sku', 1, stock)
+            )
+            product_id = cursor.lastrowid
+            conn.commit()
+            return member_id, product_id
+    finally:
+        conn.close()
+
+def teardown_fixture(member_id):
+    """Remove fixture rows (stores and products cascade from the member)"""
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("DELETE FROM members WHERE id = %s", (member_id,))
+            conn.commit()
+    finally:
+        conn.close()
+
+def get_stock(product_id):
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT stock FROM products WHERE id = %s", (product_id,))
+            return cursor.fetchone()['stock']
+    finally:
+        conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--stock', type=int, default=500)
+    parser.add_argument('--attempts', type=int, default=40, help='reservations attempted per thread')
+    parser.add_argument('--quantity', type=int, default=1, help='units per reservation')
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        member_id, product_id = setup_fixture(args.stock)
+
+    counters = {'reserved': 0, 'rejected': 0, 'errors': 0}
+    lock = threading.Lock()
+    start_gate = threading.Barrier(args.threads)
+
+    def worker():
+        with app.app_context():
+            start_gate.wait()
+            for _ in range(args.attempts):
+                try:
+                    run_in_transaction(lambda cursor: Inventory.reserve(cursor, [(product_id, args.quantity)]))
+                    outcome = 'reserved'
+                except InsufficientStockError:
+                    outcome = 'rejected'
+                except Exception:
+                    outcome = 'errors'
+                with lock:
+                    counters[outcome] += 1
+
+    threads = [threading.Thread(target=worker) for _ in range(args.threads)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    with app.app_context():
+        final_stock = get_stock(product_id)
+        teardown_fixture(member_id)
+
+    total = args.threads * args.attempts
+    expected_reserved = min(total, args.stock // args.quantity)
+    print(f"threads={args.threads} attempts={total} initial_stock={args.stock}")
+    print(f"elapsed={elapsed:.2f}s throughput={total / elapsed:.0f} attempts/s")
+    print(f"reserved={counters['reserved']} rejected={counters['rejected']} errors={counters['errors']}")
+    print(f"final_stock={final_stock}")
+
+    ok = (
+        final_stock >= 0
+        and counters['errors'] == 0
+        and counters['reserved'] == expected_reserved
+        and final_stock == args.stock - counters['reserved'] * args.quantity
+    )
+    print("OK" if ok else "FAILED: stock accounting mismatch")
+    raise SystemExit(0 if ok else 1)
+
+if __name__ == '__main__':
+    main()
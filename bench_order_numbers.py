@@ -0,0 +1,62 @@
+"""
+Order number uniqueness stress test
+
+Generates order numbers concurrently from many processes (and threads per
+process), like gunicorn workers would, and checks that every number is
+unique and that each process produced strictly increasing numbers.
+No database is needed.
+
+Usage:
+  python bench_order_numbers.py --processes 8 --threads 4 --count 50000
+"""
+import argparse
+import multiprocessing
+import threading
+import time
+from app.utils.helpers import OrderNumberGenerator
+
+def generate(args):
+    host_id, threads, count = args
+    generator = OrderNumberGenerator(host_id)
+    per_thread = [[] for _ in range(threads)]
+
+    def worker(out):
+        for _ in range(count // threads):
+            out.append(generator.next_number())
+
+    workers = [threading.Thread(target=worker, args=(out,)) for out in per_thread]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    return per_thread
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--processes', type=int, default=8)
+    parser.add_argument('--threads', type=int, default=4, help='threads per process')
+    parser.add_argument('--count', type=int, default=50000, help='numbers per process')
+    parser.add_argument('--host-id', type=int, default=1)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    with multiprocessing.Pool(args.processes) as pool:
+        results = pool.map(generate, [(args.host_id, args.threads, args.count)] * args.processes)
+    elapsed = time.perf_counter() - started
+
+    all_numbers = [number for per_thread in results for out in per_thread for number in out]
+    unique = len(set(all_numbers))
+    # Within a thread, numbers were taken in order and must strictly increase
+    ordered = all(out == sorted(set(out)) for per_thread in results for out in per_thread)
+    widths = {len(number) for number in all_numbers}
+
+    print(f"processes={args.processes} threads={args.threads} generated={len(all_numbers)}")
+    print(f"elapsed={elapsed:.2f}s rate={len(all_numbers) / elapsed:.0f}/s widths={sorted(widths)}")
+    print(f"unique={unique} duplicates={len(all_numbers) - unique} monotonic={ordered}")
+
+    ok = unique == len(all_numbers) and ordered and len(widths) == 1
+    print("OK" if ok else "FAILED")
+    raise SystemExit(0 if ok else 1)
+
+if __name__ == '__main__':
+    main()
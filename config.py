@@ -3,6 +3,8 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
 class Config:
     # Debug Configuration
     # Set to True by default for development, use FLASK_DEBUG env var to override
@@ -24,10 +26,112 @@ class Config:
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SQLALCHEMY_ECHO = DEBUG  # Print SQL queries in debug mode
     
+    # Transactions retried on deadlock / lock wait timeout
+    DB_TX_MAX_ATTEMPTS = 5
+    DB_TX_RETRY_BACKOFF = 0.02  # seconds, doubled per attempt
+    
     # Upload Configuration
     UPLOAD_FOLDER = 'app/static/images/products'
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
+    IMAGE_MAX_PIXELS = 50_000_000  # reject larger images before decoding
+    IMAGE_MAX_FULL_DECODE_PIXELS = 16_000_000  # limit for formats other than JPEG, which decode at full size
+    IMAGE_MAX_DIMENSION = 2048  # stored images are downscaled to fit this box
+    IMAGE_MAX_CONCURRENT_DECODES = 2  # per worker process
+    IMAGE_DECODE_TIMEOUT = 30  # seconds to wait for a decode slot
+    
+    # Static Asset Pipeline (run `flask assets build` to populate)
+    ASSET_OUTPUT_DIR = 'dist'
+    ASSET_MAX_AGE = 365 * 24 * 3600  # fingerprinted files never change
+    
+    # Order numbers: set a distinct 0-255 id per host when running several
+    # app servers (defaults to a hash of the hostname)
+    ORDER_HOST_ID = int(os.environ['ORDER_HOST_ID']) if os.environ.get('ORDER_HOST_ID') else None
+    
+    # Background maintenance threads, started in each serving process (set
+    # BACKGROUND_TASKS=false to run only the web handlers)
+    BACKGROUND_TASKS_ENABLED = os.environ.get('BACKGROUND_TASKS', 'true').lower() == 'true'
+    
+    # Checkout stock holds
+    STOCK_HOLD_TTL = 10 * 60  # seconds a checkout holds its stock
+    STOCK_HOLD_SWEEP_INTERVAL = 60  # seconds between expired-hold sweeps
+    STOCK_HOLD_SWEEP_BATCH = 500
+    STOCK_HOLD_SWEEPER_ENABLED = os.environ.get('STOCK_HOLD_SWEEPER', 'true').lower() == 'true'
+    
+    # Store dashboard sales chart
+    STORE_SALES_CHART_DAYS = 30
+    STORE_SALES_MAX_RANGE_DAYS = 366
+    
+    # Admin dashboard counters
+    ADMIN_STATS_SHARDS = 8  # counter rows per statistic, to spread write contention
+    ADMIN_STATS_TTL = 15  # seconds a worker reuses its snapshot
+    ADMIN_STATS_REFRESH_INTERVAL = 5 * 60  # seconds between exact recomputes
+    ADMIN_STATS_REFRESH_ENABLED = os.environ.get('ADMIN_STATS_REFRESH', 'true').lower() == 'true'
+    
+    # Order archival: closed (delivered/cancelled) orders older than this move
+    # to the *_archive tables
+    ORDER_ARCHIVE_AFTER_DAYS = 180
+    ORDER_ARCHIVE_BATCH = 500
+    ORDER_ARCHIVE_INTERVAL = 24 * 3600
+    ORDER_ARCHIVE_ENABLED = os.environ.get('ORDER_ARCHIVE', 'false').lower() == 'true'
+    ORDER_ARCHIVE_COUNT_TTL = 300  # seconds an archived row count is reused per listing
+    
+    # Idempotent checkout: a resubmission waits this long for the original
+    # request's order; claims older than the timeout belong to dead requests
+    ORDER_CLAIM_WAIT = 10  # seconds
+    ORDER_CLAIM_POLL_INTERVAL = 0.2
+    ORDER_CLAIM_TIMEOUT = 120  # seconds
+    
+    # Asynchronous checkout: orders are queued in checkout_jobs and created by
+    # CHECKOUT_WORKERS background threads per process
+    CHECKOUT_ASYNC_ENABLED = os.environ.get('CHECKOUT_ASYNC', 'false').lower() == 'true'
+    CHECKOUT_WORKERS = int(os.environ.get('CHECKOUT_WORKERS', 2))
+    CHECKOUT_BATCH = 20  # jobs claimed per round trip
+    CHECKOUT_POLL_INTERVAL = 0.5  # seconds between queue polls when idle
+    CHECKOUT_JOB_TIMEOUT = 120  # seconds before a claimed job is re-queued
+    
+    # Change feed: model writes record outbox_events in their transaction and
+    # each process delivers them to in-process subscribers
+    OUTBOX_DISPATCH_ENABLED = os.environ.get('OUTBOX_DISPATCH', 'true').lower() == 'true'
+    OUTBOX_POLL_INTERVAL = 1  # seconds between reads of new events
+    OUTBOX_BATCH = 500
+    OUTBOX_GAP_TIMEOUT = 60  # seconds to wait for ids of uncommitted transactions
+    OUTBOX_RETENTION = 24 * 3600  # seconds events are kept
+    OUTBOX_PRUNE_INTERVAL = 3600
+    
+    # Sales reports: order lines are copied into column files under
+    # ANALYTICS_DIR (run `flask analytics extract`, or in the background)
+    ANALYTICS_DIR = os.environ.get('ANALYTICS_DIR', os.path.join(BASE_DIR, 'data', 'analytics'))
+    ANALYTICS_EXTRACT_BATCH = 5000
+    ANALYTICS_EXTRACT_LAG = 60  # seconds; newer orders wait for the next run
+    ANALYTICS_EXTRACT_INTERVAL = 5 * 60
+    ANALYTICS_EXTRACT_ENABLED = os.environ.get('ANALYTICS_EXTRACT', 'true').lower() == 'true'
+    ANALYTICS_MAX_RANGE_DAYS = 3 * 366
+    ANALYTICS_MAX_ROWS = 2000  # report rows rendered or returned
+    
+    # Coupons cached per process by code (invalidated through the change feed)
+    COUPON_CACHE_SIZE = 1024
+    COUPON_CACHE_TTL = 60  # seconds
+    
+    # Generated single-use campaign codes
+    COUPON_CODE_LENGTH = 12  # 5 bits per character
+    COUPON_CODE_BATCH = 5000  # rows per INSERT IGNORE
+    
+    # Password hashing runs in a bounded per-process executor; logins beyond
+    # the queue are rejected instead of waiting
+    PASSWORD_HASH_METHOD = 'pbkdf2:sha256:600000'  # older hashes are upgraded at login
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+    PASSWORD_HASH_QUEUE = 8
+    
+    # Login token buckets, checked before hashing (per client IP and per account)
+    LOGIN_IP_BURST = 20
+    LOGIN_IP_PER_MINUTE = 10
+    LOGIN_ACCOUNT_BURST = 5
+    LOGIN_ACCOUNT_PER_MINUTE = 2
+    LOGIN_LIMIT_STORE = os.environ.get('LOGIN_LIMIT_STORE')  # import path of a shared bucket store class
+    
+    # Guest cart cookie lifetime
+    GUEST_CART_MAX_AGE = 30 * 24 * 3600
     
     # Pagination
     PRODUCTS_PER_PAGE = 12
@@ -0,0 +1,8 @@
+"""
+gunicorn settings, read automatically from the working directory.
+"""
+
+def post_fork(server, worker):
+    """Start the background tasks in each worker, not in the master"""
+    from app import start_background_tasks
+    start_background_tasks(worker.app.wsgi())
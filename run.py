@@ -1,8 +1,12 @@
-from app import create_app
+import os
+from app import create_app, start_background_tasks
 
 app = create_app()
 
 if __name__ == '__main__':
     # Use DEBUG from config, or default to True for development
     debug_mode = app.config.get('DEBUG', True)
+    # The debug reloader's parent only watches files; its child serves
+    if not debug_mode or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_tasks(app)
     app.run(debug=debug_mode, host='0.0.0.0', port=5000)
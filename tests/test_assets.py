@@ -0,0 +1,11 @@
+from app.utils.assets import minify_js
+
+def test_minify_js_keeps_code_after_inline_comment():
+    source = '/* a */ var x = 1;\nvar y = 2;\nvar z = "*/";\n/* ok */\n'
+    assert minify_js(source) == '/* a */ var x = 1;\nvar y = 2;\nvar z = "*/";'
+
+def test_minify_js_drops_comment_only_lines():
+    assert minify_js('  /* header */\n  // note\n  run();\n') == 'run();'
+
+def test_minify_js_keeps_code_between_comments_on_one_line():
+    assert minify_js('/* a */ run(); /* b */\n') == '/* a */ run(); /* b */'
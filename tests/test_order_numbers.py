@@ -0,0 +1,20 @@
+import multiprocessing
+from bench_order_numbers import generate
+
+def test_order_numbers_unique_across_processes():
+    with multiprocessing.Pool(4) as pool:
+        results = pool.map(generate, [(1, 1, 5000)] * 4)
+    per_process = [per_thread[0] for per_thread in results]
+    numbers = [number for out in per_process for number in out]
+    assert len(numbers) == 20000
+    assert len(set(numbers)) == len(numbers)
+    assert len({len(number) for number in numbers}) == 1
+    for out in per_process:
+        assert all(a < b for a, b in zip(out, out[1:]))
+
+def test_order_numbers_unique_across_threads():
+    per_thread = generate((1, 4, 8000))
+    numbers = [number for out in per_thread for number in out]
+    assert len(set(numbers)) == len(numbers) == 8000
+    for out in per_thread:
+        assert all(a < b for a, b in zip(out, out[1:]))
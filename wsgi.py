@@ -6,12 +6,18 @@ Usage examples:
   gunicorn -w 4 -b 0.0.0.0:8000 wsgi:app
   uwsgi --http :8000 --wsgi-file wsgi.py --callable app
   
+gunicorn reads gunicorn.conf.py from the working directory, which starts the
+background tasks in each worker. Other servers should call
+app.start_background_tasks(application) once per worker process (e.g. from
+uWSGI's postfork hook).
+
 For development with debug mode:
   python wsgi.py
   or set FLASK_DEBUG=true python wsgi.py
 """
 
-from app import create_app
+import os
+from app import create_app, start_background_tasks
 
 app = create_app()
 application = app
@@ -19,5 +25,8 @@ application = app
 if __name__ == "__main__":
     # Enable debug mode for development
     debug_mode = app.config.get('DEBUG', True)
+    # The debug reloader's parent only watches files; its child serves
+    if not debug_mode or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_tasks(app)
     app.run(debug=debug_mode, host='0.0.0.0', port=5000)
 